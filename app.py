@@ -3,16 +3,26 @@ import re
 import sys
 import random
 import glob
+import hmac
 import json
 import subprocess
+import time
 import zipfile
 import requests
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, session, g, abort, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, session, g, abort, jsonify, Response
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
+from classifier import FileClassifier, PathRules, parse_rules
 from db_handler import DBHandler
+from listing_backends import LIST_BACKENDS
 from logger import setup_logger
-from task_scheduler import add_tasks_to_cron, update_tasks_in_cron, delete_tasks_from_cron, list_tasks_in_cron, convert_to_cron_time, run_task_immediately
+from log_reader import LogReader, LogFilter, tail_lines, follow, parse_log_line, format_log_entry
+from invalid_manifest import DELETE_DONE, InvalidFileDeleter, list_summaries, load_summary, manifest_path, migrate_legacy_trees, read_manifest_page
+from job_queue import JobQueue, JOB_STATES
+from metrics import MetricsStore
+from refresh_planner import REFRESH_MODES
+from subpaths import parse_subpaths, format_subpaths, rootpath_relative
+from task_scheduler import add_tasks, update_tasks, delete_tasks, list_tasks, convert_to_cron_time, request_task_run, migrate_crontab
 
 
 app = Flask(__name__)
@@ -30,7 +40,6 @@ local_version = "6.0.6"
 
 
 
-CRON_BACKUP_FILE = "/config/cron.bak"
 ENV_FILE = "/config/app.env"
 
 
@@ -43,6 +52,9 @@ def check_user_config():
     # 跳过以下端点的检查
     if request.endpoint in ['login', 'register', 'static', 'random_image', 'forgot_password']:
         return
+    # /metrics 供 Prometheus 抓取，webhook 供上传工具等调用，均在视图函数中单独鉴权
+    if request.endpoint in ['metrics', 'webhook_sync']:
+        return
 
     # 确保 user_config 表中有用户名和密码
     username, password = db_handler.get_user_credentials()
@@ -113,35 +125,10 @@ def logout():
 @app.route('/')
 @login_required
 def index():
-    invalid_file_trees = []
-    invalid_tree_dir = 'invalid_file_trees'
-
-    if os.path.exists(invalid_tree_dir):
-        for json_file in os.listdir(invalid_tree_dir):
-            if json_file.endswith('.json'):
-                with open(os.path.join(invalid_tree_dir, json_file), 'r', encoding='utf-8') as file:
-                    invalid_file_trees.append({
-                        'name': json_file,  # 保留完整的文件名，包括 .json
-                        'structure': json.load(file)
-                    })
-
-    return render_template('home.html', invalid_file_trees=invalid_file_trees)
-
-@app.route('/view_invalid_directory/<path:directory_name>', methods=['GET'])
-def view_invalid_directory(directory_name):
-    try:
-        invalid_file_tree_path = os.path.join('invalid_file_trees', f'{directory_name}.json')
-        if not os.path.exists(invalid_file_tree_path):
-            return jsonify({"error": "未找到目录树"}), 404
-
-        with open(invalid_file_tree_path, 'r', encoding='utf-8') as file:
-            directory_structure = json.load(file)
-
-        # 将目录树返回给前端
-        return jsonify({"structure": json.dumps(directory_structure, ensure_ascii=False, indent=4)})
-    except Exception as e:
-        logger.error(f"查看目录树时出错: {e}")
-        return jsonify({"error": "查看目录树时出错"}), 500
+    # 已删除完的清单只保留摘要用于显示结果，不再计入
+    summaries = [summary for summary in invalid_file_summaries()
+                 if not summary['delete'] or summary['delete']['state'] != DELETE_DONE]
+    return render_template('home.html', invalid_summaries=summaries)
 
 def get_target_directory_by_config_id(config_id):
     """
@@ -152,97 +139,75 @@ def get_target_directory_by_config_id(config_id):
         return config['target_directory']
     return None
 
-@app.route('/delete_invalid_directory/<path:json_filename>', methods=['POST'])
-def delete_invalid_directory(json_filename):
+def invalid_file_summaries():
+    """
+    所有配置的失效文件清单摘要，只读取摘要文件。旧版本的目录树 JSON 在这里转换为清单。
+    """
     try:
-        # 确保文件名以 'invalid_file_trees_' 开头并以 '.json' 结尾
-        if not json_filename.startswith('invalid_file_trees_') or not json_filename.endswith('.json'):
-            return jsonify({"error": "无效的文件名"}), 400
-
-        # 从文件名中提取 config_id
-        config_id_str = json_filename.replace('invalid_file_trees_', '').replace('.json', '')
-        if not config_id_str.isdigit():
-            return jsonify({"error": "无效的配置 ID"}), 400
-
-        config_id = int(config_id_str)
-
-        # 从数据库中获取 target_directory
-        target_directory = get_target_directory_by_config_id(config_id)
-        if not target_directory:
-            return jsonify({"error": "未找到对应的配置"}), 404
-
-        # 构建 JSON 文件的路径
-        json_file_path = os.path.join('invalid_file_trees', json_filename)
-        if not os.path.exists(json_file_path):
-            return jsonify({"error": "未找到指定的 JSON 文件"}), 404
-
-        # 读取 JSON 文件，获取目录树
-        with open(json_file_path, 'r', encoding='utf-8') as file:
-            directory_tree = json.load(file)
-
-        # 遍历目录树，删除所有列出的 .strm 文件
-        def delete_strm_files(base_path, tree):
-            for name, content in tree.items():
-                current_path = os.path.join(base_path, name)
-                if isinstance(content, dict):
-                    # 如果是目录，递归遍历
-                    delete_strm_files(current_path, content)
-                    # 删除空目录
-                    if os.path.exists(current_path) and not os.listdir(current_path):
-                        os.rmdir(current_path)
-                        logger.info(f"删除空目录: {current_path}")
-                elif content == "invalid" and name.endswith('.strm'):
-                    # 删除文件
-                    if os.path.exists(current_path):
-                        os.remove(current_path)
-                        logger.info(f"删除文件: {current_path}")
-
-        # 开始删除
-        delete_strm_files(target_directory, directory_tree)
-
-        # 删除对应的失效目录树 JSON 文件
-        os.remove(json_file_path)
-        logger.info(f"删除失效目录树 JSON 文件: {json_file_path}")
-
-        flash('目录及其 .strm 文件已成功删除！', 'success')
-        return jsonify({"message": "目录和失效目录树已成功删除"}), 200
-
+        migrate_legacy_trees(target_directory_of=get_target_directory_by_config_id)
     except Exception as e:
-        logger.error(f"删除目录时出错: {e}")
-        return jsonify({"error": "删除目录时出错"}), 500
+        app.logger.error(f"转换旧版本的失效目录树时出错: {e}")
+    return list_summaries()
 
 @app.route('/invalid_file_trees')
 def invalid_file_trees():
-    invalid_file_trees = []
-    invalid_tree_dir = 'invalid_file_trees'
+    summaries = invalid_file_summaries()
+    for summary in summaries:
+        config = db_handler.get_webdav_config(summary['config_id'])
+        summary['config_name'] = config['config_name'] if config else ''
+        summary['created_text'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(summary['created_at']))
+    return render_template('invalid_file_trees.html', invalid_summaries=summaries)
+
+@app.route('/invalid_files/<int:config_id>', methods=['GET'])
+def get_invalid_files(config_id):
+    """
+    分页返回失效文件清单中的路径（相对于目标目录），offset / limit 参数指定范围。
+    """
+    summary = load_summary(config_id)
+    if not summary or not os.path.exists(manifest_path(config_id)):
+        return jsonify({"error": "未找到失效文件清单"}), 404
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 200)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "offset 和 limit 必须是整数"}), 400
 
-    if os.path.exists(invalid_tree_dir):
-        for json_file in os.listdir(invalid_tree_dir):
-            if json_file.endswith('.json'):
-                invalid_file_trees.append({
-                    'name': json_file,  # 保留完整的文件名，包括 .json
-                })
+    try:
+        files = read_manifest_page(config_id, offset, limit)
+    except Exception as e:
+        app.logger.error(f"读取失效文件清单时出错: {e}")
+        return jsonify({"error": "读取失效文件清单时出错"}), 500
+    next_offset = offset + len(files) if offset + len(files) < summary['count'] else None
+    return jsonify({"summary": summary, "files": files, "offset": offset, "next_offset": next_offset})
 
-    return render_template('invalid_file_trees.html', invalid_file_trees=invalid_file_trees)
+@app.route('/invalid_files/<int:config_id>/delete', methods=['POST'])
+def delete_invalid_files(config_id):
+    """
+    在后台线程中按批删除清单中的 .strm 文件和删除后变空的目录，立即返回；进度通过 delete_progress 查询。
+    """
+    target_directory = get_target_directory_by_config_id(config_id)
+    if not target_directory:
+        return jsonify({"error": "未找到对应的配置"}), 404
 
-@app.route('/get_invalid_file_tree/<path:json_filename>', methods=['GET'])
-def get_invalid_file_tree(json_filename):
     try:
-        # 构建 JSON 文件的路径
-        json_file_path = os.path.join('invalid_file_trees', json_filename)
-        if not os.path.exists(json_file_path):
-            return jsonify({"error": "未找到指定的 JSON 文件"}), 404
-
-        # 读取 JSON 文件，获取目录树
-        with open(json_file_path, 'r', encoding='utf-8') as file:
-            directory_tree = json.load(file)
+        progress = InvalidFileDeleter(config_id, target_directory, logger=app.logger).start()
+    except FileNotFoundError:
+        return jsonify({"error": "未找到失效文件清单"}), 404
+    except Exception as e:
+        app.logger.error(f"启动删除任务时出错: {e}")
+        return jsonify({"error": "启动删除任务时出错"}), 500
+    if progress is None:
+        return jsonify({"error": "该配置的删除任务正在运行"}), 409
 
-        # 返回目录树结构
-        return jsonify({"structure": directory_tree}), 200
+    app.logger.info(f"开始删除配置ID {config_id} 的 {progress['total']} 个失效 .strm 文件")
+    return jsonify({"message": "删除任务已开始", "progress": progress}), 202
 
-    except Exception as e:
-        logger.error(f"获取目录树时出错: {e}")
-        return jsonify({"error": "获取目录树时出错"}), 500
+@app.route('/invalid_files/<int:config_id>/delete_progress', methods=['GET'])
+def delete_progress(config_id):
+    summary = load_summary(config_id)
+    if not summary:
+        return jsonify({"error": "未找到失效文件清单"}), 404
+    return jsonify({"progress": summary.get('delete')})
 
 
 # 配置文件页面
@@ -292,12 +257,54 @@ def edit_config(config_id):
             download_interval_range = request.form.get('download_interval_range', '1-3')  # 保持为字符串
             download_enabled = int(request.form.get('download_enabled', 0))  # 获取是否启用下载功能，默认0（禁用）
             update_mode = request.form['update_mode']  # 获取更新模式
+            crawl_workers = request.form.get('crawl_workers', '4')
+            list_backend = request.form.get('list_backend', 'webdav')
+            download_workers = request.form.get('download_workers', '4')
+            refresh_mode = request.form.get('refresh_mode', 'root')
+            refresh_budget = request.form.get('refresh_budget', '20')
+            refresh_max_age = request.form.get('refresh_max_age', '1440')
+            hot_paths = request.form.get('hot_paths', '')
+            hot_refresh_minutes = request.form.get('hot_refresh_minutes', '60')
 
             # 前端验证已经做过，这里做后端验证
             if not validate_download_interval_range(download_interval_range):
                 flash("下载间隔范围无效。请使用 'min-max' 格式，且 min <= max。", 'error')
                 return redirect(url_for('new_config'))
 
+            if not validate_crawl_workers(crawl_workers):
+                flash("并发遍历线程数无效，请输入 1 到 32 之间的整数。", 'error')
+                return redirect(url_for('edit_config', config_id=config_id))
+
+            if list_backend not in LIST_BACKENDS:
+                flash("列表方式无效。", 'error')
+                return redirect(url_for('edit_config', config_id=config_id))
+
+            if not validate_download_workers(download_workers):
+                flash("并发下载线程数无效，请输入 1 到 32 之间的整数。", 'error')
+                return redirect(url_for('edit_config', config_id=config_id))
+
+            if refresh_mode not in REFRESH_MODES:
+                flash("刷新方式无效。", 'error')
+                return redirect(url_for('edit_config', config_id=config_id))
+
+            if not (refresh_budget.isdigit() and refresh_max_age.isdigit() and int(refresh_max_age) > 0
+                    and hot_refresh_minutes.isdigit() and int(hot_refresh_minutes) > 0):
+                flash("定向刷新的目录数和间隔必须是正整数。", 'error')
+                return redirect(url_for('edit_config', config_id=config_id))
+
+            try:
+                PathRules(parse_rules(hot_paths))
+            except ValueError as e:
+                flash(f"热门路径规则无效: {e}", 'error')
+                return redirect(url_for('edit_config', config_id=config_id))
+
+            # 子路径：每行 路径 | 同步间隔（分钟） | 排除规则
+            try:
+                subpaths = parse_subpaths(request.form.get('subpaths', ''))
+            except ValueError as e:
+                flash(f"子路径无效: {e}", 'error')
+                return redirect(url_for('edit_config', config_id=config_id))
+
             # 自动为 rootpath 添加 /dav/ 前缀（如果没有）
             if not rootpath.startswith('/dav/'):
                 rootpath = '/dav/' + rootpath.lstrip('/')
@@ -305,17 +312,22 @@ def edit_config(config_id):
             # 更新配置，包括下载启用状态、更新模式和大小阈值
             db_handler.cursor.execute('''
                 UPDATE config 
-                SET config_name = ?, url = ?, username = ?, password = ?, rootpath = ?, target_directory = ?, download_enabled = ?, update_mode = ?, download_interval_range = ?
+                SET config_name = ?, url = ?, username = ?, password = ?, rootpath = ?, target_directory = ?, download_enabled = ?, update_mode = ?, download_interval_range = ?, crawl_workers = ?, list_backend = ?, download_workers = ?,
+                    refresh_mode = ?, refresh_budget = ?, refresh_max_age = ?, hot_paths = ?, hot_refresh_minutes = ?
                 WHERE config_id = ?
-            ''', (config_name, url, username, password, rootpath, target_directory, download_enabled, update_mode, download_interval_range, config_id))
+            ''', (config_name, url, username, password, rootpath, target_directory, download_enabled, update_mode, download_interval_range, int(crawl_workers), list_backend, int(download_workers),
+                  refresh_mode, int(refresh_budget), int(refresh_max_age), hot_paths, int(hot_refresh_minutes), config_id))
             db_handler.conn.commit()
+            db_handler.set_config_subpaths(config_id, subpaths)
+            db_handler.invalidate_cache()
 
             flash('配置已成功更新！', 'success')
             return redirect(url_for('configs'))
 
         # GET 请求时，获取并显示现有的配置项
         db_handler.cursor.execute('''
-            SELECT config_name, url, username, password, rootpath, target_directory, download_enabled, update_mode, download_interval_range 
+            SELECT config_name, url, username, password, rootpath, target_directory, download_enabled, update_mode, download_interval_range, crawl_workers, list_backend, download_workers,
+                   refresh_mode, refresh_budget, refresh_max_age, hot_paths, hot_refresh_minutes
             FROM config 
             WHERE config_id = ?
         ''', (config_id,))
@@ -325,7 +337,26 @@ def edit_config(config_id):
             config = list(config)  # 转换为列表以进行修改
             config[8] = '1-3'  # 默认值为字符串 '1-3'
 
-        return render_template('edit_config.html', config=config)
+        if config and config[9] is None:
+            config = list(config)
+            config[9] = 4  # 默认并发遍历线程数
+
+        if config and config[10] is None:
+            config = list(config)
+            config[10] = 'webdav'  # 默认使用 WebDAV 列表
+
+        if config and config[11] is None:
+            config = list(config)
+            config[11] = 4  # 默认并发下载线程数
+
+        # 刷新方式及定向刷新的参数，新建的配置中为空
+        for index, default in ((12, 'root'), (13, 20), (14, 1440), (15, ''), (16, 60)):
+            if config and config[index] is None:
+                config = list(config)
+                config[index] = default
+
+        subpaths = format_subpaths(db_handler.get_config_subpaths(config_id))
+        return render_template('edit_config.html', config=config, subpaths=subpaths)
     except Exception as e:
         flash(f"编辑配置时出错: {e}", 'error')
         return redirect(url_for('configs'))
@@ -350,22 +381,38 @@ def new_config():
             download_interval_range = request.form.get('download_interval_range', '1-3')  # 保持为字符串
             download_enabled = int(request.form.get('download_enabled', 0))  # 获取是否启用下载功能，默认0（禁用）
             update_mode = request.form['update_mode']  # 获取更新模式
+            crawl_workers = request.form.get('crawl_workers', '4')
+            list_backend = request.form.get('list_backend', 'webdav')
+            download_workers = request.form.get('download_workers', '4')
 
             # 前端验证已经做过，这里做后端验证
             if not validate_download_interval_range(download_interval_range):
                 flash("下载间隔范围无效。请使用 'min-max' 格式，且 min <= max。", 'error')
                 return redirect(url_for('new_config'))
 
+            if not validate_crawl_workers(crawl_workers):
+                flash("并发遍历线程数无效，请输入 1 到 32 之间的整数。", 'error')
+                return redirect(url_for('new_config'))
+
+            if list_backend not in LIST_BACKENDS:
+                flash("列表方式无效。", 'error')
+                return redirect(url_for('new_config'))
+
+            if not validate_download_workers(download_workers):
+                flash("并发下载线程数无效，请输入 1 到 32 之间的整数。", 'error')
+                return redirect(url_for('new_config'))
+
             # 自动为 rootpath 添加 /dav/ 前缀（如果没有）
             if not rootpath.startswith('/dav/'):
                 rootpath = '/dav/' + rootpath.lstrip('/')
 
             # 插入新配置到数据库，确保所有字段都被插入
             db_handler.cursor.execute('''
-                INSERT INTO config (config_name, url, username, password, rootpath, target_directory, download_interval_range, download_enabled, update_mode) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (config_name, url, username, password, rootpath, target_directory, download_interval_range, download_enabled, update_mode))
+                INSERT INTO config (config_name, url, username, password, rootpath, target_directory, download_interval_range, download_enabled, update_mode, crawl_workers, list_backend, download_workers) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (config_name, url, username, password, rootpath, target_directory, download_interval_range, download_enabled, update_mode, int(crawl_workers), list_backend, int(download_workers)))
             db_handler.conn.commit()
+            db_handler.invalidate_cache()
 
             flash('新配置已成功添加！', 'success')
             return redirect(url_for('configs'))
@@ -381,7 +428,7 @@ def new_config():
 def copy_config(config_id):
     try:
         # 查询要复制的配置
-        db_handler.cursor.execute('SELECT config_name, url, username, password, rootpath, target_directory, download_interval_range, download_enabled, update_mode FROM config WHERE config_id = ?', (config_id,))
+        db_handler.cursor.execute('SELECT config_name, url, username, password, rootpath, target_directory, download_interval_range, download_enabled, update_mode, crawl_workers, list_backend, download_workers, refresh_mode, refresh_budget, refresh_max_age, hot_paths, hot_refresh_minutes FROM config WHERE config_id = ?', (config_id,))
         config = db_handler.cursor.fetchone()
 
         if not config:
@@ -392,12 +439,15 @@ def copy_config(config_id):
         new_name = config[0] + " - 复制"
 
         db_handler.cursor.execute('''
-            INSERT INTO config (config_name, url, username, password, rootpath, target_directory, download_interval_range, download_enabled, update_mode) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (new_name, config[1], config[2], config[3], config[4], config[5], config[6], config[7], config[8]))
+            INSERT INTO config (config_name, url, username, password, rootpath, target_directory, download_interval_range, download_enabled, update_mode, crawl_workers, list_backend, download_workers, refresh_mode, refresh_budget, refresh_max_age, hot_paths, hot_refresh_minutes) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (new_name,) + tuple(config[1:]))
 
         # 提交事务
         db_handler.conn.commit()
+        # 子路径一并复制，同步时间不复制
+        db_handler.set_config_subpaths(db_handler.cursor.lastrowid, db_handler.get_config_subpaths(config_id))
+        db_handler.invalidate_cache()
 
         # 添加日志输出，确认插入成功
         print(f"新配置已插入数据库: {new_name}")
@@ -416,6 +466,8 @@ def delete_config(config_id):
     try:
         db_handler.cursor.execute("DELETE FROM config WHERE config_id = ?", (config_id,))
         db_handler.conn.commit()
+        db_handler.delete_config_subpaths([config_id])
+        db_handler.invalidate_cache()
         flash('配置已成功删除！', 'success')
     except Exception as e:
         flash(f"删除配置时出错: {e}", 'error')
@@ -433,6 +485,20 @@ def validate_download_interval_range(interval_range):
     return min_val <= max_val
 
 
+def validate_crawl_workers(crawl_workers):
+    try:
+        return 1 <= int(crawl_workers) <= 32
+    except (TypeError, ValueError):
+        return False
+
+
+def validate_download_workers(download_workers):
+    try:
+        return 1 <= int(download_workers) <= 32
+    except (TypeError, ValueError):
+        return False
+
+
 # 设置页面
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
@@ -444,12 +510,19 @@ def settings():
             image_formats = request.form['image_formats']
             metadata_formats = request.form['metadata_formats']
             size_threshold = int(request.form['size_threshold'])
+            include_rules = request.form.get('include_rules', '').strip()
+            exclude_rules = request.form.get('exclude_rules', '').strip()
+            # 保存前检查规则能否编译，无效的正则表达式抛出 ValueError
+            PathRules(parse_rules(include_rules))
+            PathRules(parse_rules(exclude_rules))
             # 使用现有的 db_handler 进行数据库更新
             db_handler.cursor.execute('''
                 UPDATE user_config 
-                SET video_formats = ?, subtitle_formats = ?, image_formats = ?, metadata_formats = ?,size_threshold = ?
-            ''', (video_formats, subtitle_formats, image_formats, metadata_formats, size_threshold))
+                SET video_formats = ?, subtitle_formats = ?, image_formats = ?, metadata_formats = ?,size_threshold = ?,
+                    include_rules = ?, exclude_rules = ?
+            ''', (video_formats, subtitle_formats, image_formats, metadata_formats, size_threshold, include_rules, exclude_rules))
             db_handler.conn.commit()
+            db_handler.invalidate_cache()
 
 
             flash('设置已成功更新！', 'success')
@@ -477,71 +550,147 @@ def settings():
     return render_template('settings.html', script_config=script_config)
 
 
-@app.route('/logs/<int:config_id>')
-def logs(config_id):
-    log_dir = os.path.join(os.getcwd(), 'logs')
+# 任务日志每页显示的行数
+TASK_LOG_LINES_PER_PAGE = 500
 
-    # 获取指定 config_id 的所有日志文件（以 config_id 为前缀）
-    log_files = [f for f in os.listdir(log_dir) if f.startswith(f'config_{config_id}') and f.endswith('.log')]
 
+def latest_log_file(*patterns):
+    """
+    返回匹配任一 pattern 的最新日志文件路径，没有时返回 None。
+    """
+    log_files = [log_file for pattern in patterns for log_file in glob.glob(os.path.join(os.getcwd(), 'logs', pattern))]
     if not log_files:
-        # 如果没有找到相关日志文件，返回 404 错误
-        abort(404, description=f"没有找到与配置 ID {config_id} 相关的日志文件")
+        return None
+    return max(log_files, key=os.path.getmtime)
 
-    # 按修改时间倒序排列，获取最新的日志文件
-    latest_log_file = max(log_files, key=lambda f: os.path.getmtime(os.path.join(log_dir, f)))
-    log_file_path = os.path.join(log_dir, latest_log_file)
 
-    # 分页参数
-    page = int(request.args.get('page', 1))  # 获取当前页码，默认为第一页
-    per_page = 100  # 每页显示100行日志
-    start = (page - 1) * per_page
-    end = start + per_page
+# 日志页面可用的过滤参数
+LOG_FILTER_ARGS = ('level', 'stage', 'run_id', 'q')
 
-    # 读取日志文件并按行倒序排列
-    with open(log_file_path, 'r', encoding='utf-8') as log_file:
-        log_lines = log_file.readlines()
 
-    # 计算总页数
-    total_lines = len(log_lines)
-    total_pages = (total_lines // per_page) + (1 if total_lines % per_page > 0 else 0)
+def log_filter_args():
+    return {name: request.args[name] for name in LOG_FILTER_ARGS if request.args.get(name)}
 
-    # 确保页码合法
-    if page < 1:
+
+def log_filter_from_request():
+    args = log_filter_args()
+    return LogFilter(level=args.get('level'), stage=args.get('stage'), run_id=args.get('run_id'), keyword=args.get('q'))
+
+
+def read_log_page(log_file_path, per_page):
+    """
+    使用行偏移索引读取一页日志，返回模板参数：
+    log_lines（格式化后的日志行，按文件中的顺序）、page、total_pages、offset（当前文件末尾的偏移，用于实时跟踪）、
+    filters（过滤参数）、before（过滤时下一页的游标，没有更早的日志时为 None）。
+
+    没有过滤条件时按页码分页，第 1 页为最新的日志；有过滤条件时从 before 行向前查找符合条件的日志。
+    """
+    reader = LogReader(log_file_path)
+    log_filter = log_filter_from_request()
+    result = {'offset': reader.indexed_bytes, 'filters': log_filter_args(), 'page': 1, 'total_pages': 1, 'before': None}
+
+    if log_filter.active:
+        before = request.args.get('before', type=int)
+        entries, result['before'] = reader.search(log_filter, before=before, limit=per_page)
+        result['log_lines'] = [format_log_entry(entry) for entry in entries]
+        # 只有从文件末尾开始的查找结果才实时跟踪
+        result['page'] = 1 if before is None else 2
+        return result
+
+    total_pages = reader.total_pages(per_page)
+    try:
+        page = int(request.args.get('page', 1))
+    except ValueError:
         page = 1
-    elif page > total_pages:
-        page = total_pages
+    # 确保页码合法
+    page = min(max(page, 1), total_pages)
+    result['log_lines'] = [format_log_entry(parse_log_line(line)) for line in reader.page(page, per_page)]
+    result['page'], result['total_pages'] = page, total_pages
+    return result
 
-    # 获取当前页的日志内容，并反转顺序（最新的日志行在顶部）
-    current_page_lines = log_lines[start:end][::-1]
 
-    # 将当前页面的日志行转换成字符串，确保每行用 <br> 换行
-    log_content = '<br>'.join(current_page_lines)
+def log_event_stream(log_file_path):
+    """
+    以 server-sent events 推送日志文件中新写入的行，事件 id 为下一行的字节偏移，
+    浏览器断线重连时通过 Last-Event-ID 从断开的位置继续。日志被轮转时发送 rotated 事件后结束。
+    """
+    size = os.path.getsize(log_file_path)
+    log_filter = log_filter_from_request()
+    offset = request.headers.get('Last-Event-ID', request.args.get('offset'))
+    try:
+        offset = min(max(int(offset), 0), size)
+    except (TypeError, ValueError):
+        offset = size
+
+    def generate():
+        yield 'retry: 3000\n\n'
+        for next_offset, line in follow(log_file_path, offset):
+            if next_offset is None:
+                yield 'event: rotated\ndata: \n\n'
+                return
+            if line is None:
+                # 心跳，避免代理断开空闲连接
+                yield ': keepalive\n\n'
+                continue
+            entry = parse_log_line(line)
+            if log_filter.matches(entry):
+                yield f'id: {next_offset}\ndata: {format_log_entry(entry)}\n\n'
+            else:
+                # 不符合过滤条件的行只推进事件 id，重连时不必重新读取
+                yield f'id: {next_offset}\n\n'
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/logs/<int:config_id>')
+def logs(config_id):
+    # 获取指定 config_id 最新的日志文件（以 config_id 为前缀）
+    log_file_path = latest_log_file(f'config_{config_id}.log', f'config_{config_id}_*.log')
+    if not log_file_path:
+        # 如果没有找到相关日志文件，返回 404 错误
+        abort(404, description=f"没有找到与配置 ID {config_id} 相关的日志文件")
+
+    # 每页显示100行日志，只读取当前页，不再读取整个日志文件
+    log_page = read_log_page(log_file_path, 100)
+    # 最新的日志行在顶部
+    log_page['log_lines'].reverse()
 
     # 渲染模板并传递分页信息
     return render_template(
         'logs_single.html',
-        log_content=log_content,
+        log_file=os.path.basename(log_file_path),
         config_id=config_id,
-        page=page,
-        total_pages=total_pages
+        **log_page
     )
 
 
-# 定义函数来运行 main.py
-def run_config(config_id):
+@app.route('/logs/<int:config_id>/stream')
+def logs_stream(config_id):
+    log_file_path = latest_log_file(f'config_{config_id}.log', f'config_{config_id}_*.log')
+    if not log_file_path:
+        abort(404, description=f"没有找到与配置 ID {config_id} 相关的日志文件")
+    return log_event_stream(log_file_path)
+
+
+# 定义函数来运行 runner.py，多个配置在同一个进程中运行，同一主机的配置共享连接池和限速器
+def run_configs(config_ids):
     # 获取当前文件的目录路径
     current_dir = os.path.dirname(os.path.abspath(__file__))
 
-    # 使用绝对路径指定 main.py 的位置
-    main_script_path = os.path.join(current_dir, 'main.py')
+    # 使用绝对路径指定 runner.py 的位置
+    runner_script_path = os.path.join(current_dir, 'runner.py')
 
-    if os.path.exists(main_script_path):
-        command = f"python3.9 {main_script_path} {config_id}"
-        logger.info(f"启动配置ID: {config_id} 的命令: {command}")
-        subprocess.Popen(command, shell=True)
+    if os.path.exists(runner_script_path):
+        command = ['python3.9', runner_script_path] + [str(config_id) for config_id in config_ids]
+        logger.info(f"启动配置ID: {', '.join(map(str, config_ids))} 的命令: {' '.join(command)}")
+        subprocess.Popen(command)
     else:
-        logger.error(f"无法找到 main.py 文件: {main_script_path}")
+        logger.error(f"无法找到 runner.py 文件: {runner_script_path}")
+
+
+def run_config(config_id):
+    run_configs([config_id])
 
 @app.route('/run_selected_configs', methods=['POST'])
 def run_selected_configs():
@@ -563,11 +712,13 @@ def run_selected_configs():
         for config_id in selected_configs:
             db_handler.cursor.execute('DELETE FROM config WHERE config_id = ?', (config_id,))
         db_handler.conn.commit()
+        db_handler.delete_config_subpaths([int(config_id) for config_id in selected_configs])
+        db_handler.invalidate_cache()
         flash('选定的配置已成功删除！', 'success')
 
     elif action == 'run_selected':
-        for config_id in selected_configs:
-            run_config(int(config_id))  # 调用 `run_config` 函数来运行 main.py
+        # 所有选定的配置在同一个 runner 进程中运行
+        run_configs([int(config_id) for config_id in selected_configs])
         flash('选定的配置已开始运行！', 'success')
 
     return redirect(url_for('configs'))
@@ -576,7 +727,7 @@ def run_selected_configs():
 def scheduled_tasks():
     try:
         # 从定时任务模块中获取所有定时任务
-        tasks = list_tasks_in_cron()  # 调用 task_scheduler.py 的 list_tasks_in_cron 方法
+        tasks = list_tasks()  # 调用 task_scheduler.py 的 list_tasks 方法
         return render_template('scheduled_tasks.html', tasks=tasks)
     except Exception as e:
         flash(f'获取定时任务时出错: {e}', 'error')
@@ -612,7 +763,7 @@ def new_task():
         cron_time = convert_to_cron_time(interval_type, interval_value)
 
         # 调用定时任务模块的函数添加任务
-        task_ids = add_tasks_to_cron(
+        task_ids = add_tasks(
             task_name=task_name,
             cron_time=cron_time,
             config_ids=config_ids,
@@ -658,7 +809,7 @@ def update_task(task_id):
         cron_time = convert_to_cron_time(interval_type, interval_value)
 
         # 更新任务信息
-        update_tasks_in_cron(
+        update_tasks(
             task_ids=[task_id],
             cron_time=cron_time,
             config_ids=config_ids,
@@ -671,7 +822,7 @@ def update_task(task_id):
         return redirect(url_for('scheduled_tasks'))
 
     # GET 请求时，加载任务信息
-    tasks = list_tasks_in_cron()  # 调用 task_scheduler.py 的 list_tasks_in_cron 方法
+    tasks = list_tasks()  # 调用 task_scheduler.py 的 list_tasks 方法
     task = next((t for t in tasks if t.get('task_id') == task_id), None)
     configs = db_handler.get_all_configurations()
 
@@ -690,7 +841,7 @@ def update_task(task_id):
 def delete_task(task_id):
     try:
         # 删除定时任务
-        delete_tasks_from_cron([task_id])  # 调用 task_scheduler.py 的 delete_tasks_from_cron 方法
+        delete_tasks([task_id])  # 调用 task_scheduler.py 的 delete_tasks 方法
 
         flash('任务已成功删除！', 'success')
     except Exception as e:
@@ -707,7 +858,7 @@ def delete_selected_tasks():
         if not task_ids:
             return jsonify({'success': False, 'error': '未提供任务ID'})
 
-        delete_tasks_from_cron(task_ids)
+        delete_tasks(task_ids)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -715,28 +866,25 @@ def delete_selected_tasks():
 
 @app.route('/view_logs/<task_id>')
 def view_logs(task_id):
-    # 日志文件的路径
-    log_dir = os.path.join(os.getcwd(), 'logs')
-    # 构建日志文件的搜索模式
-    log_pattern = os.path.join(log_dir, f'task_{task_id}_*.log')
-    log_files = glob.glob(log_pattern)
-
-    if log_files:
-        # 按照文件修改时间排序，最新的文件排在第一个
-        log_files.sort(key=os.path.getmtime, reverse=True)
-
-        # 只读取最新的日志文件
-        latest_log_file = log_files[0]
-        with open(latest_log_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        log_contents = [{
-            'filename': os.path.basename(latest_log_file),
-            'content': content
-        }]
-    else:
-        log_contents = None
+    # 只读取最新的日志文件
+    log_file_path = latest_log_file(f'task_{task_id}_*.log')
+    if not log_file_path:
+        return render_template('view_logs.html', log_lines=None, task_id=task_id)
 
-    return render_template('view_logs.html', log_contents=log_contents, task_id=task_id)
+    return render_template(
+        'view_logs.html',
+        log_file=os.path.basename(log_file_path),
+        task_id=task_id,
+        **read_log_page(log_file_path, TASK_LOG_LINES_PER_PAGE)
+    )
+
+
+@app.route('/view_logs/<task_id>/stream')
+def view_logs_stream(task_id):
+    log_file_path = latest_log_file(f'task_{task_id}_*.log')
+    if not log_file_path:
+        abort(404, description=f"没有找到任务 {task_id} 的日志文件")
+    return log_event_stream(log_file_path)
 
 
 def restart_app():
@@ -879,34 +1027,165 @@ def other():
                                log_content=log_content)
 
 
-def run_task_immediately(task_id):
-    # 获取所有任务
-    tasks = list_tasks_in_cron()
+@app.route('/api/jobs')
+def api_jobs():
+    """
+    以 JSON 返回运行队列的状态，可用 state 参数按状态过滤，limit 参数限制返回数量（默认 100）。
+    """
+    state = request.args.get('state')
+    if state and state not in JOB_STATES:
+        return jsonify({"error": f"无效的状态: {state}"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "limit 必须是整数"}), 400
 
-    # 查找指定 task_id 对应的任务
-    task_to_run = next((task for task in tasks if task.get('task_id') == task_id), None)
+    job_queue = JobQueue()
+    try:
+        # list_jobs 会先清理过期的租约，再统计各状态数量
+        jobs = job_queue.list_jobs(state=state, limit=limit)
+        return jsonify({"summary": job_queue.summary(), "jobs": jobs})
+    finally:
+        job_queue.close()
 
-    if task_to_run:
-        # 获取任务命令
-        command = task_to_run.get('command')
-        if not command:
-            raise ValueError('找不到该任务的命令，无法运行。')
 
-        try:
-            # 使用 subprocess 来运行任务的命令
-            subprocess.Popen(command, shell=True)
-            print(f"任务 {task_id} 已立即运行。")
-        except Exception as e:
-            print(f"运行任务 {task_id} 时发生错误: {e}")
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus 文本格式的运行指标。已登录的会话可以直接访问；
+    设置了环境变量 METRICS_TOKEN 时，也可以使用 Authorization: Bearer <METRICS_TOKEN> 抓取。
+    """
+    metrics_token = os.getenv('METRICS_TOKEN')
+    authorized = 'logged_in' in session or (
+        metrics_token and request.headers.get('Authorization') == f'Bearer {metrics_token}')
+    if not authorized:
+        return 'Unauthorized\n', 401, {'Content-Type': 'text/plain; charset=utf-8'}
+
+    store = MetricsStore()
+    try:
+        return store.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    finally:
+        store.close()
+
+
+# webhook 推送的防抖时间和从第一次推送算起的最长等待时间（秒），可用环境变量覆盖
+DEFAULT_WEBHOOK_DEBOUNCE_SECONDS = 10
+DEFAULT_WEBHOOK_MAX_DELAY_SECONDS = 60
+
+
+@app.route('/api/webhook/sync', methods=['POST'])
+def webhook_sync():
+    """
+    推送有新内容的远程路径，只同步这些目录（列出目录、生成 .strm、下载字幕和元数据）。
+    需要设置环境变量 WEBHOOK_TOKEN，并在请求头中携带 Authorization: Bearer <WEBHOOK_TOKEN> 或 X-Webhook-Token。
+
+    请求体为 JSON：{"paths": ["/电视剧/某剧/Season 1", ...], "config_id": 1}。路径可以是 AList 路径或以 /dav 开头的
+    WebDAV 路径，扩展名在格式列表中的文件路径按其所在目录处理；省略 config_id 时推送到根路径包含该路径的所有配置。
+    同一配置的推送在最后一次推送 WEBHOOK_DEBOUNCE_SECONDS 秒后合并为一次运行（从第一次推送算起最多等待
+    WEBHOOK_MAX_DELAY_SECONDS 秒），由定时任务调度进程从运行队列中领取执行。
+    """
+    webhook_token = os.getenv('WEBHOOK_TOKEN')
+    if not webhook_token:
+        return jsonify({"error": "未设置 WEBHOOK_TOKEN，webhook 已禁用"}), 403
+    authorization = request.headers.get('Authorization', '')
+    supplied = request.headers.get('X-Webhook-Token') or (
+        authorization[len('Bearer '):] if authorization.startswith('Bearer ') else '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), webhook_token.encode('utf-8')):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    paths = data.get('paths')
+    if isinstance(paths, str):
+        paths = [paths]
+    if not paths or not isinstance(paths, list) or not all(isinstance(path, str) and path.strip() for path in paths):
+        return jsonify({"error": "paths 必须是非空的路径列表"}), 400
+    config_id = data.get('config_id')
+
+    if config_id is not None:
+        db_handler.cursor.execute('SELECT config_id, rootpath FROM config WHERE config_id = ?', (config_id,))
     else:
-        raise ValueError(f"找不到 task_id 为 {task_id} 的任务。")
+        db_handler.cursor.execute('SELECT config_id, rootpath FROM config')
+    configs = db_handler.cursor.fetchall()
+    if config_id is not None and not configs:
+        return jsonify({"error": f"配置ID {config_id} 不存在"}), 404
+
+    # 文件路径按其所在目录处理，同一目录的多个文件只同步一次
+    classifier = FileClassifier(db_handler.get_script_config())
+    directories = {}
+    unmatched = []
+    try:
+        for path in paths:
+            directory = (path.rstrip('/').rsplit('/', 1)[0] or '/') if classifier.category(path) else path
+            matched = False
+            for matched_config_id, rootpath in configs:
+                relative = rootpath_relative(directory, rootpath)
+                if relative is not None:
+                    directories.setdefault(matched_config_id, set()).add(relative)
+                    matched = True
+            if not matched:
+                unmatched.append(path)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not directories:
+        return jsonify({"error": "推送的路径不在任何配置的根路径下", "unmatched": unmatched}), 404
+
+    debounce_seconds = float(os.getenv('WEBHOOK_DEBOUNCE_SECONDS', DEFAULT_WEBHOOK_DEBOUNCE_SECONDS))
+    max_delay_seconds = float(os.getenv('WEBHOOK_MAX_DELAY_SECONDS', DEFAULT_WEBHOOK_MAX_DELAY_SECONDS))
+    jobs = []
+    job_queue = JobQueue()
+    try:
+        for matched_config_id, relative_paths in sorted(directories.items()):
+            job_id, coalesced = job_queue.enqueue_paths(matched_config_id, sorted(relative_paths),
+                                                        debounce_seconds, max_delay_seconds)
+            app.logger.info(f"webhook 推送配置ID {matched_config_id} 的 {len(relative_paths)} 个目录，"
+                            f"{'合并到' if coalesced else '加入'}队列任务 {job_id}")
+            jobs.append({"config_id": matched_config_id, "job_id": job_id, "coalesced": coalesced,
+                         "paths": sorted(relative_paths)})
+    finally:
+        job_queue.close()
+    return jsonify({"jobs": jobs, "unmatched": unmatched}), 202
+
+
+@app.route('/api/runs')
+def api_runs():
+    """
+    以 JSON 返回最近的运行指标（各阶段耗时、请求数、下载字节数、限速等待时间等），
+    可用 config_id 参数按配置过滤，limit 参数限制返回数量（默认 50）。
+    """
+    try:
+        config_id = request.args.get('config_id', type=int)
+        limit = min(max(int(request.args.get('limit', 50)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "limit 必须是整数"}), 400
+
+    store = MetricsStore()
+    try:
+        return jsonify({"runs": store.list_runs(config_id=config_id, limit=limit)})
+    finally:
+        store.close()
+
+
+@app.route('/api/runs/<int:run_id>')
+def api_run(run_id):
+    store = MetricsStore()
+    try:
+        run = store.get_run(run_id)
+    finally:
+        store.close()
+    if run is None:
+        return jsonify({"error": f"运行记录 {run_id} 不存在"}), 404
+    return jsonify(run)
+
 
 @app.route('/run_task_now/<task_id>', methods=['POST'])
 def run_task_now(task_id):
     try:
-        # 调用立即运行任务的函数
-        run_task_immediately(task_id)
-        flash(f"任务 {task_id} 已成功运行！", 'success')
+        # 加入运行队列，由定时任务调度守护进程运行；同一配置正在运行时排队等待
+        job_id, coalesced = request_task_run(task_id)
+        if coalesced:
+            flash(f"任务 {task_id} 已在队列中等待运行（队列任务 {job_id}）", 'success')
+        else:
+            flash(f"任务 {task_id} 已加入运行队列（队列任务 {job_id}）！", 'success')
     except Exception as e:
         flash(f"运行任务 {task_id} 时出错: {e}", 'error')
 
@@ -940,10 +1219,8 @@ def get_script_log():
     log_file_name = 'replace_domain.log'
     log_file = os.path.join(log_dir, log_file_name)
     if os.path.exists(log_file):
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            # 只返回最后 1000 行
-            return ''.join(lines[-1000:])
+        # 只返回最后 1000 行，从文件末尾向前读取
+        return '\n'.join(format_log_entry(parse_log_line(line)) for line in tail_lines(log_file, 1000))
     else:
         return '日志文件不存在。'
 
@@ -1076,18 +1353,6 @@ def check_and_apply_updates():
 
 
 
-def sync_cron_with_backup():
-    """同步 crontab 与备份文件"""
-    if os.path.exists(CRON_BACKUP_FILE):
-        with open(CRON_BACKUP_FILE, 'r') as f:
-            backup_cron_jobs = f.read().strip()
-        current_cron_jobs = subprocess.run(['crontab', '-l'], stdout=subprocess.PIPE, text=True).stdout.strip()
-        if backup_cron_jobs != current_cron_jobs:
-            subprocess.run(f'(echo "{backup_cron_jobs}") | crontab -', shell=True)
-            print("Cron tasks synchronized with backup.")
-    else:
-        print("Backup file not found, skipping synchronization.")
-
 import os
 
 ENV_FILE = '/config/app.env'
@@ -1169,7 +1434,8 @@ if __name__ == '__main__':
     logger, log_file = setup_logger('app')
     # 启动应用之前先检查更新
     check_and_apply_updates()
-    sync_cron_with_backup()
+    # 将旧版本 crontab 中的定时任务导入数据库，由 scheduler_daemon.py 调度
+    migrate_crontab(logger)
     ensure_env_file()
     port = load_port_from_env()
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+测量 Downloader 在不同并发数下下载字幕、图片、元数据文件的吞吐量和建立的 TCP 连接数。
+
+用法：python benchmark/bench_download.py [--files 2000] [--workers 1 4 16] [--latency 0.005]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到 sys.path，以便导入项目模块
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from downloader import Downloader
+from fake_alist_server import FakeAListServer, FakeTree, join_path
+
+DOWNLOAD_EXTENSIONS = ('srt', 'nfo', 'jpg')
+
+
+def run_downloader(server, tree, workers):
+    config = {
+        'host': '127.0.0.1',
+        'port': server.port,
+        'protocol': 'http',
+        'username': 'admin',
+        'password': 'admin'
+    }
+    logger = logging.getLogger(f'bench_download_{workers}')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    server.reset_stats()
+    with tempfile.TemporaryDirectory() as target_directory:
+        downloader = Downloader(config, logger, workers=workers).start()
+        start = time.perf_counter()
+        for path, children in tree.directories.items():
+            for child in children:
+                if not child['is_dir'] and child['name'].rsplit('.', 1)[-1] in DOWNLOAD_EXTENSIONS:
+                    downloader.submit('/dav' + join_path(path, child['name']), target_directory, child['size'])
+        downloader.finish()
+        elapsed = time.perf_counter() - start
+
+    stats = dict(server.stats)
+    return {
+        'workers': workers,
+        'seconds': elapsed,
+        'files': downloader.progress.downloaded,
+        'failed': downloader.progress.failed,
+        'connections': stats.get('connections', {}).get('requests', 0)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='元数据下载基准测试')
+    parser.add_argument('--files', type=int, default=2000, help='虚拟目录中的文件数量（约 60% 需要下载）')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--latency', type=float, default=0.005)
+    args = parser.parse_args()
+
+    tree = FakeTree(depth=0, dirs_per_level=0, files_per_dir=args.files)
+    server = FakeAListServer(tree, latency=args.latency).start()
+    print(f'注入延迟 {args.latency}s')
+    print(f"{'并发数':<8}{'耗时(s)':>10}{'文件数':>10}{'失败':>8}{'文件/秒':>10}{'TCP连接':>10}")
+    try:
+        for workers in args.workers:
+            result = run_downloader(server, tree, workers)
+            print(f"{result['workers']:<8}{result['seconds']:>10.2f}{result['files']:>10}{result['failed']:>8}"
+                  f"{result['files'] / result['seconds']:>10.0f}{result['connections']:>10}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
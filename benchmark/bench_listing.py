@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+对比 WebDAV 与 AList JSON 接口两种列表后端的遍历耗时、请求数和传输字节数。
+
+用法：python benchmark/bench_listing.py [--depth 3] [--dirs-per-level 5] [--files-per-dir 20] [--workers 4] [--latency 0.01]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+# 添加项目根目录到 sys.path，以便导入项目模块
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from crawler import DirectoryCrawler
+from fake_alist_server import FAKE_TOKEN, FakeAListServer, FakeTree
+from listing_backends import create_list_backend
+
+
+def run_backend(server, backend_name, workers):
+    config = {
+        'host': '127.0.0.1',
+        'port': server.port,
+        'protocol': 'http',
+        'username': 'admin',
+        'password': 'admin',
+        'rootpath': '/dav',
+        'list_backend': backend_name
+    }
+    logger = logging.getLogger(f'bench_{backend_name}')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    server.reset_stats()
+    crawler = DirectoryCrawler(create_list_backend(config, FAKE_TOKEN), logger, workers=workers)
+    files = []
+    start = time.perf_counter()
+    change_set = crawler.crawl('/dav/', on_file=lambda entry, directory: files.append(entry['name']))
+    elapsed = time.perf_counter() - start
+    stats = dict(server.stats)
+    stats.pop('connections', None)
+    requests_count = sum(stat['requests'] for stat in stats.values())
+    bytes_count = sum(stat['bytes'] for stat in stats.values())
+    return {
+        'backend': backend_name,
+        'seconds': elapsed,
+        'directories': change_set.listed_directories,
+        'files': len(files),
+        'requests': requests_count,
+        'bytes': bytes_count
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='列表后端基准测试')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--dirs-per-level', type=int, default=5)
+    parser.add_argument('--files-per-dir', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    tree = FakeTree(args.depth, args.dirs_per_level, args.files_per_dir)
+    server = FakeAListServer(tree, latency=args.latency).start()
+    directories = len(tree.directories)
+    print(f'虚拟目录树: {directories} 个目录，{tree.file_count} 个文件，并发 {args.workers}，注入延迟 {args.latency}s')
+    print(f"{'后端':<8}{'耗时(s)':>10}{'目录数':>10}{'文件数':>10}{'请求数':>10}{'字节/目录':>14}")
+    try:
+        for backend_name in ('webdav', 'api'):
+            result = run_backend(server, backend_name, args.workers)
+            print(f"{result['backend']:<8}{result['seconds']:>10.2f}{result['directories']:>10}{result['files']:>10}"
+                  f"{result['requests']:>10}{result['bytes'] / directories:>14.0f}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
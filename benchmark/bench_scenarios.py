@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+端到端场景基准测试：对本地模拟的 AList 服务运行完整的同步和校验流程，完全离线。
+
+场景（按顺序运行，后面的场景沿用前面场景生成的索引和 .strm 文件）：
+    cold_full            首次全量同步（索引和目标目录均为空）
+    incremental_noop     云端没有变化的增量同步
+    incremental_change   云端约 --change 比例的文件发生变化后的增量同步
+    validate_slow        对 --strm-files 个 .strm 文件执行慢扫校验
+
+每个场景在独立的子进程中运行 main.run_config / strm_validator.run_validation，
+报告墙钟时间、模拟服务收到的请求数和 TCP 连接数、读写系统调用数（/proc/self/io 的 syscr/syscw）
+以及峰值 RSS，并附上运行指标（run_metrics）中的各阶段耗时。所有数据库和文件都写入临时目录。
+
+用法：python benchmark/bench_scenarios.py [--depth 3] [--dirs-per-level 8] [--files-per-dir 20]
+                                         [--latency 0.002] [--change 0.01] [--strm-files 100000]
+                                         [--scenarios cold_full incremental_noop ...] [--json result.json]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+# 添加项目根目录到 sys.path，以便导入项目模块
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from fake_alist_server import FakeAListServer, FakeTree
+
+SCENARIOS = ('cold_full', 'incremental_noop', 'incremental_change', 'validate_slow')
+SYNC_CONFIG_ID = 1
+VALIDATE_CONFIG_ID = 2
+VIDEO_EXTENSIONS = ('mkv', 'mp4')
+# 校验场景每个目录存放的 .strm 文件数
+STRM_FILES_PER_DIR = 1000
+
+
+def read_proc_io():
+    """
+    读取 /proc/self/io，非 Linux 系统返回空字典。
+    """
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except OSError:
+        return {}
+
+
+def run_child(scenario, config_id, result_file):
+    """
+    子进程入口：运行一个场景并把测量结果写入 result_file。
+    """
+    # 与 main.py 一致
+    os.umask(0)
+    from metrics import MetricsStore
+
+    start = time.perf_counter()
+    if scenario == 'validate_slow':
+        from strm_validator import run_validation
+        run_validation(config_id, 'slow')
+    else:
+        from main import run_config
+        run_config(config_id)
+    wall_seconds = time.perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    io = read_proc_io()
+    store = MetricsStore()
+    try:
+        runs = store.list_runs(config_id=config_id, limit=1)
+    finally:
+        store.close()
+    run_data = runs[0]['data'] if runs else {}
+    result = {
+        'wall_seconds': wall_seconds,
+        # Linux 上 ru_maxrss 的单位为 KB
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'syscr': io.get('syscr'),
+        'syscw': io.get('syscw'),
+        'stages': run_data.get('stages', {}),
+        'counters': run_data.get('counters', {})
+    }
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+class ScenarioBench:
+    """
+    在临时目录中准备数据库和配置，启动模拟服务，并依次在子进程中运行各场景。
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.work_dir = tempfile.mkdtemp(prefix='alist_strm_bench_')
+        self.tree = FakeTree(args.depth, args.dirs_per_level, args.files_per_dir)
+        self.server = FakeAListServer(self.tree, latency=args.latency).start()
+        self.env = dict(os.environ,
+                        DB_FILE=os.path.join(self.work_dir, 'config.db'),
+                        INDEX_DB_FILE=os.path.join(self.work_dir, 'index.db'),
+                        INVENTORY_DB_FILE=os.path.join(self.work_dir, 'inventory.db'))
+        self.sync_directory = os.path.join(self.work_dir, 'strm')
+        self.validate_directory = os.path.join(self.work_dir, 'validate')
+
+    def setup(self):
+        from db_handler import DBHandler
+        db_handler = DBHandler(self.env['DB_FILE'])
+        try:
+            db_handler.initialize_tables()
+            rows = [
+                (SYNC_CONFIG_ID, 'bench_sync', self.sync_directory, self.args.download, self.args.crawl_workers),
+                (VALIDATE_CONFIG_ID, 'bench_validate', self.validate_directory, 0, self.args.crawl_workers)
+            ]
+            for config_id, name, target_directory, download_enabled, crawl_workers in rows:
+                db_handler.cursor.execute(
+                    '''INSERT INTO config (config_id, config_name, url, username, password, rootpath, target_directory,
+                       download_enabled, update_mode, download_interval_range, crawl_workers, list_backend, download_workers)
+                       VALUES (?, ?, ?, 'admin', 'admin', '/dav', ?, ?, 'incremental', '0-0', ?, ?, ?)''',
+                    (config_id, name, self.server.url, target_directory, int(download_enabled), crawl_workers,
+                     self.args.backend, self.args.workers))
+            db_handler.conn.commit()
+        finally:
+            db_handler.close()
+        os.makedirs(self.sync_directory)
+
+    def prepare_validation(self):
+        """
+        生成 --strm-files 个 .strm 文件，依次指向模拟服务上的视频文件（数量不足时循环使用）。
+        """
+        videos = [path for path, _ in self.tree.iter_files(VIDEO_EXTENSIONS)]
+        for i in range(self.args.strm_files):
+            directory = os.path.join(self.validate_directory, f'{i // STRM_FILES_PER_DIR:04d}')
+            if i % STRM_FILES_PER_DIR == 0:
+                os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f'{i:06d}.strm'), 'w', encoding='utf-8') as f:
+                f.write(f'{self.server.url}/d{quote(videos[i % len(videos)])}')
+
+    def run(self, scenario):
+        config_id = VALIDATE_CONFIG_ID if scenario == 'validate_slow' else SYNC_CONFIG_ID
+        if scenario == 'incremental_change':
+            changed = self.tree.mutate(self.args.change)
+            print(f'已修改云端 {changed} 个文件')
+        if scenario == 'validate_slow' and not os.path.isdir(self.validate_directory):
+            self.prepare_validation()
+
+        result_file = os.path.join(self.work_dir, f'{scenario}.json')
+        self.server.reset_stats()
+        with open(os.path.join(self.work_dir, f'{scenario}.log'), 'w') as log:
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', scenario, str(config_id), result_file],
+                                     cwd=self.work_dir, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        if process.returncode != 0 or not os.path.exists(result_file):
+            raise RuntimeError(f'场景 {scenario} 运行失败，日志: {os.path.join(self.work_dir, scenario + ".log")}')
+
+        with open(result_file, encoding='utf-8') as f:
+            result = json.load(f)
+        stats = dict(self.server.stats)
+        result['scenario'] = scenario
+        result['connections'] = stats.pop('connections', {}).get('requests', 0)
+        result['requests'] = {endpoint: stat['requests'] for endpoint, stat in stats.items()}
+        return result
+
+    def close(self):
+        self.server.stop()
+        if self.args.keep:
+            print(f'临时目录已保留: {self.work_dir}')
+        else:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def print_report(results):
+    print(f"{'场景':<22}{'耗时(s)':>10}{'CPU(s)':>10}{'请求数':>10}{'TCP连接':>10}{'读调用':>10}{'写调用':>10}{'峰值RSS(MB)':>14}")
+    for result in results:
+        print(f"{result['scenario']:<22}{result['wall_seconds']:>10.2f}{result['cpu_seconds']:>10.2f}"
+              f"{sum(result['requests'].values()):>10}{result['connections']:>10}"
+              f"{result['syscr'] if result['syscr'] is not None else '-':>10}"
+              f"{result['syscw'] if result['syscw'] is not None else '-':>10}{result['peak_rss_mb']:>14.1f}")
+    for result in results:
+        stages = '，'.join(f'{name} {seconds:.2f}s' for name, seconds in result['stages'].items())
+        requests_text = '，'.join(f'{endpoint} {count}' for endpoint, count in sorted(result['requests'].items()))
+        print(f"{result['scenario']}: 阶段 [{stages}]，请求 [{requests_text}]")
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--child':
+        return run_child(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+
+    parser = argparse.ArgumentParser(description='端到端场景基准测试')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--dirs-per-level', type=int, default=8)
+    parser.add_argument('--files-per-dir', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.002, help='每个请求注入的延迟（秒）')
+    parser.add_argument('--backend', choices=('webdav', 'api'), default='webdav')
+    parser.add_argument('--crawl-workers', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=4, help='下载和校验的并发数')
+    parser.add_argument('--download', action='store_true', help='同步时下载字幕、图片和元数据文件')
+    parser.add_argument('--change', type=float, default=0.01, help='incremental_change 场景中云端修改的文件比例')
+    parser.add_argument('--strm-files', type=int, default=100000, help='validate_slow 场景校验的 .strm 文件数')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--json', help='把完整结果写入该 JSON 文件')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录（数据库、日志和生成的文件）')
+    args = parser.parse_args()
+
+    bench = ScenarioBench(args)
+    print(f'虚拟目录树: {len(bench.tree.directories)} 个目录，{bench.tree.file_count} 个文件，'
+          f'列表后端 {args.backend}，注入延迟 {args.latency}s')
+    results = []
+    try:
+        bench.setup()
+        selected = [scenario for scenario in SCENARIOS if scenario in args.scenarios]
+        if any(scenario.startswith('incremental') for scenario in selected) and 'cold_full' not in selected:
+            # 增量场景需要已建立的索引，先运行一次全量同步（不计入结果）
+            bench.run('cold_full')
+        for scenario in selected:
+            print(f'正在运行场景: {scenario}')
+            results.append(bench.run(scenario))
+    finally:
+        bench.close()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+本地模拟的 AList 服务，用于离线运行基准测试（bench_listing.py、bench_download.py、bench_scenarios.py）。
+
+生成一棵确定性的虚拟目录树（depth 层，每层 dirs_per_level 个子目录，每个目录
+files_per_dir 个文件），并提供：
+    PROPFIND /dav/...      WebDAV Depth: 1 列表（207 Multi-Status）
+    POST /api/auth/login   返回固定的 token
+    POST /api/fs/list      分页 JSON 列表
+    GET|HEAD /d/...        下载文件，内容为确定性的填充字节，支持 Range/If-Range 和 ETag
+每个请求可注入固定延迟，服务会统计各接口的请求数、响应字节数以及建立的 TCP 连接数。
+FakeTree.mutate() 可以在运行期间修改一部分文件，模拟两次同步之间云端发生的变化。
+
+用法：python benchmark/fake_alist_server.py [--port 5244] [--depth 3] ...
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+from xml.sax.saxutils import escape
+
+FAKE_TOKEN = 'fake-alist-token'
+FILE_EXTENSIONS = ('mkv', 'mp4', 'srt', 'nfo', 'jpg')
+
+
+class FakeTree:
+    """
+    确定性的虚拟目录树。路径均为解码后的 AList 路径（不含 /dav 前缀），目录不带结尾的 /。
+    """
+
+    def __init__(self, depth=3, dirs_per_level=5, files_per_dir=10, file_size=200 * 1024 * 1024, mtime=1700000000):
+        self.directories = {}
+        self.mtime = mtime
+        self._build('/', depth, dirs_per_level, files_per_dir, file_size)
+
+    def _build(self, path, depth, dirs_per_level, files_per_dir, file_size):
+        children = []
+        for i in range(files_per_dir):
+            ext = FILE_EXTENSIONS[i % len(FILE_EXTENSIONS)]
+            size = file_size if ext in ('mkv', 'mp4') else 1024 + i
+            children.append({'name': f'文件 {i:04d}.{ext}', 'is_dir': False, 'size': size, 'mtime': self.mtime})
+        if depth > 0:
+            for i in range(dirs_per_level):
+                name = f'目录 {i:03d}'
+                children.append({'name': name, 'is_dir': True, 'size': 0, 'mtime': self.mtime})
+                self._build(join_path(path, name), depth - 1, dirs_per_level, files_per_dir, file_size)
+        self.directories[path] = children
+
+    def list(self, path):
+        return self.directories.get(path.rstrip('/') or '/')
+
+    def mutate(self, fraction, seed=0):
+        """
+        随机修改约 fraction 比例的文件：一半修改大小和修改时间，一半重命名（相当于删除后新增）。
+        与本地存储驱动一致，被修改文件所在目录及其所有上级目录的修改时间随之更新。
+        返回被修改的文件数。
+        """
+        rng = random.Random(seed)
+        files = sorted((path, child['name']) for path, children in self.directories.items()
+                       for child in children if not child['is_dir'])
+        selected = rng.sample(files, max(1, int(len(files) * fraction))) if files else []
+        self.mtime += 60
+        for index, (path, name) in enumerate(selected):
+            child = next(child for child in self.directories[path] if child['name'] == name)
+            child['mtime'] = self.mtime
+            if index % 2:
+                stem, ext = name.rsplit('.', 1)
+                child['name'] = f'{stem} v{self.mtime}.{ext}'
+            else:
+                child['size'] += 1
+            self._touch_directory(path)
+        return len(selected)
+
+    def _touch_directory(self, path):
+        while path != '/':
+            parent, _, name = path.rpartition('/')
+            parent = parent or '/'
+            for child in self.directories[parent]:
+                if child['is_dir'] and child['name'] == name:
+                    child['mtime'] = self.mtime
+            path = parent
+
+    def iter_files(self, extensions=None):
+        """
+        按目录顺序返回 (文件路径, 文件记录)，extensions 不为 None 时只返回这些扩展名的文件。
+        """
+        for path, children in self.directories.items():
+            for child in children:
+                if not child['is_dir'] and (extensions is None or child['name'].rsplit('.', 1)[-1] in extensions):
+                    yield join_path(path, child['name']), child
+
+    def find(self, path):
+        """
+        查找文件记录，不存在或为目录时返回 None。
+        """
+        parent, _, name = path.rstrip('/').rpartition('/')
+        for child in self.list(parent or '/') or []:
+            if child['name'] == name and not child['is_dir']:
+                return child
+        return None
+
+    @property
+    def file_count(self):
+        return sum(1 for children in self.directories.values() for child in children if not child['is_dir'])
+
+
+def join_path(parent, name):
+    return parent.rstrip('/') + '/' + name
+
+
+class FakeAListServer:
+    """
+    在后台线程中运行的模拟 AList 服务。
+    """
+
+    def __init__(self, tree, host='127.0.0.1', port=0, latency=0.0):
+        self.tree = tree
+        self.latency = latency
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def record(self, endpoint, nbytes):
+        with self._stats_lock:
+            stat = self.stats.setdefault(endpoint, {'requests': 0, 'bytes': 0})
+            stat['requests'] += 1
+            stat['bytes'] += nbytes
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                server.record('connections', 0)
+
+            def _send(self, status, body, content_type, endpoint, headers=None, content_length=None):
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body) if content_length is None else content_length))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if self.command == 'HEAD':
+                    # HEAD 只返回响应头，单独统计
+                    return server.record('head', 0)
+                self.wfile.write(body)
+                server.record(endpoint, len(body))
+
+            def _read_json(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def _send_json(self, payload, endpoint):
+                self._send(200, json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                           'application/json; charset=utf-8', endpoint)
+
+            def do_PROPFIND(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                request_path = unquote(urlparse(self.path).path)
+                if not request_path.startswith('/dav'):
+                    return self._send(404, b'', 'text/plain', 'propfind')
+                path = request_path[len('/dav'):] or '/'
+                children = server.tree.list(path)
+                if children is None:
+                    return self._send(404, b'', 'text/plain', 'propfind')
+
+                responses = [propfind_response('/dav' + path.rstrip('/') + '/', True, 0, server.tree.mtime)]
+                for child in children:
+                    href = '/dav' + join_path(path, child['name']) + ('/' if child['is_dir'] else '')
+                    responses.append(propfind_response(href, child['is_dir'], child['size'], child['mtime']))
+                body = ('<?xml version="1.0" encoding="UTF-8"?><D:multistatus xmlns:D="DAV:">'
+                        + ''.join(responses) + '</D:multistatus>').encode('utf-8')
+                self._send(207, body, 'text/xml; charset=utf-8', 'propfind')
+
+            def do_GET(self):
+                request_path = unquote(urlparse(self.path).path)
+                if not request_path.startswith('/d/'):
+                    return self._send(404, b'', 'text/plain', 'other')
+                item = server.tree.find(request_path[len('/d'):])
+                if item is None:
+                    # 与 AList 一致：文件不存在时返回 HTTP 200 和带 code 的 JSON
+                    return self._send_json({'code': 500, 'message': 'object not found', 'data': None}, 'download')
+                size = item['size']
+                etag = f'"{size:x}-{item["mtime"]:x}"'
+                headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+                status, start, end = 200, 0, size - 1
+
+                # 支持单段 Range 请求，If-Range 与 ETag 不一致时返回完整内容
+                range_match = re.match(r'^bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+                if range_match and self.headers.get('If-Range', etag) == etag:
+                    start = int(range_match.group(1))
+                    if start >= size:
+                        headers['Content-Range'] = f'bytes */{size}'
+                        return self._send(416, b'', 'text/plain', 'download', headers)
+                    end = min(int(range_match.group(2) or size - 1), size - 1)
+                    status = 206
+                    headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+                # HEAD 请求不生成响应体，避免为大文件分配内存
+                length = end - start + 1
+                body = b'' if self.command == 'HEAD' else file_content(length)
+                self._send(status, body, 'application/octet-stream', 'download', headers, content_length=length)
+
+            do_HEAD = do_GET
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path == '/api/auth/login':
+                    self._read_json()
+                    return self._send_json({'code': 200, 'message': 'success', 'data': {'token': FAKE_TOKEN}}, 'login')
+                if path == '/api/fs/list':
+                    return self._fs_list()
+                self._send(404, b'', 'text/plain', 'other')
+
+            def _fs_list(self):
+                payload = self._read_json()
+                if self.headers.get('Authorization') != FAKE_TOKEN:
+                    return self._send_json({'code': 401, 'message': 'token is invalidated', 'data': None}, 'fs_list')
+                children = server.tree.list(payload.get('path', '/'))
+                if children is None:
+                    return self._send_json({'code': 500, 'message': 'object not found', 'data': None}, 'fs_list')
+                per_page = int(payload.get('per_page') or 0) or len(children) or 1
+                page = max(1, int(payload.get('page') or 1))
+                content = [{
+                    'name': child['name'],
+                    'size': child['size'],
+                    'is_dir': child['is_dir'],
+                    'modified': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(child['mtime'])) + '.1234567Z',
+                    'sign': '',
+                    'thumb': '',
+                    'type': 1 if child['is_dir'] else 0
+                } for child in children[(page - 1) * per_page:page * per_page]]
+                self._send_json({'code': 200, 'message': 'success', 'data': {
+                    'content': content, 'total': len(children), 'readme': '', 'write': False, 'provider': 'Local'
+                }}, 'fs_list')
+
+        return Handler
+
+
+def file_content(size):
+    return b'\0' * size
+
+
+def propfind_response(href, is_dir, size, mtime):
+    props = [
+        f'<D:displayname>{escape(href.rstrip("/").rsplit("/", 1)[-1])}</D:displayname>',
+        f'<D:getlastmodified>{formatdate(mtime, usegmt=True)}</D:getlastmodified>',
+        '<D:resourcetype><D:collection/></D:resourcetype>' if is_dir else '<D:resourcetype/>'
+    ]
+    if not is_dir:
+        props.append(f'<D:getcontentlength>{size}</D:getcontentlength>')
+        props.append('<D:getcontenttype>application/octet-stream</D:getcontenttype>')
+    return (f'<D:response><D:href>{escape(quote(href))}</D:href><D:propstat><D:prop>{"".join(props)}'
+            '</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 AList 服务')
+    parser.add_argument('--port', type=int, default=5244)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--dirs-per-level', type=int, default=5)
+    parser.add_argument('--files-per-dir', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求注入的延迟（秒）')
+    args = parser.parse_args()
+
+    tree = FakeTree(args.depth, args.dirs_per_level, args.files_per_dir)
+    server = FakeAListServer(tree, port=args.port, latency=args.latency)
+    print(f'模拟 AList 服务已启动: {server.url}（{len(tree.directories)} 个目录，{tree.file_count} 个文件）')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import fnmatch
+import os
+import re
+
+# 文件类别
+CATEGORY_VIDEO = 'video'
+CATEGORY_SUBTITLE = 'subtitle'
+CATEGORY_IMAGE = 'image'
+CATEGORY_METADATA = 'metadata'
+# 需要下载到本地的类别
+DOWNLOAD_CATEGORIES = frozenset((CATEGORY_SUBTITLE, CATEGORY_IMAGE, CATEGORY_METADATA))
+
+# script_config 中各类别对应的格式列表，靠前的类别优先（同一扩展名出现在多个列表中时）
+CATEGORY_FORMATS = (
+    (CATEGORY_VIDEO, 'video_formats'),
+    (CATEGORY_SUBTITLE, 'subtitle_formats'),
+    (CATEGORY_IMAGE, 'image_formats'),
+    (CATEGORY_METADATA, 'metadata_formats'),
+)
+
+# 以该前缀开头的规则为正则表达式，否则为通配符
+REGEX_RULE_PREFIX = 're:'
+
+
+def file_extension(name):
+    """
+    小写的扩展名（不含点），与 os.path.splitext 一致：没有扩展名或只有开头的点时返回空字符串。
+    """
+    base = name.rstrip('/').rpartition('/')[2].lstrip('.')
+    dot = base.rfind('.')
+    return base[dot + 1:].lower() if dot != -1 else ''
+
+
+def parse_rules(text):
+    """
+    把设置页面中的规则文本（每行一条，# 开头为注释）解析为列表。
+    """
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        return [rule for rule in text if rule]
+    rules = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            rules.append(line)
+    return rules
+
+
+class PathRules:
+    """
+    一组路径规则，匹配相对于根目录的路径（以 / 分隔，不以 / 开头），不区分大小写：
+
+    - re:<正则>   对相对路径执行 re.search，目录的路径以 / 结尾
+    - 以 / 结尾   只匹配目录，例如 Extras/
+    - 不含 /      匹配路径中任意一级的名称，例如 @eaDir、*sample*
+    - 其他        匹配整个相对路径，例如 电影/*/花絮
+
+    同一类规则合并为一个正则表达式，匹配一个路径最多执行四次正则匹配。
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        name_patterns, path_patterns, directory_patterns, regex_patterns = [], [], [], []
+        for rule in self.rules:
+            if rule.startswith(REGEX_RULE_PREFIX):
+                pattern = rule[len(REGEX_RULE_PREFIX):]
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise ValueError(f"无效的正则表达式规则 {rule}: {e}")
+                regex_patterns.append(pattern)
+            elif rule.endswith('/'):
+                directory_patterns.append(fnmatch.translate(rule.rstrip('/')))
+            elif '/' in rule:
+                path_patterns.append(fnmatch.translate(rule.strip('/')))
+            else:
+                name_patterns.append(fnmatch.translate(rule))
+        self._name = self._compile(name_patterns)
+        self._path = self._compile(path_patterns)
+        self._directory = self._compile(directory_patterns)
+        self._regex = re.compile('|'.join(f'(?:{pattern})' for pattern in regex_patterns), re.IGNORECASE) \
+            if regex_patterns else None
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), re.IGNORECASE)
+
+    def matches(self, relative_path, is_directory=False):
+        relative_path = relative_path.strip('/')
+        name = relative_path.rpartition('/')[2]
+        if self._name and self._name.match(name):
+            return True
+        if self._path and self._path.match(relative_path):
+            return True
+        if is_directory and self._directory and (self._directory.match(name) or self._directory.match(relative_path)):
+            return True
+        if self._regex and self._regex.search(relative_path + '/' if is_directory else relative_path):
+            return True
+        return False
+
+
+class FileClassifier:
+    """
+    由 script_config 构建的文件分类器，每次运行构建一次，遍历、校验和本地扫描共用。
+
+    - category()：扩展名 → 类别，一次字典查找
+    - size_threshold_bytes：视频文件的大小阈值（字节）
+    - 排除规则（exclude_rules）匹配的目录整个子树不再列出或扫描，匹配的文件不处理；
+      设置了包含规则（include_rules）时，只处理匹配其中任一规则的文件（包含规则不作用于目录）
+    """
+
+    def __init__(self, script_config):
+        self.categories = {}
+        for category, key in reversed(CATEGORY_FORMATS):
+            for fmt in script_config.get(key) or []:
+                fmt = fmt.strip().lower().lstrip('.')
+                if fmt:
+                    self.categories[fmt] = category
+        self.size_threshold_mb = script_config.get('size_threshold', 100)
+        self.size_threshold_bytes = int(self.size_threshold_mb * 1024 * 1024)
+        self.include = PathRules(parse_rules(script_config.get('include_rules')))
+        self.exclude = PathRules(parse_rules(script_config.get('exclude_rules')))
+
+    @property
+    def has_rules(self):
+        return bool(self.include or self.exclude)
+
+    def extensions(self, *categories):
+        return {ext for ext, category in self.categories.items() if category in categories}
+
+    def category(self, name):
+        return self.categories.get(file_extension(name))
+
+    def is_download(self, category):
+        return category in DOWNLOAD_CATEGORIES
+
+    def is_too_small(self, size):
+        return (size or 0) < self.size_threshold_bytes
+
+    def is_excluded_directory(self, relative_path):
+        return bool(self.exclude) and self.exclude.matches(relative_path, is_directory=True)
+
+    def is_excluded_file(self, relative_path):
+        if self.exclude and self.exclude.matches(relative_path):
+            return True
+        return bool(self.include) and not self.include.matches(relative_path)
+
+    def is_excluded_path(self, relative_path):
+        """
+        与 is_excluded_file 相同，但同时检查各级上级目录，用于没有经过目录剪枝的路径（例如远程文件索引中的记录）。
+        """
+        if self.is_excluded_file(relative_path):
+            return True
+        parts = relative_path.strip('/').split('/')[:-1]
+        return any(self.is_excluded_directory('/'.join(parts[:i + 1])) for i in range(len(parts)))
+
+    def classify(self, path, root=''):
+        """
+        返回文件的类别，扩展名不在任何格式列表中或被规则排除时返回 None。
+        规则匹配 path 相对于 root 的路径，没有规则时只做一次字典查找。
+        """
+        category = self.categories.get(file_extension(path))
+        if category is not None and self.has_rules and self.is_excluded_file(relative_path(path, root)):
+            return None
+        return category
+
+
+def relative_path(path, root):
+    """
+    path 相对于 root 的路径（以 / 分隔），用于匹配规则。path 不在 root 下时返回去掉开头 / 的 path。
+    """
+    root = root.rstrip('/')
+    if root and (path == root or path.startswith(root + '/')):
+        path = path[len(root):]
+    return path.strip('/')
+
+
+def local_relative_path(path, root):
+    """
+    本地路径相对于 root 的路径，分隔符统一为 /，root 自身为空字符串。
+    """
+    relative = os.path.relpath(path, root)
+    return '' if relative == '.' else relative.replace(os.sep, '/')
@@ -0,0 +1,313 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import unquote
+
+from classifier import relative_path
+from listing_backends import retryable_status, retry_after
+from logger import log_extra
+from metrics import record_wait
+from remote_index import directory_key
+
+# 列表请求遇到限流或服务端暂时错误时的最大重试次数
+LIST_RETRIES = 3
+# 重试前的等待时间（秒），每次重试翻倍，服务端返回 Retry-After 时以其为准，最长 MAX_RETRY_DELAY
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 30.0
+
+
+def directory_fingerprint(file_infos):
+    """
+    计算目录直接子项的指纹（名称、大小、修改时间、是否目录），子项不变时指纹不变。
+    """
+    digest = hashlib.sha1()
+    for item in sorted(file_infos, key=lambda x: x['name']):
+        digest.update(f"{item['name']}\0{item['size']}\0{item['modified']}\0{int(bool(item['is_directory']))}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ChangeSet:
+    """
+    一次增量遍历产生的变更集。为保证内存占用不随目录规模增长，新增和变化的文件只计数，
+    删除的文件只保留前 removed_sample_size 个解码后完整路径用于日志。
+    由多个遍历线程并发写入。
+    """
+
+    def __init__(self, removed_sample_size=100):
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.removed_sample = []
+        self.removed_sample_size = removed_sample_size
+        self.listed_directories = 0
+        self.skipped_directories = 0
+        self.excluded_directories = 0
+        self.list_errors = 0  # 列表失败的目录数，不为 0 时索引中这些目录的子树不完整
+        self._lock = threading.Lock()
+
+    def record(self, added=(), changed=(), removed=()):
+        with self._lock:
+            self.added += len(added)
+            self.changed += len(changed)
+            for name in removed:
+                self.removed += 1
+                if len(self.removed_sample) < self.removed_sample_size:
+                    self.removed_sample.append(name)
+
+    def count_directory(self, skipped=False, excluded=False, failed=False):
+        with self._lock:
+            if failed:
+                self.list_errors += 1
+            elif excluded:
+                self.excluded_directories += 1
+            elif skipped:
+                self.skipped_directories += 1
+            else:
+                self.listed_directories += 1
+
+    def is_empty(self):
+        return not (self.added or self.changed or self.removed)
+
+    def merge(self, other):
+        """
+        合并另一棵子树的变更集（同一次运行分别遍历多个子路径时），返回 self。
+        """
+        with self._lock:
+            self.added += other.added
+            self.changed += other.changed
+            self.removed += other.removed
+            self.removed_sample.extend(other.removed_sample[:self.removed_sample_size - len(self.removed_sample)])
+            self.listed_directories += other.listed_directories
+            self.skipped_directories += other.skipped_directories
+            self.excluded_directories += other.excluded_directories
+            self.list_errors += other.list_errors
+        return self
+
+
+class DirectoryCrawler:
+    """
+    广度优先的并发目录遍历器。
+
+    每一层目录由 workers 个线程并发调用列表后端（WebDAV PROPFIND 或 AList JSON 接口），
+    所有请求共享同一个限速器。遍历结果逐目录写入远程文件索引（IndexSession），
+    不在内存中保留整棵目录树。
+
+    incremental 为 True 且索引已建立时执行增量遍历：修改时间与索引一致的子目录不再列出，
+    直接沿用索引中的子树；只有新增或变化的文件会触发 on_file。目录修改时间是否随深层
+    文件变化而更新取决于 AList 的存储驱动，全量更新模式始终会重新列出所有目录。
+
+    classifier（classifier.FileClassifier）的排除规则匹配的子目录不会被列出，整个子树被跳过。
+    规则匹配相对于 rules_root 的路径，默认为遍历的起点（只遍历 rootpath 下的一棵子树时传入 rootpath）。
+    relist 为增量遍历时即使修改时间未变也要重新列出的目录（解码后的完整路径，以 / 结尾），例如本次刚刷新过的目录。
+    列表请求返回 429 或 5xx 时最多重试 retries 次，每次重试计入 metrics 的 retries。
+
+    子目录的修改时间在其整棵子树都列出成功后才写入索引；某个目录列表失败时，清除它及其各级上级目录的修改时间，
+    运行中断时未完成的子树也保留旧的修改时间，因此下一次增量遍历会重新列出这些目录，而不是沿用不完整的子树。
+    """
+
+    def __init__(self, backend, logger, workers=4, rate_limiter=None, metrics=None, classifier=None, rules_root=None,
+                 relist=None, retries=LIST_RETRIES, retry_delay=RETRY_DELAY):
+        self.backend = backend
+        self.logger = logger
+        self.workers = max(1, int(workers or 1))
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.classifier = classifier
+        self.rules_root = rules_root
+        self.relist = relist or set()
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    def list_directory(self, directory):
+        """
+        列出单个目录，返回 (列表后端记录, file_info 列表)。限流或服务端暂时错误时等待后重试。
+        """
+        attempt = 0
+        while True:
+            record_wait(self.metrics, self.rate_limiter)
+            self.logger.info(f"尝试遍历目录: {unquote(directory)}", extra=log_extra('crawl', 'list_directory'))
+            start = time.perf_counter()
+            try:
+                entries = self.backend.list_directory(directory)
+                error = None
+            except Exception as e:
+                error = e
+            if self.metrics:
+                self.metrics.observe('list_request_seconds', time.perf_counter() - start)
+                self.metrics.incr('list_requests')
+            if error is None:
+                break
+
+            status = retryable_status(error)
+            if status is None or attempt >= self.retries:
+                raise error
+            delay = min(retry_after(error) or self.retry_delay * 2 ** attempt, MAX_RETRY_DELAY)
+            attempt += 1
+            self.logger.warning(f"列表请求返回 {status}，{delay:g} 秒后第 {attempt} 次重试: {unquote(directory)}",
+                                extra=log_extra('crawl'))
+            if self.metrics:
+                self.metrics.incr('retries')
+            time.sleep(delay)
+        file_infos = [{
+            'name': entry['name'],
+            'size': entry['size'],
+            'modified': entry['modified'],
+            'is_directory': entry['is_directory']
+        } for entry in entries]
+        return entries, file_infos
+
+    def crawl(self, root_directory, on_directory=None, on_file=None, index_session=None, incremental=False, stop=None):
+        """
+        从 root_directory 开始广度优先遍历。
+
+        :param on_directory: 每个被列出的目录调用 on_directory(directory)
+        :param on_file: 文件回调 on_file(entry, directory)，在工作线程中执行。增量遍历时只对新增或
+                        变化的文件调用，否则对所有文件调用
+        :param index_session: 远程文件索引会话，为 None 时不做变更比较也不保存结果
+        :param incremental: 是否跳过修改时间未变化的子目录
+        :param stop: threading.Event，被设置后不再列出新的目录，等待正在进行的列表完成后返回
+        :return: ChangeSet
+        """
+        change_set = ChangeSet()
+        # 只遍历子树时，该子树被完成的运行写入过索引即可比较
+        populated = index_session is not None and index_session.is_populated(unquote(root_directory))
+        incremental = incremental and populated
+        visited = {root_directory}
+        pending = {}
+        # 子树完成情况：remaining 为目录自身及尚未完成的子目录数，parents、names、modified 为子目录的上级、
+        # 索引中的路径和上级列表中的修改时间，failed 为子树中有目录列表失败的目录
+        remaining = {root_directory: 1}
+        parents, names, modified = {}, {root_directory: unquote(root_directory)}, {}
+        failed = set()
+        root_name = unquote(self.rules_root or root_directory)
+        prune = self.classifier is not None and bool(self.classifier.exclude)
+
+        def visit(directory):
+            entries, file_infos = self.list_directory(directory)
+            change_set.count_directory()
+            if on_directory:
+                on_directory(directory)
+            fingerprint = directory_fingerprint(file_infos)
+            file_entries = [entry for entry in entries if not entry['is_directory']]
+
+            cached_children = None
+            if index_session is None:
+                changed_entries = file_entries
+            else:
+                cached_children = index_session.get_children(unquote(directory)) if populated else []
+                if cached_children and fingerprint == index_session.get_fingerprint(unquote(directory)):
+                    changed_entries = []
+                else:
+                    changed_entries = self._diff_directory(entries, cached_children, change_set, index_session)
+                index_session.save_listing(unquote(directory), file_infos, fingerprint,
+                                           hrefs={entry['name']: entry['href'] for entry in entries})
+
+            if on_file:
+                for entry in (changed_entries if incremental else file_entries):
+                    on_file(entry, directory)
+            return entries, cached_children
+
+        def complete(directory):
+            # 目录自身或一个子目录的子树已完成，整棵子树完成且没有失败时写入修改时间
+            while directory is not None:
+                remaining[directory] -= 1
+                if remaining[directory]:
+                    return
+                del remaining[directory]
+                if directory not in failed and modified.get(directory) and index_session is not None:
+                    index_session.set_directory_modified(names[directory], modified[directory])
+                directory = parents.get(directory)
+
+        def fail(directory):
+            # 清除失败的目录及其各级上级目录在索引中的修改时间
+            chain = []
+            while directory is not None and directory not in failed:
+                failed.add(directory)
+                chain.append(names[directory])
+                directory = parents.get(directory)
+            if chain and index_session is not None:
+                index_session.clear_directory_modified(chain)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending[executor.submit(visit, root_directory)] = root_directory
+
+            while pending:
+                if stop is not None and stop.is_set():
+                    # 下游已停止，取消尚未开始的列表请求
+                    for future in pending:
+                        future.cancel()
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory = pending.pop(future)
+                    try:
+                        entries, cached_children = future.result()
+                    except Exception as e:
+                        self.logger.error(f"Error listing files: {unquote(directory)}，错误: {e}", extra=log_extra('crawl'))
+                        change_set.count_directory(failed=True)
+                        if self.metrics:
+                            self.metrics.incr('list_errors')
+                        fail(directory)
+                        complete(directory)
+                        continue
+
+                    cached_by_name = {item['name']: item for item in cached_children or []}
+                    for entry in entries:
+                        if not entry['is_directory'] or entry['href'] in visited:
+                            continue
+                        visited.add(entry['href'])
+
+                        if prune and self.classifier.is_excluded_directory(relative_path(entry['name'], root_name)):
+                            self.logger.debug(f"跳过被排除的目录: {entry['name']}", extra=log_extra('crawl', 'directory_excluded'))
+                            change_set.count_directory(excluded=True)
+                            continue
+                        cached_node = cached_by_name.get(entry['name'])
+                        if incremental and cached_node and cached_node['is_directory'] and entry['modified'] \
+                                and cached_node['modified'] == entry['modified'] \
+                                and directory_key(entry['name']) not in self.relist:
+                            # 目录修改时间未变，沿用索引中的子树，不再发起列表请求
+                            index_session.touch_subtree(entry['name'])
+                            change_set.count_directory(skipped=True)
+                            continue
+                        pending[executor.submit(visit, entry['href'])] = entry['href']
+                        remaining[directory] += 1
+                        remaining[entry['href']] = 1
+                        parents[entry['href']] = directory
+                        names[entry['href']] = entry['name']
+                        modified[entry['href']] = entry['modified']
+                    complete(directory)
+
+        return change_set
+
+    def _diff_directory(self, entries, cached_children, change_set, index_session):
+        """
+        比较单个目录的新列表与索引中的子项，记录变更并返回新增或变化的文件记录。
+        """
+        cached_by_name = {item['name']: item for item in cached_children}
+        current = {}
+        added, changed, changed_entries = [], [], []
+
+        for entry in entries:
+            current[entry['name']] = entry['is_directory']
+            if entry['is_directory']:
+                continue
+            cached = cached_by_name.get(entry['name'])
+            if cached is None or cached['is_directory']:
+                added.append(entry['name'])
+                changed_entries.append(entry)
+            elif cached['size'] != entry['size'] or cached['modified'] != entry['modified']:
+                changed.append(entry['name'])
+                changed_entries.append(entry)
+
+        removed = []
+        for name, cached in cached_by_name.items():
+            if current.get(name) == cached['is_directory']:
+                continue
+            if cached['is_directory']:
+                removed.extend(index_session.iter_subtree_files(name))
+            else:
+                removed.append(name)
+
+        change_set.record(added=added, changed=changed, removed=removed)
+        return changed_entries
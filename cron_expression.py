@@ -0,0 +1,102 @@
+import re
+from datetime import datetime, timedelta
+
+# 各字段的取值范围（分 时 日 月 周），周日可以写成 0 或 7
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+FIELD_NAMES = ('分钟', '小时', '日', '月', '星期')
+# 月和星期字段允许使用英文缩写（JAN-DEC、SUN-SAT）
+MONTH_ALIASES = {name: index for index, name in enumerate(
+    ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'), 1)}
+WEEKDAY_ALIASES = {name: index for index, name in enumerate(('SUN', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT'))}
+FIELD_ALIASES = (None, None, None, MONTH_ALIASES, WEEKDAY_ALIASES)
+
+
+def parse_field(value, low, high, name, aliases=None):
+    """
+    解析单个字段，支持 *、n、a-b、*/n、a-b/n 及逗号分隔的组合，返回取值集合。
+    """
+    if aliases:
+        value = re.sub(r'[A-Za-z]{3}', lambda match: str(aliases.get(match.group(0).upper(), match.group(0))), value)
+    values = set()
+    for part in value.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            if not step_text.isdigit() or int(step_text) < 1:
+                raise ValueError(f"cron 表达式的{name}字段步长无效: {value}")
+            step = int(step_text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            if not start_text.isdigit() or not end_text.isdigit():
+                raise ValueError(f"cron 表达式的{name}字段无效: {value}")
+            start, end = int(start_text), int(end_text)
+        elif part.isdigit():
+            start = int(part)
+            # 'n/step' 表示从 n 开始到最大值
+            end = high if step > 1 else start
+        else:
+            raise ValueError(f"cron 表达式的{name}字段无效: {value}")
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron 表达式的{name}字段超出范围 {low}-{high}: {value}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """
+    标准 5 段 cron 表达式（分 时 日 月 周），与 crontab 的语义一致：
+    日和周都不是 * 时，满足其一即可触发。
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 表达式必须包含 5 个字段: {expression}")
+        self.expression = expression
+        parsed = [parse_field(field, low, high, name, aliases)
+                  for field, (low, high), name, aliases in zip(fields, FIELD_RANGES, FIELD_NAMES, FIELD_ALIASES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # cron 中 0 和 7 都表示周日，转换为 Python 的 weekday()（周一为 0）
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+
+    def _day_matches(self, dt):
+        day_match = dt.day in self.days
+        weekday_match = dt.weekday() in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_time(self, after):
+        """
+        返回严格晚于 after 的下一个触发时间（精确到分钟，本地时间）。
+        """
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # 最多向后查找 5 年，足以覆盖 2 月 29 日这类表达式
+        limit = dt + timedelta(days=5 * 366)
+        while dt <= limit:
+            if dt.month not in self.months:
+                # 跳到下个月的第一天
+                dt = (dt.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt
+        raise ValueError(f"cron 表达式没有可触发的时间: {self.expression}")
+
+
+def validate_cron_expression(expression):
+    """
+    校验 cron 表达式，无效时抛出 ValueError。
+    """
+    CronExpression(expression).next_time(datetime.now())
@@ -1,21 +1,124 @@
+import copy
 import os
 import sqlite3
+import threading
+import time
 from urllib.parse import urlparse
 import  uuid
 from urllib.parse import urlparse
+from refresh_planner import (REFRESH_MODE_ROOT, REFRESH_MODES, DEFAULT_REFRESH_BUDGET, DEFAULT_REFRESH_MAX_AGE_MINUTES,
+                             DEFAULT_HOT_REFRESH_MINUTES)
+
+# 表结构版本，记录在 PRAGMA user_version 中；修改表结构时加 1，并在 _migrate() 中补充对应的迁移
+SCHEMA_VERSION = 4
+# 数据库被其他连接锁定时的等待时间（秒）
+BUSY_TIMEOUT_SECONDS = 30
+# 线程结束后留待复用的空闲连接数量上限
+MAX_IDLE_CONNECTIONS = 4
+# 配置缓存的有效期（秒）。网页上的修改会立即使缓存失效，有效期只用于发现其他途径对数据库的修改
+CONFIG_CACHE_SECONDS = 60
+
+# 本进程中已完成表结构迁移的数据库文件
+_migrated_files = set()
+_migrated_lock = threading.Lock()
+
 
 class DBHandler:
+    """
+    config.db 的访问层。
+
+    - 每个线程使用自己的连接和游标（conn、cursor 属性返回当前线程的连接），网页的并发请求和后台任务
+      不再共用同一个游标；线程结束后其连接放回空闲列表，供新的线程复用
+    - 数据库使用 WAL 日志模式，读写互不阻塞，被锁定时最多等待 BUSY_TIMEOUT_SECONDS 秒
+    - 表结构迁移在每个进程中只运行一次，并以 PRAGMA user_version 记录版本，版本一致时直接跳过
+    - get_webdav_config、get_script_config、get_user_credentials 的结果缓存在内存中，
+      本类的写入方法会使缓存失效，直接通过 cursor 修改配置后需调用 invalidate_cache()
+    """
+
     def __init__(self, db_file=None):
         # 如果 db_file 为空，则从环境变量中读取或使用默认值 '/config/config.db'
         self.db_file = db_file or os.getenv('DB_FILE', '/config/config.db')
-        # 使用 check_same_thread=False 允许跨线程访问
-        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._owners = {}  # 线程 -> 该线程正在使用的连接
+        self._idle = []
+        self._cache = {}
         # 初始化表结构
         self.initialize_tables()
 
+    def _connect(self):
+        # 连接会在线程之间转交（见 _acquire），同一时刻只被一个线程使用
+        conn = sqlite3.connect(self.db_file, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            # 回收已结束线程的连接
+            for thread in [thread for thread in self._owners if not thread.is_alive()]:
+                self._idle.append(self._owners.pop(thread))
+            while len(self._idle) > MAX_IDLE_CONNECTIONS:
+                self._idle.pop().close()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            else:
+                # 丢弃上一个线程未提交的修改
+                conn.rollback()
+            self._owners[threading.current_thread()] = conn
+        return conn
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._acquire()
+            self._local.cursor = conn.cursor()
+        return conn
+
+    @property
+    def cursor(self):
+        self.conn
+        return self._local.cursor
+
+    def _cached(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is None or now - cached[0] > CONFIG_CACHE_SECONDS:
+            cached = (now, loader())
+            with self._lock:
+                self._cache[key] = cached
+        # 返回副本，调用方修改结果不影响缓存
+        return copy.deepcopy(cached[1])
+
+    def invalidate_cache(self):
+        """
+        清空配置缓存，修改 config 或 user_config 表后调用。
+        """
+        with self._lock:
+            self._cache.clear()
 
     def initialize_tables(self):
+        """
+        把表结构迁移到 SCHEMA_VERSION，每个进程对同一个数据库文件只检查一次。
+        """
+        key = os.path.abspath(self.db_file)
+        with _migrated_lock:
+            if key in _migrated_files:
+                return
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self._migrate()
+                self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                self.conn.commit()
+            _migrated_files.add(key)
+
+    def _migrate(self):
+        """
+        创建缺少的表和列。每一步都可以重复执行，旧版本（包括没有记录 user_version 的数据库）直接运行全部步骤。
+        """
         # 初始化 config 表，添加 config_name 用于前端展示
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS config (
                                 config_id INTEGER PRIMARY KEY AUTOINCREMENT, 
@@ -37,6 +140,30 @@ class DBHandler:
                                 metadata_formats TEXT,
                                 size_threshold INTEGER DEFAULT 100)''')
 
+        # 初始化 scheduled_tasks 表，存储定时任务（由 scheduler_daemon.py 调度）
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS scheduled_tasks (
+                                task_id TEXT PRIMARY KEY,
+                                task_name TEXT,
+                                cron_time TEXT,
+                                config_id INTEGER,
+                                task_mode TEXT,
+                                is_enabled INTEGER DEFAULT 1,
+                                next_run_at REAL,  -- 下一次运行的时间戳，为空时由调度器重新计算
+                                last_run_at REAL,
+                                last_status TEXT
+                                )''')
+
+        # 初始化 config_subpaths 表，存储配置下单独设置同步间隔和排除规则的子路径（见 subpaths.py）
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS config_subpaths (
+                                subpath_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                config_id INTEGER NOT NULL,
+                                path TEXT NOT NULL,  -- 相对于 rootpath，空字符串表示整个根目录
+                                refresh_minutes INTEGER DEFAULT 60,
+                                exclude_rules TEXT DEFAULT '',  -- 每行一条，与全局排除规则写法相同
+                                last_synced_at REAL,
+                                UNIQUE (config_id, path)
+                                )''')
+
 
 
         self.conn.commit()
@@ -48,12 +175,25 @@ class DBHandler:
         self.add_column_if_not_exists('config', 'target_directory', 'TEXT')
         self.add_column_if_not_exists('config', 'update_mode', 'TEXT')
         self.add_column_if_not_exists('config', 'download_interval_range', 'TEXT', default_value='1-3')
+        self.add_column_if_not_exists('config', 'crawl_workers', 'INTEGER', default_value=4)
+        self.add_column_if_not_exists('config', 'list_backend', 'TEXT', default_value='webdav')
+        self.add_column_if_not_exists('config', 'download_workers', 'INTEGER', default_value=4)
+        # 遍历前的目录刷新方式和定向刷新的参数（见 refresh_planner.py）
+        self.add_column_if_not_exists('config', 'refresh_mode', 'TEXT', default_value=REFRESH_MODE_ROOT)
+        self.add_column_if_not_exists('config', 'refresh_budget', 'INTEGER', default_value=DEFAULT_REFRESH_BUDGET)
+        self.add_column_if_not_exists('config', 'refresh_max_age', 'INTEGER', default_value=DEFAULT_REFRESH_MAX_AGE_MINUTES)
+        self.add_column_if_not_exists('config', 'hot_paths', 'TEXT', default_value='')
+        self.add_column_if_not_exists('config', 'hot_refresh_minutes', 'INTEGER', default_value=DEFAULT_HOT_REFRESH_MINUTES)
         self.add_column_if_not_exists('user_config', 'size_threshold', 'INTEGER', default_value=100)
         self.add_column_if_not_exists('user_config', 'username', 'TEXT')
         self.add_column_if_not_exists('user_config', 'password', 'TEXT')
+        # 路径包含 / 排除规则，每行一条（见 classifier.py）
+        self.add_column_if_not_exists('user_config', 'include_rules', 'TEXT', default_value='')
+        self.add_column_if_not_exists('user_config', 'exclude_rules', 'TEXT', default_value='')
 
         # 如果 user_config 表为空，插入默认值
         self.insert_default_user_config()
+        self.invalidate_cache()
 
     def add_column_if_not_exists(self, table_name, column_name, column_type, default_value=None):
         """
@@ -140,8 +280,12 @@ class DBHandler:
 
 
     def get_webdav_config(self, config_id):
+        return self._cached(('webdav_config', config_id), lambda: self._load_webdav_config(config_id))
+
+    def _load_webdav_config(self, config_id):
         self.cursor.execute('''
-            SELECT config_name, url, username, password, rootpath, target_directory, download_enabled, update_mode,  download_interval_range
+            SELECT config_name, url, username, password, rootpath, target_directory, download_enabled, update_mode,  download_interval_range, crawl_workers, list_backend, download_workers,
+                   refresh_mode, refresh_budget, refresh_max_age, hot_paths, hot_refresh_minutes
             FROM config
             WHERE config_id=? LIMIT 1
         ''', (config_id,))
@@ -149,7 +293,8 @@ class DBHandler:
         result = self.cursor.fetchone()
 
         if result:
-            config_name, url, username, password, rootpath, target_directory, download_enabled, update_mode, download_interval_range = result
+            (config_name, url, username, password, rootpath, target_directory, download_enabled, update_mode, download_interval_range, crawl_workers, list_backend, download_workers,
+             refresh_mode, refresh_budget, refresh_max_age, hot_paths, hot_refresh_minutes) = result
             parsed_url = urlparse(url)
 
             protocol = parsed_url.scheme
@@ -159,6 +304,11 @@ class DBHandler:
             if download_enabled is None:
                 download_enabled = 1
 
+            # 并发遍历的线程数，至少为 1
+            crawl_workers = max(1, int(crawl_workers or 4))
+            # 并发下载的线程数（同时也是 HTTP 连接池大小），至少为 1
+            download_workers = max(1, int(download_workers or 4))
+
 
 
             # 解析下载间隔范围
@@ -178,24 +328,35 @@ class DBHandler:
                 'target_directory': target_directory,
                 'download_enabled': download_enabled,
                 'update_mode': update_mode,
-                'download_interval_range': (min_interval, max_interval)  # 返回最小和最大间隔
+                'download_interval_range': (min_interval, max_interval),  # 返回最小和最大间隔
+                'crawl_workers': crawl_workers,
+                'list_backend': list_backend or 'webdav',
+                'download_workers': download_workers,
+                'refresh_mode': refresh_mode if refresh_mode in REFRESH_MODES else REFRESH_MODE_ROOT,
+                'refresh_budget': max(0, int(refresh_budget if refresh_budget is not None else DEFAULT_REFRESH_BUDGET)),
+                'refresh_max_age': max(1, int(refresh_max_age or DEFAULT_REFRESH_MAX_AGE_MINUTES)),
+                'hot_paths': hot_paths or '',
+                'hot_refresh_minutes': max(1, int(hot_refresh_minutes or DEFAULT_HOT_REFRESH_MINUTES))
             }
         else:
             return None
 
     def get_script_config(self):
+        return self._cached('script_config', self._load_script_config)
+
+    def _load_script_config(self):
         # 获取脚本的配置（视频、图片、字幕、元数据格式，以及大小阈值）
         self.cursor.execute(
-            "SELECT video_formats, subtitle_formats, image_formats, metadata_formats, size_threshold FROM user_config LIMIT 1")
+            "SELECT video_formats, subtitle_formats, image_formats, metadata_formats, size_threshold, include_rules, exclude_rules FROM user_config LIMIT 1")
         result = self.cursor.fetchone()
 
         # 检查是否获取到数据，如果没有获取到，返回默认配置
         if result is None:
             # 插入默认配置，如果数据不存在
             self.insert_default_user_config()
-            result = ('mp4,mkv,avi', 'srt,ass,sub', 'jpg,png', 'nfo', 100)  # 默认格式和默认大小阈值
+            result = ('mp4,mkv,avi', 'srt,ass,sub', 'jpg,png', 'nfo', 100, '', '')  # 默认格式和默认大小阈值
 
-        video_formats, subtitle_formats, image_formats, metadata_formats, size_threshold = result
+        video_formats, subtitle_formats, image_formats, metadata_formats, size_threshold, include_rules, exclude_rules = result
 
         # 获取 download_enabled
         self.cursor.execute("SELECT download_enabled FROM config LIMIT 1")
@@ -212,6 +373,8 @@ class DBHandler:
             'image_formats': image_formats.split(','),
             'metadata_formats': metadata_formats.split(','),
             'size_threshold': size_threshold,  # 直接返回以MB为单位的大小阈值
+            'include_rules': include_rules or '',
+            'exclude_rules': exclude_rules or '',
             'download_enabled': bool(download_enabled[0])
         }
 
@@ -219,6 +382,9 @@ class DBHandler:
         """
         获取存储在 user_config 表中的用户名和密码哈希值。
         """
+        return self._cached('user_credentials', self._load_user_credentials)
+
+    def _load_user_credentials(self):
         self.cursor.execute('SELECT username, password FROM user_config LIMIT 1')
         result = self.cursor.fetchone()
         if result:
@@ -244,9 +410,94 @@ class DBHandler:
                 UPDATE user_config SET username = ?, password = ?
             ''', (username, password_hash))
         self.conn.commit()
+        self.invalidate_cache()
+
+
+
+    def get_config_subpaths(self, config_id):
+        """
+        获取配置的子路径，按路径排序返回字典列表。同步时间每次运行都会变化，不做缓存。
+        """
+        self.cursor.execute('''
+            SELECT subpath_id, path, refresh_minutes, exclude_rules, last_synced_at
+            FROM config_subpaths WHERE config_id = ? ORDER BY path
+        ''', (config_id,))
+        columns = [column[0] for column in self.cursor.description]
+        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+    def set_config_subpaths(self, config_id, subpaths):
+        """
+        用 subpaths（subpaths.parse_subpaths 的结果）替换配置的子路径，保留仍然存在的子路径的上次同步时间。
+        """
+        paths = [subpath['path'] for subpath in subpaths]
+        self.cursor.execute(f'''
+            DELETE FROM config_subpaths WHERE config_id = ? AND path NOT IN ({','.join('?' * len(paths))})
+        ''', [config_id] + paths)
+        for subpath in subpaths:
+            self.cursor.execute('''
+                INSERT INTO config_subpaths (config_id, path, refresh_minutes, exclude_rules) VALUES (?, ?, ?, ?)
+                ON CONFLICT (config_id, path) DO UPDATE SET refresh_minutes = excluded.refresh_minutes,
+                                                           exclude_rules = excluded.exclude_rules
+            ''', (config_id, subpath['path'], subpath['refresh_minutes'], subpath['exclude_rules']))
+        self.conn.commit()
 
+    def mark_subpaths_synced(self, subpath_ids, synced_at):
+        self.cursor.executemany('UPDATE config_subpaths SET last_synced_at = ? WHERE subpath_id = ?',
+                                [(synced_at, subpath_id) for subpath_id in subpath_ids])
+        self.conn.commit()
+
+    def delete_config_subpaths(self, config_ids):
+        self.cursor.executemany('DELETE FROM config_subpaths WHERE config_id = ?', [(config_id,) for config_id in config_ids])
+        self.conn.commit()
+
+    def get_scheduled_tasks(self):
+        """
+        获取所有定时任务，按添加顺序返回字典列表。
+        """
+        self.cursor.execute('''
+            SELECT task_id, task_name, cron_time, config_id, task_mode, is_enabled, next_run_at, last_run_at, last_status
+            FROM scheduled_tasks ORDER BY rowid
+        ''')
+        columns = [column[0] for column in self.cursor.description]
+        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
 
+    def add_scheduled_task(self, task_id, task_name, cron_time, config_id, task_mode, is_enabled=True):
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO scheduled_tasks (task_id, task_name, cron_time, config_id, task_mode, is_enabled)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (task_id, task_name, cron_time, int(config_id), task_mode, int(bool(is_enabled))))
+        self.conn.commit()
+
+    def update_scheduled_task(self, task_id, task_name, cron_time, config_id, task_mode, is_enabled):
+        """
+        更新定时任务，并清空下一次运行时间，由调度器按新的 cron 表达式重新计算。
+        """
+        self.cursor.execute('''
+            UPDATE scheduled_tasks SET task_name = ?, cron_time = ?, config_id = ?, task_mode = ?, is_enabled = ?, next_run_at = NULL
+            WHERE task_id = ?
+        ''', (task_name, cron_time, int(config_id), task_mode, int(bool(is_enabled)), task_id))
+        self.conn.commit()
+        return self.cursor.rowcount
+
+    def delete_scheduled_tasks(self, task_ids):
+        self.cursor.executemany('DELETE FROM scheduled_tasks WHERE task_id = ?', [(task_id,) for task_id in task_ids])
+        self.conn.commit()
+
+    def set_task_next_run(self, task_id, next_run_at):
+        self.cursor.execute('UPDATE scheduled_tasks SET next_run_at = ? WHERE task_id = ?', (next_run_at, task_id))
+        self.conn.commit()
+
+    def record_task_run(self, task_id, run_at, status):
+        self.cursor.execute('UPDATE scheduled_tasks SET last_run_at = ?, last_status = ? WHERE task_id = ?',
+                            (run_at, status, task_id))
+        self.conn.commit()
 
     def close(self):
-        # 关闭数据库连接
-        self.conn.close()
+        # 关闭所有线程的数据库连接
+        with self._lock:
+            connections = list(self._owners.values()) + self._idle
+            self._owners.clear()
+            self._idle = []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
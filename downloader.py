@@ -0,0 +1,285 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger import log_extra
+from metrics import record_wait
+from pipeline import BackgroundStage
+
+DEFAULT_DOWNLOAD_WORKERS = 4
+# 下载中的临时文件后缀
+PART_SUFFIX = '.part'
+
+
+class DownloadError(Exception):
+    pass
+
+
+def create_session(pool_size=DEFAULT_DOWNLOAD_WORKERS):
+    """
+    创建复用 TCP/TLS 连接的 requests.Session，每个主机最多保持 pool_size 个长连接。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class HostLimiter:
+    """
+    按主机限制并发请求数，同一主机同时进行的下载不超过 per_host 个。
+    """
+
+    def __init__(self, per_host=DEFAULT_DOWNLOAD_WORKERS):
+        self.per_host = max(1, int(per_host))
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, host):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = semaphore
+        with semaphore:
+            yield
+
+
+class ProgressCounter:
+    """
+    线程安全的下载进度计数器。
+    """
+
+    def __init__(self):
+        self.total = 0  # 加入下载的文件数量
+        self.downloaded = 0  # 下载成功的文件数量
+        self.skipped = 0  # 本地已存在而跳过的文件数量
+        self.failed = 0  # 下载失败的文件数量
+        self._lock = threading.Lock()
+
+    def add_total(self, count=1):
+        with self._lock:
+            self.total += count
+
+    def record(self, status):
+        """
+        记录一个文件的处理结果（'downloaded'、'skipped' 或 'failed'），返回 (已处理数, 总数)。
+        """
+        with self._lock:
+            setattr(self, status, getattr(self, status) + 1)
+            return self.downloaded + self.skipped + self.failed, self.total
+
+    def merge(self, other):
+        """
+        合并另一个下载器的进度，返回 self。
+        """
+        with self._lock:
+            self.total += other.total
+            self.downloaded += other.downloaded
+            self.skipped += other.skipped
+            self.failed += other.failed
+        return self
+
+
+class Downloader:
+    """
+    并发下载字幕、图片、元数据等小文件。
+
+    workers 个线程共享一个带连接池的 Session（连接池大小与线程数相同），
+    每次 GET 前向 rate_limiter 申请令牌，并受 host_limiter 的单主机并发上限约束。
+    submit() 只把任务放入队列，调用 start() 后即开始下载，finish() 等待全部任务完成。
+    index_session 用于读取和记录文件的 ETag，以便安全地续传。metrics 记录下载耗时、字节数和续传次数。
+    """
+
+    def __init__(self, config, logger, rate_limiter=None, workers=DEFAULT_DOWNLOAD_WORKERS, session=None, host_limiter=None, index_session=None, metrics=None):
+        self.config = config
+        self.metrics = metrics
+        self.index_session = index_session
+        self.logger = logger
+        self.rate_limiter = rate_limiter
+        self.workers = max(1, int(workers or 1))
+        self.base_url = f"{config['protocol']}://{config['host']}:{config['port']}"
+        self.host = urlparse(self.base_url).netloc
+        self.session = session or create_session(self.workers)
+        self.host_limiter = host_limiter or HostLimiter(self.workers)
+        self.progress = ProgressCounter()
+        self._stage = BackgroundStage(self._run_task, name='download', workers=self.workers)
+
+    def start(self):
+        self._stage.start()
+        return self
+
+    def submit(self, file_name, local_directory, expected_size):
+        self.progress.add_total()
+        self._stage.put((file_name, local_directory, expected_size))
+
+    def finish(self):
+        self._stage.finish()
+
+    def _run_task(self, task):
+        status = self.download(*task)
+        done, total = self.progress.record(status)
+        self.logger.info(f"文件下载进度: {done}/{total}", extra=log_extra('download', 'download_progress'))
+
+    def download(self, file_name, local_directory, expected_size):
+        """
+        下载单个文件，返回 'downloaded'、'skipped' 或 'failed'。
+
+        数据先写入同目录下的 <文件名>.part，大小与索引中的远程大小一致后再原子地重命名为目标文件，
+        索引中没有大小（或为 0）时改用响应的 Content-Length / Content-Range 中的总大小校验，
+        因此目标文件存在即表示下载完整。中断留下的 .part 会在下次下载时通过 HTTP Range 续传，
+        If-Range 携带上次下载时记录的校验值（ETag，服务端未返回 ETag 时为 Last-Modified），
+        远程文件已变化时服务端会返回完整内容；续传响应的校验值与记录的不一致时丢弃临时文件，下次重新下载。
+        没有记录校验值时无法确认临时文件属于当前版本的远程文件，删除临时文件后从头下载。
+        留有临时文件（上次下载失败）时再次发起的下载请求计入 metrics 的 retries。
+        """
+        # 本地文件路径，解码为中文文件名
+        remote_path = unquote(file_name)
+        local_file_path = os.path.join(local_directory, os.path.basename(remote_path))
+        part_path = local_file_path + PART_SUFFIX
+
+        # 如果文件已存在，跳过下载
+        if os.path.exists(local_file_path):
+            self.logger.info(f"跳过文件下载: {local_file_path}（本地已存在）", extra=log_extra('download', 'download_exists'))
+            return 'skipped'
+
+        clean_file_name = file_name.replace('/dav', '')
+        file_url = f"{self.base_url}/d{clean_file_name}"
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        retry = offset > 0
+        validator = None
+        if offset:
+            record = self.index_session.get_file(remote_path) if self.index_session else None
+            validator = record.get('etag') if record else None
+            if not validator:
+                self.logger.info(f"没有记录远程文件的校验值，无法安全续传，从头下载: {part_path}", extra=log_extra('download'))
+        if offset and (not validator or (expected_size and offset > expected_size)):
+            os.remove(part_path)
+            offset = 0
+
+        try:
+            if offset and offset == expected_size:
+                # 上次已完整下载但未来得及重命名
+                self.logger.info(f"临时文件已完整: {part_path}", extra=log_extra('download'))
+                total_size = expected_size
+            else:
+                if retry and self.metrics:
+                    self.metrics.incr('retries')
+                total_size = self._fetch(remote_path, file_url, part_path, offset, expected_size, validator)
+
+            # 校验文件大小是否匹配，索引中没有大小时以响应中的总大小为准
+            expected_size = expected_size or total_size
+            actual_size = os.path.getsize(part_path)
+            if expected_size is None:
+                self.logger.warning(f"无法获取远程文件大小，未校验完整性: {local_file_path}", extra=log_extra('download'))
+            elif actual_size < expected_size:
+                self.logger.warning(f"文件下载不完整，保留临时文件以便续传: {part_path}。预期: {expected_size}，实际: {actual_size}", extra=log_extra('download'))
+                return 'failed'
+            elif actual_size != expected_size:
+                self.logger.warning(f"文件大小不匹配: {local_file_path}。预期: {expected_size}，实际: {actual_size}", extra=log_extra('download'))
+                os.remove(part_path)
+                return 'failed'
+
+            os.chmod(part_path, 0o777)
+            os.replace(part_path, local_file_path)
+            self.logger.info(f"文件已成功下载: {local_file_path}（大小: {actual_size} 字节）", extra=log_extra('download', 'download_done'))
+            return 'downloaded'
+        except Exception as e:
+            self.logger.error(f"下载文件时出错: {file_name}，错误: {e}", extra=log_extra('download'))
+            return 'failed'
+
+    def _fetch(self, remote_path, file_url, part_path, offset, expected_size, validator=None):
+        """
+        将远程文件写入 part_path，offset > 0 时以 validator 作为 If-Range 从该位置续传。
+        返回响应中的文件总大小，未知时为 None。失败时抛出 DownloadError，已写入的数据保留在 part_path 中。
+        """
+        headers = {}
+        if offset:
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = validator
+
+        record_wait(self.metrics, self.rate_limiter)
+        with self.host_limiter.slot(self.host):
+            if offset:
+                if self.metrics:
+                    self.metrics.incr('download_resumes')
+                self.logger.info(f"正在续传文件: {file_url}（从第 {offset} 字节开始）", extra=log_extra('download'))
+            else:
+                self.logger.info(f"正在下载文件: {file_url}", extra=log_extra('download', 'download_start'))
+            request_start = time.perf_counter()
+            with self.session.get(file_url, auth=(self.config['username'], self.config['password']),
+                                  headers=headers, stream=True, allow_redirects=True) as response:
+                if self.metrics:
+                    # 收到响应头的耗时
+                    self.metrics.observe('download_request_seconds', time.perf_counter() - request_start)
+                    self.metrics.incr('download_requests')
+                current_validator = response_validator(response)
+                if response.status_code == 206:
+                    start, total = parse_content_range(response.headers.get('Content-Range'))
+                    if start != offset or (expected_size and total not in (None, expected_size)):
+                        raise DownloadError(f"续传范围不匹配: {response.headers.get('Content-Range')}")
+                    if current_validator and current_validator != validator:
+                        # 服务端忽略了 If-Range，临时文件中的数据属于旧版本的文件
+                        os.remove(part_path)
+                        raise DownloadError(f"远程文件已变化（{validator} -> {current_validator}），已丢弃临时文件")
+                    if total is None:
+                        length = content_length(response)
+                        total = offset + length if length is not None else None
+                    mode = 'ab'
+                elif response.status_code == 200:
+                    # 服务端不支持 Range 或文件已变化，从头下载
+                    total = content_length(response)
+                    mode = 'wb'
+                else:
+                    if response.status_code == 416 and os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise DownloadError(f"状态码: {response.status_code}")
+
+                if current_validator and self.index_session:
+                    self.index_session.set_etag(remote_path, current_validator)
+
+                received = 0
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        f.write(chunk)
+                        received += len(chunk)
+                if self.metrics:
+                    self.metrics.incr('download_bytes', received)
+                    self.metrics.incr('download_transfer_seconds', time.perf_counter() - request_start)
+        return total
+
+
+def parse_content_range(value):
+    """
+    解析 'bytes start-end/total'，返回 (start, total)，total 未知时为 None。
+    """
+    match = re.match(r'^bytes (\d+)-\d+/(\d+|\*)$', (value or '').strip())
+    if not match:
+        return None, None
+    return int(match.group(1)), None if match.group(2) == '*' else int(match.group(2))
+
+
+def content_length(response):
+    """
+    响应体的字节数，未知或内容经过压缩编码时返回 None。
+    """
+    value = response.headers.get('Content-Length')
+    if not value or not value.isdigit() or response.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    return int(value)
+
+
+def response_validator(response):
+    """
+    续传时用作 If-Range 的校验值：响应的 ETag，没有 ETag 时为 Last-Modified，都没有时返回 None。
+    """
+    return response.headers.get('ETag') or response.headers.get('Last-Modified')
@@ -0,0 +1,312 @@
+import glob
+import json
+import os
+import threading
+import time
+from itertools import islice
+
+# 失效文件清单的存放目录（相对于工作目录，与旧版本的目录树 JSON 相同）
+INVALID_FILE_TREES_DIR = 'invalid_file_trees'
+# 清单每行一个 JSON 字符串（相对于目标目录的 .strm 路径），摘要单独存放
+MANIFEST_SUFFIX = '.jsonl'
+SUMMARY_SUFFIX = '.summary.json'
+# 旧版本保存的嵌套目录树
+LEGACY_TREE_PREFIX = 'invalid_file_trees_'
+# 后台删除每批删除的文件数，每批结束后写入一次进度
+DELETE_BATCH_SIZE = 500
+# 每批之间让出的时间（秒），避免长时间占满磁盘 IO
+DELETE_BATCH_PAUSE = 0.01
+DEFAULT_PAGE_SIZE = 200
+
+DELETE_RUNNING = 'running'
+DELETE_DONE = 'done'
+DELETE_FAILED = 'failed'
+
+# 当前进程中正在删除的配置，同一配置同时只有一个删除任务
+_deleting = set()
+_deleting_lock = threading.Lock()
+
+
+def manifest_path(config_id, directory=INVALID_FILE_TREES_DIR):
+    return os.path.join(directory, f'invalid_{config_id}{MANIFEST_SUFFIX}')
+
+
+def summary_path(config_id, directory=INVALID_FILE_TREES_DIR):
+    return os.path.join(directory, f'invalid_{config_id}{SUMMARY_SUFFIX}')
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class ManifestWriter:
+    """
+    以追加方式逐行写入失效文件清单，close() 时写入摘要并替换旧清单。
+    写入过程中旧的清单和摘要保持可读，中途失败时调用 discard() 丢弃临时文件。
+    """
+
+    def __init__(self, config_id, target_directory, scan_mode=None, directory=INVALID_FILE_TREES_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.config_id = config_id
+        self.target_directory = target_directory
+        self.scan_mode = scan_mode
+        self.directory = directory
+        self.path = manifest_path(config_id, directory)
+        self.tmp_path = self.path + '.tmp'
+        self.count = 0
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+
+    def add(self, file_path):
+        relative_path = os.path.relpath(file_path, self.target_directory)
+        self._file.write(json.dumps(relative_path, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self, total_files=None):
+        """
+        完成写入，返回摘要。没有失效文件时删除清单和摘要。
+        """
+        self._file.close()
+        if not self.count:
+            os.remove(self.tmp_path)
+            remove_manifest(self.config_id, self.directory)
+            return None
+        summary = {
+            'config_id': self.config_id,
+            'target_directory': self.target_directory,
+            'scan_mode': self.scan_mode,
+            'count': self.count,
+            'total_files': total_files,
+            'created_at': time.time(),
+            'delete': None
+        }
+        os.replace(self.tmp_path, self.path)
+        _write_json(summary_path(self.config_id, self.directory), summary)
+        return summary
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def write_manifest(config_id, target_directory, invalid_files, scan_mode=None, total_files=None,
+                   directory=INVALID_FILE_TREES_DIR):
+    writer = ManifestWriter(config_id, target_directory, scan_mode, directory)
+    try:
+        for file_path in invalid_files:
+            writer.add(file_path)
+    except BaseException:
+        writer.discard()
+        raise
+    return writer.close(total_files)
+
+
+def remove_manifest(config_id, directory=INVALID_FILE_TREES_DIR):
+    for path in (manifest_path(config_id, directory), summary_path(config_id, directory)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def migrate_legacy_trees(directory=INVALID_FILE_TREES_DIR, target_directory_of=None):
+    """
+    把旧版本的 invalid_file_trees_<config_id>.json 目录树转换为清单后删除。
+    target_directory_of(config_id) 返回配置的目标目录，用于写入摘要。
+    """
+    for tree_path in glob.glob(os.path.join(directory, f'{LEGACY_TREE_PREFIX}*.json')):
+        config_id = os.path.basename(tree_path)[len(LEGACY_TREE_PREFIX):-len('.json')]
+        if not config_id.isdigit():
+            continue
+        config_id = int(config_id)
+        with open(tree_path, 'r', encoding='utf-8') as f:
+            tree = json.load(f)
+
+        def iter_paths(node, prefix):
+            for name, content in node.items():
+                path = os.path.join(prefix, name) if prefix else name
+                if isinstance(content, dict):
+                    yield from iter_paths(content, path)
+                elif content == 'invalid':
+                    yield path
+
+        target_directory = (target_directory_of(config_id) if target_directory_of else None) or ''
+        write_manifest(config_id, target_directory,
+                       (os.path.join(target_directory, path) for path in iter_paths(tree, '')),
+                       directory=directory)
+        os.remove(tree_path)
+
+
+def load_summary(config_id, directory=INVALID_FILE_TREES_DIR):
+    try:
+        with open(summary_path(config_id, directory), 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    delete = summary.get('delete')
+    if delete and delete['state'] == DELETE_RUNNING:
+        with _deleting_lock:
+            interrupted = config_id not in _deleting
+        if interrupted:
+            # 删除过程中网页服务重启，已删除的文件不会再出现在下一次的清单中
+            delete['state'] = DELETE_FAILED
+            delete['error'] = '删除被中断'
+    return summary
+
+
+def list_summaries(directory=INVALID_FILE_TREES_DIR):
+    """
+    所有配置的清单摘要，按 config_id 排序。只读取摘要文件，不读取清单。
+    """
+    summaries = []
+    for path in glob.glob(os.path.join(directory, f'invalid_*{SUMMARY_SUFFIX}')):
+        config_id = os.path.basename(path)[len('invalid_'):-len(SUMMARY_SUFFIX)]
+        if config_id.isdigit():
+            summary = load_summary(int(config_id), directory)
+            if summary:
+                summaries.append(summary)
+    return sorted(summaries, key=lambda summary: summary['config_id'])
+
+
+def iter_manifest(config_id, directory=INVALID_FILE_TREES_DIR):
+    """
+    逐行读取清单，生成相对于目标目录的路径。
+    """
+    with open(manifest_path(config_id, directory), 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_manifest_page(config_id, offset=0, limit=DEFAULT_PAGE_SIZE, directory=INVALID_FILE_TREES_DIR):
+    return list(islice(iter_manifest(config_id, directory), max(0, offset), max(0, offset) + max(0, limit)))
+
+
+def _inside(path, root):
+    return os.path.commonpath([path, root]) == root and path != root
+
+
+class InvalidFileDeleter:
+    """
+    在后台线程中按批删除清单中的 .strm 文件，每批结束后把进度写入摘要的 delete 字段。
+
+    只删除位于目标目录内、以 .strm 结尾的文件；文件删除完后从最深的目录开始尝试 rmdir 空目录，
+    非空目录 rmdir 失败即跳过，不需要逐个列出目录内容。全部完成后删除清单（摘要保留，用于显示结果）。
+    同一配置同时只有一个删除任务。
+    """
+
+    def __init__(self, config_id, target_directory, logger=None, directory=INVALID_FILE_TREES_DIR,
+                 batch_size=DELETE_BATCH_SIZE, pause=DELETE_BATCH_PAUSE):
+        self.config_id = config_id
+        self.target_directory = os.path.abspath(target_directory)
+        self.logger = logger
+        self.directory = directory
+        self.batch_size = batch_size
+        self.pause = pause
+        self.summary = None
+        self.progress = None
+
+    def start(self):
+        """
+        启动后台删除，返回初始进度。清单不存在时抛出 FileNotFoundError，已在删除时返回 None。
+        """
+        self.summary = load_summary(self.config_id, self.directory)
+        if not self.summary or not os.path.exists(manifest_path(self.config_id, self.directory)):
+            raise FileNotFoundError(manifest_path(self.config_id, self.directory))
+        with _deleting_lock:
+            if self.config_id in _deleting:
+                return None
+            _deleting.add(self.config_id)
+        self.progress = {
+            'state': DELETE_RUNNING,
+            'total': self.summary['count'],
+            'processed': 0,
+            'deleted': 0,
+            'missing': 0,
+            'skipped': 0,
+            'removed_directories': 0,
+            'started_at': time.time(),
+            'finished_at': None,
+            'error': None
+        }
+        try:
+            self._save_progress()
+            threading.Thread(target=self._run, name=f'invalid-delete-{self.config_id}', daemon=True).start()
+        except BaseException:
+            with _deleting_lock:
+                _deleting.discard(self.config_id)
+            raise
+        return dict(self.progress)
+
+    def _save_progress(self):
+        summary = dict(self.summary, delete=self.progress)
+        _write_json(summary_path(self.config_id, self.directory), summary)
+
+    def _run(self):
+        directories = set()
+        try:
+            batch = []
+            for relative_path in iter_manifest(self.config_id, self.directory):
+                batch.append(relative_path)
+                if len(batch) >= self.batch_size:
+                    self._delete_batch(batch, directories)
+                    batch = []
+            if batch:
+                self._delete_batch(batch, directories)
+            self._remove_empty_directories(directories)
+            self.progress['state'] = DELETE_DONE
+            # 删除期间重新校验过时清单已被替换，不能删除新的清单
+            current = load_summary(self.config_id, self.directory)
+            if current and current.get('created_at') == self.summary['created_at']:
+                os.remove(manifest_path(self.config_id, self.directory))
+            if self.logger:
+                self.logger.info(f"配置ID {self.config_id} 的失效 .strm 文件删除完成: 删除 {self.progress['deleted']} 个，"
+                                 f"不存在 {self.progress['missing']} 个，跳过 {self.progress['skipped']} 个，"
+                                 f"删除空目录 {self.progress['removed_directories']} 个")
+        except Exception as e:
+            self.progress['state'] = DELETE_FAILED
+            self.progress['error'] = str(e)
+            if self.logger:
+                self.logger.error(f"删除配置ID {self.config_id} 的失效 .strm 文件时出错: {e}")
+        finally:
+            self.progress['finished_at'] = time.time()
+            try:
+                current = load_summary(self.config_id, self.directory)
+                if current and current.get('created_at') == self.summary['created_at']:
+                    self._save_progress()
+            finally:
+                with _deleting_lock:
+                    _deleting.discard(self.config_id)
+
+    def _delete_batch(self, batch, directories):
+        for relative_path in batch:
+            path = os.path.abspath(os.path.join(self.target_directory, relative_path))
+            if not path.endswith('.strm') or not _inside(path, self.target_directory):
+                self.progress['skipped'] += 1
+                continue
+            try:
+                os.remove(path)
+                self.progress['deleted'] += 1
+            except FileNotFoundError:
+                self.progress['missing'] += 1
+            directories.add(os.path.dirname(path))
+        self.progress['processed'] += len(batch)
+        self._save_progress()
+        if self.pause:
+            time.sleep(self.pause)
+
+    def _remove_empty_directories(self, directories):
+        # 把每个目录的上级目录（目标目录以内）也加入，子目录删除后上级可能随之变空
+        candidates = set()
+        for directory in directories:
+            while _inside(directory, self.target_directory) and directory not in candidates:
+                candidates.add(directory)
+                directory = os.path.dirname(directory)
+        for directory in sorted(candidates, key=lambda path: path.count(os.sep), reverse=True):
+            try:
+                os.rmdir(directory)
+                self.progress['removed_directories'] += 1
+            except OSError:
+                # 目录不为空或已不存在
+                pass
@@ -0,0 +1,245 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)
+
+# 只同步指定目录的任务（由 webhook 推送），目录存放在 job_paths 表中
+JOB_TYPE_PARTIAL = 'strm_partial'
+
+# 运行中的任务每隔 LEASE_SECONDS / 3 续租一次，持有者退出后租约在 LEASE_SECONDS 内过期
+LEASE_SECONDS = 120
+# 保留的已结束任务数量
+KEEP_FINISHED_JOBS = 500
+
+
+class ConfigBusyError(Exception):
+    pass
+
+
+def lease_owner():
+    """
+    当前进程的租约持有者标识。
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    基于 SQLite 的运行队列，保证同一配置同时只有一个任务在运行。
+
+    每个任务是 jobs 表中的一行，状态依次为 queued → running → done / failed。
+    running 的任务持有该配置的租约（lease_owner、lease_expires_at），持有者需要定期续租；
+    进程异常退出后租约过期，任务被标记为 failed，配置重新可用。
+
+    - enqueue()：加入队列。同一配置、同一类型已有排队中的任务时合并为一次运行
+    - enqueue_paths()：加入只同步指定目录的任务，短时间内的多次推送合并为一次运行（防抖）
+    - claim()：取出最早的、所属配置当前没有运行中任务的排队任务（调度守护进程使用）
+    - start()：不经过队列直接开始运行，配置正在运行时抛出 ConfigBusyError（命令行和 runner.py 使用）
+
+    app.py、scheduler_daemon.py、runner.py 和 main.py 分属不同进程，通过同一个数据库协调。
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file or os.getenv('DB_FILE', '/config/config.db')
+        self.conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.initialize_tables()
+
+    def initialize_tables(self):
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                config_id INTEGER NOT NULL,
+                                job_type TEXT NOT NULL,  -- 与定时任务的 task_mode 相同
+                                task_id TEXT,
+                                source TEXT,  -- schedule / manual / cli
+                                state TEXT NOT NULL,
+                                enqueued_at REAL,
+                                started_at REAL,
+                                finished_at REAL,
+                                lease_owner TEXT,
+                                lease_expires_at REAL,
+                                coalesced INTEGER DEFAULT 0,  -- 合并进来的重复提交次数
+                                error TEXT
+                                )''')
+        columns = [row['name'] for row in self.conn.execute('PRAGMA table_info(jobs)')]
+        if 'run_after' not in columns:
+            # 排队的任务在该时间之前不会被领取，用于防抖
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN run_after REAL')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, config_id)')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS job_paths (
+                                job_id INTEGER NOT NULL,
+                                path TEXT NOT NULL,  -- 相对于配置 rootpath 的目录，空字符串表示根目录
+                                PRIMARY KEY (job_id, path)
+                                )''')
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE 在读取前就取得写锁，多个进程同时领取任务时不会重复领取
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def _expire_leases(self, conn, now):
+        conn.execute('''UPDATE jobs SET state = ?, finished_at = ?, error = '租约已过期，运行进程可能已退出'
+                        WHERE state = ? AND lease_expires_at < ?''', (JOB_FAILED, now, JOB_RUNNING, now))
+
+    def enqueue(self, config_id, job_type, task_id=None, source='manual'):
+        """
+        加入队列，返回 (job_id, 是否与已有的排队任务合并)。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT job_id FROM jobs WHERE config_id = ? AND job_type = ? AND state = ? LIMIT 1',
+                               (config_id, job_type, JOB_QUEUED)).fetchone()
+            if row:
+                conn.execute('UPDATE jobs SET coalesced = coalesced + 1 WHERE job_id = ?', (row['job_id'],))
+                return row['job_id'], True
+            cursor = conn.execute('''INSERT INTO jobs (config_id, job_type, task_id, source, state, enqueued_at)
+                                     VALUES (?, ?, ?, ?, ?, ?)''', (config_id, job_type, task_id, source, JOB_QUEUED, now))
+            return cursor.lastrowid, False
+
+    def enqueue_paths(self, config_id, paths, debounce_seconds, max_delay_seconds, source='webhook'):
+        """
+        加入只同步 paths 的任务，返回 (job_id, 是否与已有的排队任务合并)。
+
+        任务在最后一次推送 debounce_seconds 秒后才会被领取，期间同一配置的推送都合并到该任务中（目录去重），
+        但从第一次推送算起最多推迟 max_delay_seconds 秒，持续的推送不会让任务一直等待。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT job_id, enqueued_at FROM jobs WHERE config_id = ? AND job_type = ? AND state = ? LIMIT 1',
+                               (config_id, JOB_TYPE_PARTIAL, JOB_QUEUED)).fetchone()
+            if row:
+                job_id = row['job_id']
+                conn.execute('UPDATE jobs SET coalesced = coalesced + 1, run_after = ? WHERE job_id = ?',
+                             (min(now + debounce_seconds, row['enqueued_at'] + max_delay_seconds), job_id))
+            else:
+                job_id = conn.execute('''INSERT INTO jobs (config_id, job_type, source, state, enqueued_at, run_after)
+                                         VALUES (?, ?, ?, ?, ?, ?)''',
+                                      (config_id, JOB_TYPE_PARTIAL, source, JOB_QUEUED, now,
+                                       now + min(debounce_seconds, max_delay_seconds))).lastrowid
+            conn.executemany('INSERT OR IGNORE INTO job_paths (job_id, path) VALUES (?, ?)',
+                             [(job_id, path) for path in paths])
+            return job_id, row is not None
+
+    def get_paths(self, job_id):
+        with self._lock:
+            return [row['path'] for row in
+                    self.conn.execute('SELECT path FROM job_paths WHERE job_id = ? ORDER BY path', (job_id,))]
+
+    def claim(self, owner=None):
+        """
+        领取一个可以运行的排队任务并取得其配置的租约，没有时返回 None。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_leases(conn, now)
+            row = conn.execute('''SELECT * FROM jobs WHERE state = ? AND (run_after IS NULL OR run_after <= ?)
+                                  AND config_id NOT IN (SELECT config_id FROM jobs WHERE state = ?)
+                                  ORDER BY job_id LIMIT 1''', (JOB_QUEUED, now, JOB_RUNNING)).fetchone()
+            if row is None:
+                return None
+            conn.execute('''UPDATE jobs SET state = ?, started_at = ?, lease_owner = ?, lease_expires_at = ?
+                            WHERE job_id = ?''', (JOB_RUNNING, now, owner or lease_owner(), now + LEASE_SECONDS, row['job_id']))
+            return dict(row, state=JOB_RUNNING, started_at=now)
+
+    def start(self, config_id, job_type, task_id=None, source='cli', owner=None):
+        """
+        直接开始运行并取得配置的租约，返回 job_id。配置已有运行中的任务时抛出 ConfigBusyError。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_leases(conn, now)
+            running = conn.execute('SELECT job_id, lease_owner FROM jobs WHERE config_id = ? AND state = ? LIMIT 1',
+                                   (config_id, JOB_RUNNING)).fetchone()
+            if running:
+                raise ConfigBusyError(f"配置ID {config_id} 正在运行（任务 {running['job_id']}，{running['lease_owner']}）")
+            cursor = conn.execute('''INSERT INTO jobs (config_id, job_type, task_id, source, state, enqueued_at, started_at,
+                                     lease_owner, lease_expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                  (config_id, job_type, task_id, source, JOB_RUNNING, now, now,
+                                   owner or lease_owner(), now + LEASE_SECONDS))
+            return cursor.lastrowid
+
+    def renew(self, job_ids):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany('UPDATE jobs SET lease_expires_at = ? WHERE job_id = ? AND state = ?',
+                             [(now + LEASE_SECONDS, job_id, JOB_RUNNING) for job_id in job_ids])
+
+    def finish(self, job_id, success, error=None):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute('''UPDATE jobs SET state = ?, finished_at = ?, lease_expires_at = NULL, error = ?
+                            WHERE job_id = ?''', (JOB_DONE if success else JOB_FAILED, now, error, job_id))
+            # 只保留最近的已结束任务
+            conn.execute('''DELETE FROM jobs WHERE state IN (?, ?) AND job_id NOT IN
+                            (SELECT job_id FROM jobs WHERE state IN (?, ?) ORDER BY job_id DESC LIMIT ?)''',
+                         (JOB_DONE, JOB_FAILED, JOB_DONE, JOB_FAILED, KEEP_FINISHED_JOBS))
+            conn.execute('DELETE FROM job_paths WHERE job_id NOT IN (SELECT job_id FROM jobs)')
+
+    @contextmanager
+    def hold(self, job_id):
+        """
+        在 with 块中后台续租 job_id，退出时根据是否有异常标记为 done 或 failed。
+        """
+        stop = threading.Event()
+
+        def renew_loop():
+            while not stop.wait(LEASE_SECONDS / 3):
+                try:
+                    self.renew([job_id])
+                except sqlite3.Error:
+                    pass
+
+        renewer = threading.Thread(target=renew_loop, name=f'lease-{job_id}', daemon=True)
+        renewer.start()
+        try:
+            yield job_id
+        except BaseException as e:
+            stop.set()
+            self.finish(job_id, False, str(e) or type(e).__name__)
+            raise
+        else:
+            stop.set()
+            self.finish(job_id, True)
+        finally:
+            renewer.join()
+
+    def list_jobs(self, state=None, limit=100):
+        """
+        按 job_id 倒序返回任务列表，运行中任务的过期租约会先被清理。
+        """
+        with self._transaction() as conn:
+            self._expire_leases(conn, time.time())
+        query = 'SELECT * FROM jobs'
+        params = []
+        if state:
+            query += ' WHERE state = ?'
+            params.append(state)
+        query += ' ORDER BY job_id DESC LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(query, params)]
+
+    def summary(self):
+        with self._lock:
+            counts = dict(self.conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return {state: counts.get(state, 0) for state in JOB_STATES}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,114 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+
+from downloader import HostLimiter, create_session
+from metrics import record_wait
+
+DEFAULT_CHECK_WORKERS = 4
+
+# 检查结果
+LINK_VALID = 'valid'
+LINK_INVALID = 'invalid'
+LINK_ERROR = 'error'  # 网络错误等无法判断的情况，不视为无效
+
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+
+class LinkChecker:
+    """
+    并发校验 .strm 中的 AList 直链。
+
+    每个链接先发送 HEAD（不跟随重定向），服务端不支持 HEAD 时改用 Range: bytes=0-0 的 GET，
+    不会下载视频内容。判定规则与原来的 curl 慢扫一致：
+        - 3xx 重定向或 200/206 的非 JSON 响应：有效
+        - AList 返回带 code 字段的 JSON：无效
+        - 4xx/5xx：无效
+    所有请求共享带连接池的 Session、限速器和单主机并发上限，metrics 记录每个请求的耗时。
+    """
+
+    def __init__(self, rate_limiter=None, workers=DEFAULT_CHECK_WORKERS, session=None, host_limiter=None, auth=None, metrics=None):
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.workers = max(1, int(workers or 1))
+        self.session = session or create_session(self.workers)
+        self.host_limiter = host_limiter or HostLimiter(self.workers)
+        self.auth = auth
+
+    def check(self, url):
+        """
+        校验单个链接，返回 (结果, 说明)。
+        """
+        try:
+            response = self._request('HEAD', url)
+            # HEAD 不被支持，或返回的是 JSON（需要读取响应体中的 code）时，改用只取 1 字节的 GET
+            if response.status_code in (405, 501) or (response.status_code == 200 and is_json_response(response)):
+                response = self._request('GET', url, headers={'Range': 'bytes=0-0'})
+            return classify_response(response)
+        except Exception as e:
+            return LINK_ERROR, str(e)
+
+    def _request(self, method, url, headers=None):
+        record_wait(self.metrics, self.rate_limiter)
+        with self.host_limiter.slot(urlparse(url).netloc):
+            # HEAD 没有响应体，不使用 stream 才能让连接回到连接池
+            start = time.perf_counter()
+            response = self.session.request(method, url, headers=headers, auth=self.auth,
+                                            allow_redirects=False, stream=method != 'HEAD', timeout=30)
+            if self.metrics:
+                self.metrics.observe('link_check_seconds', time.perf_counter() - start)
+                self.metrics.incr('link_check_requests')
+            if method != 'HEAD':
+                # 错误 JSON 和 206 的 1 字节响应体都很小，读完后连接可以复用；
+                # 其他情况（例如服务端忽略 Range 返回整个视频）直接关闭连接
+                if is_json_response(response) or response.status_code in (206,) + REDIRECT_STATUS_CODES:
+                    response.content
+                response.close()
+        return response
+
+    def check_all(self, items):
+        """
+        并发校验 items 中的 (key, url)，按完成顺序产出 (key, url, 结果, 说明)。
+        同时在途的请求不超过 workers 的 4 倍，items 可以是生成器。
+        """
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+
+            def fill():
+                while len(pending) < self.workers * 4:
+                    try:
+                        key, url = next(items)
+                    except StopIteration:
+                        return
+                    pending[executor.submit(self.check, url)] = (key, url)
+
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, url = pending.pop(future)
+                    result, detail = future.result()
+                    yield key, url, result, detail
+                fill()
+
+
+def is_json_response(response):
+    return 'json' in (response.headers.get('Content-Type') or '').lower()
+
+
+def classify_response(response):
+    status = response.status_code
+    if status in REDIRECT_STATUS_CODES:
+        return LINK_VALID, f"{status} -> {response.headers.get('Location', '')}"
+    if status >= 400:
+        return LINK_INVALID, f"HTTP {status}"
+    if is_json_response(response):
+        try:
+            payload = json.loads(response.content or b'{}')
+        except ValueError:
+            return LINK_VALID, f"HTTP {status}"
+        if isinstance(payload, dict) and 'code' in payload:
+            return LINK_INVALID, f"code: {payload['code']} {payload.get('message', '')}".strip()
+    return LINK_VALID, f"HTTP {status}"
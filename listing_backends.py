@@ -0,0 +1,172 @@
+import re
+import threading
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from urllib.parse import quote, unquote
+
+import easywebdav
+import requests
+
+# AList 的 WebDAV 服务挂载在 /dav 下，/api/fs/list 使用的是去掉该前缀后的路径
+WEBDAV_PREFIX = '/dav'
+
+LIST_BACKENDS = ('webdav', 'api')
+# 列表请求遇到这些状态码（限流或服务端暂时错误）时重试
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def make_entry(href, size, modified, is_directory):
+    """
+    构建列表后端返回的统一记录。href 为 WebDAV 风格的 URL 编码路径（目录以 / 结尾），
+    name 为解码后的完整路径，与目录树缓存中的 name 字段一致。
+    """
+    return {
+        'href': href,
+        'name': unquote(href),
+        'size': size,
+        'modified': modified,
+        'is_directory': is_directory
+    }
+
+
+class WebDAVBackend:
+    """
+    基于 easywebdav PROPFIND 的列表后端。每个线程持有独立的连接。
+    """
+
+    name = 'webdav'
+
+    def __init__(self, config):
+        self.config = config
+        self._local = threading.local()
+
+    def _get_client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = easywebdav.connect(
+                host=self.config['host'],
+                port=self.config['port'],
+                username=self.config['username'],
+                password=self.config['password'],
+                protocol=self.config['protocol']
+            )
+            self._local.client = client
+        return client
+
+    def list_directory(self, directory):
+        """
+        列出单个目录（PROPFIND Depth: 1）。PROPFIND 的结果中包含目录自身，这里将其剔除。
+        """
+        entries = []
+        for f in self._get_client().ls(directory):
+            if unquote(f.name).rstrip('/') == unquote(directory).rstrip('/'):
+                continue
+            entries.append(make_entry(f.name, f.size, f.mtime, f.name.endswith('/')))
+        return entries
+
+
+class AListAPIBackend:
+    """
+    基于 AList /api/fs/list JSON 接口的列表后端，按 per_page 分页拉取，复用已获取的 JWT。
+    返回的记录与 WebDAVBackend 相同：href 补回 /dav 前缀并做 URL 编码，修改时间转换为
+    WebDAV getlastmodified 使用的 RFC 1123 格式，保证切换后端后缓存比较结果不变。
+    传入 session 时使用共享的连接池（见 runner.py），否则每个线程持有独立的 Session。
+    """
+
+    name = 'api'
+
+    def __init__(self, config, token, per_page=1000, session=None):
+        self.config = config
+        self.token = token
+        self.per_page = per_page
+        self.session = session
+        self.base_url = f"{config['protocol']}://{config['host']}:{config['port']}"
+        self._local = threading.local()
+
+    def _get_session(self):
+        if self.session is not None:
+            return self.session
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def list_directory(self, directory):
+        decoded_directory = unquote(directory).rstrip('/')
+        api_path = decoded_directory[len(WEBDAV_PREFIX):] if decoded_directory.startswith(WEBDAV_PREFIX) else decoded_directory
+        api_path = api_path or '/'
+
+        entries = []
+        page = 1
+        while True:
+            # AList 直接校验 Authorization 头中的 JWT，不带 Bearer 前缀；共享 Session 时按请求携带
+            response = self._get_session().post(f"{self.base_url}/api/fs/list", headers={'Authorization': self.token}, json={
+                'path': api_path,
+                'password': '',
+                'page': page,
+                'per_page': self.per_page,
+                'refresh': False
+            })
+            response.raise_for_status()
+            data = response.json()
+            if data.get('code') != 200:
+                raise RuntimeError(f"/api/fs/list 返回错误: {data.get('code')} {data.get('message')}")
+
+            content = (data.get('data') or {}).get('content') or []
+            for item in content:
+                is_directory = bool(item.get('is_dir'))
+                path = f"{decoded_directory}/{item['name']}" + ('/' if is_directory else '')
+                entries.append(make_entry(quote(path), item.get('size', 0),
+                                          format_api_modified(item.get('modified', '')), is_directory))
+
+            total = (data.get('data') or {}).get('total') or 0
+            if not content or len(entries) >= total:
+                return entries
+            page += 1
+
+
+def format_api_modified(value):
+    """
+    将 AList 返回的 ISO 8601 时间（可能带 7 位小数和时区）转换为 RFC 1123 GMT 格式。
+    无法解析时原样返回。
+    """
+    match = re.match(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.\d+)?(Z|[+-]\d{2}:\d{2})?$', value or '')
+    if not match:
+        return value
+    offset = match.group(2) or 'Z'
+    if offset == 'Z':
+        offset = '+00:00'
+    dt = datetime.fromisoformat(match.group(1) + offset)
+    return format_datetime(dt.astimezone(timezone.utc), usegmt=True)
+
+
+def retryable_status(error):
+    """
+    列表请求失败后可以重试时返回 HTTP 状态码（429 或 5xx），否则返回 None。
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+    elif isinstance(error, easywebdav.OperationFailed):
+        status = error.actual_code
+    else:
+        return None
+    return status if status in RETRYABLE_STATUS_CODES else None
+
+
+def retry_after(error):
+    """
+    响应中 Retry-After 头给出的等待秒数，没有或不是秒数时返回 None。
+    """
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    return int(value) if value and value.isdigit() else None
+
+
+def create_list_backend(config, token=None, session=None):
+    """
+    根据配置中的 list_backend 创建列表后端。JSON 接口需要 JWT，拿不到时回退到 WebDAV。
+    """
+    if config.get('list_backend') == 'api' and token:
+        return AListAPIBackend(config, token, session=session)
+    return WebDAVBackend(config)
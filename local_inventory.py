@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from classifier import local_relative_path
+
+# 修改时间距扫描时刻太近的目录不写入缓存的 mtime，避免同一时间粒度内的后续修改被漏掉
+RACY_MTIME_SECONDS = 2
+
+
+def relative_key(root, directory):
+    """
+    目录相对于 root 的路径，root 自身为 '.'，与 os.path.relpath 一致。
+    """
+    return os.path.relpath(directory, root)
+
+
+def subtree_range(key):
+    """
+    返回 key 子树（不含 key 本身）在 path 上的范围 [lower, upper)。
+    """
+    if key == '.':
+        return '', '\U0010ffff'
+    lower = key + os.sep
+    return lower, key + chr(ord(os.sep) + 1)
+
+
+class LocalInventory:
+    """
+    本地目标目录的清单扫描器，基于 os.scandir 并持久化每个目录的 (mtime, 子项列表)。
+
+    再次扫描时每个目录只需一次 stat：修改时间未变的目录直接使用缓存的子项列表，
+    只有新增、删除或重命名过子项的目录才会重新 scandir。目录的修改时间不会随文件内容
+    变化，因此清单只记录文件名；.strm 文件的内容由 StrmWriter 写入时单独记录在 strm_contents 表中。
+
+    缓存存放在独立的 SQLite 数据库中（INVENTORY_DB_FILE，默认 /config/local_inventory.db），
+    以目标目录的绝对路径区分不同的配置。
+    """
+
+    def __init__(self, root, db_file=None, logger=None):
+        self.root = os.path.abspath(root)
+        self.logger = logger
+        self.db_file = db_file or os.getenv('INVENTORY_DB_FILE', '/config/local_inventory.db')
+        self.conn = sqlite3.connect(self.db_file, timeout=30)
+        self.initialize_tables()
+        self.scanned_directories = 0
+        self.cached_directories = 0
+
+    def initialize_tables(self):
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS local_directories (
+                                root TEXT NOT NULL,
+                                path TEXT NOT NULL,
+                                mtime_ns INTEGER,
+                                dirs TEXT,
+                                files TEXT,
+                                PRIMARY KEY (root, path)
+                                )''')
+        # 本程序写入的 .strm 文件内容，用于判断链接是否需要更新
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS strm_contents (
+                                root TEXT NOT NULL,
+                                dir TEXT NOT NULL,
+                                name TEXT NOT NULL,
+                                content TEXT,
+                                PRIMARY KEY (root, dir, name)
+                                )''')
+        self.conn.commit()
+
+    def _load_all(self):
+        """
+        一次性读取该目录的全部缓存行，子项列表在用到时才解析。
+        """
+        rows = self.conn.execute('SELECT path, mtime_ns, dirs, files FROM local_directories WHERE root = ?', (self.root,))
+        return {row[0]: row[1:] for row in rows}
+
+    def _scandir(self, directory):
+        dirs, files = [], []
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif not entry.is_dir():
+                        # 与 os.walk 一致：指向目录的符号链接既不作为文件，也不进入遍历
+                        files.append(entry.name)
+                except OSError:
+                    continue
+        return dirs, files
+
+    def walk(self, classifier=None, start=None):
+        """
+        与 os.walk(root) 相同，自顶向下产出 (目录绝对路径, 子目录名列表, 文件名列表)，
+        调用方可以原地修改子目录名列表来跳过子树。classifier 的排除规则匹配的子目录不会被遍历。
+        start 为 root 下的某个目录时只遍历该子树，其他目录的缓存保持不变。
+        遍历结束后把变化的目录写回缓存。
+        """
+        prune = classifier is not None and bool(classifier.exclude)
+        self.scanned_directories = 0
+        self.cached_directories = 0
+        now_ns = time.time_ns()
+        cache = self._load_all()
+        stack = [start or self.root]
+        try:
+            while stack:
+                directory = stack.pop()
+                key = relative_key(self.root, directory)
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+
+                cached = cache.pop(key, None)
+                if cached and cached[0] == mtime_ns:
+                    dirs, files = json.loads(cached[1]), json.loads(cached[2])
+                    self.cached_directories += 1
+                else:
+                    try:
+                        dirs, files = self._scandir(directory)
+                    except OSError as e:
+                        if self.logger:
+                            self.logger.error(f"读取本地目录出错: {directory}，错误: {e}")
+                        continue
+                    self.scanned_directories += 1
+                    self._save(key, mtime_ns, now_ns, dirs, files, json.loads(cached[1]) if cached else [])
+
+                if prune:
+                    # 缓存中保存的是完整的子目录列表，这里只影响本次遍历
+                    dirs = [name for name in dirs
+                            if not classifier.is_excluded_directory(local_relative_path(os.path.join(directory, name), self.root))]
+                yield directory, dirs, files
+                stack.extend(os.path.join(directory, name) for name in reversed(dirs))
+        finally:
+            self.conn.commit()
+
+        if self.logger:
+            self.logger.info(f"本地目录扫描完成: 重新读取 {self.scanned_directories} 个目录，"
+                             f"使用缓存 {self.cached_directories} 个目录")
+
+    def _save(self, key, mtime_ns, now_ns, dirs, files, previous_dirs):
+        if now_ns - mtime_ns < RACY_MTIME_SECONDS * 1_000_000_000:
+            mtime_ns = None
+        self.conn.execute('INSERT OR REPLACE INTO local_directories (root, path, mtime_ns, dirs, files) VALUES (?, ?, ?, ?, ?)',
+                          (self.root, key, mtime_ns, json.dumps(dirs, ensure_ascii=False), json.dumps(files, ensure_ascii=False)))
+        # 已删除或改名的子目录，连同其子树一起从缓存中删除
+        for name in set(previous_dirs) - set(dirs):
+            child = os.path.join(key, name) if key != '.' else name
+            lower, upper = subtree_range(child)
+            self.conn.execute('DELETE FROM local_directories WHERE root = ? AND (path = ? OR (path >= ? AND path < ?))',
+                              (self.root, child, lower, upper))
+
+    def iter_files(self, suffix=None, classifier=None):
+        """
+        产出所有文件的绝对路径，可按后缀（不区分大小写）过滤。
+        指定 classifier 时跳过排除规则匹配的目录和文件。
+        """
+        suffix = suffix.lower() if suffix else None
+        excluded = classifier is not None and bool(classifier.exclude)
+        for directory, dirs, files in self.walk(classifier=classifier):
+            for name in files:
+                if suffix is None or name.lower().endswith(suffix):
+                    path = os.path.join(directory, name)
+                    if excluded and classifier.exclude.matches(local_relative_path(path, self.root)):
+                        continue
+                    yield path
+
+    def load_strm_contents(self, key):
+        """
+        返回目录 key（相对路径）下已记录的 .strm 内容 {文件名: 内容}。
+        """
+        rows = self.conn.execute('SELECT name, content FROM strm_contents WHERE root = ? AND dir = ?', (self.root, key))
+        return dict(rows)
+
+    def save_strm_contents(self, rows):
+        """
+        记录 .strm 内容，rows 为 (目录相对路径, 文件名, 内容)。
+        """
+        self.conn.executemany('INSERT OR REPLACE INTO strm_contents (root, dir, name, content) VALUES (?, ?, ?, ?)',
+                              [(self.root, key, name, content) for key, name, content in rows])
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute('DELETE FROM local_directories WHERE root = ?', (self.root,))
+        self.conn.execute('DELETE FROM strm_contents WHERE root = ?', (self.root,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("用法: python local_inventory.py <target_directory>")
+        sys.exit(1)
+
+    inventory = LocalInventory(sys.argv[1])
+    try:
+        start = time.perf_counter()
+        file_count = sum(len(files) for _, _, files in inventory.walk())
+        print(f"共 {file_count} 个文件，重新读取 {inventory.scanned_directories} 个目录，"
+              f"使用缓存 {inventory.cached_directories} 个目录，耗时 {time.perf_counter() - start:.2f} 秒")
+    finally:
+        inventory.close()
+
+
+if __name__ == '__main__':
+    main()
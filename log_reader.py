@@ -0,0 +1,335 @@
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+
+# 行偏移索引文件的后缀，与日志文件放在同一目录（logger.py 在轮转和清理日志时一并处理）
+LOG_INDEX_SUFFIX = '.idx'
+# 索引文件头：魔数、日志文件 inode、已索引的字节数、行首偏移数量
+INDEX_HEADER = struct.Struct('<8sQQQ')
+INDEX_MAGIC = b'ALSIDX01'
+# 从文件末尾向前读取、扫描换行符时每次读取的块大小
+BLOCK_SIZE = 64 * 1024
+SCAN_BLOCK_SIZE = 1024 * 1024
+DEFAULT_PER_PAGE = 100
+# 按条件过滤时每次向前读取的行数，以及单次请求最多扫描的行数
+SEARCH_BATCH_LINES = 2000
+SEARCH_MAX_LINES = 200000
+
+# 旧版文本格式的日志行：时间 - [名称] - 级别 - 内容
+TEXT_LINE_PATTERN = re.compile(r'^(\S+ \S+) - \[(.*?)\] - ([A-Z]+) - (.*)$')
+
+# 同一进程中的多个请求线程不能同时更新同一个索引文件
+_index_locks = {}
+_index_locks_guard = threading.Lock()
+
+
+def index_path_for(log_path):
+    return log_path + LOG_INDEX_SUFFIX
+
+
+def _index_lock(log_path):
+    with _index_locks_guard:
+        return _index_locks.setdefault(os.path.abspath(log_path), threading.Lock())
+
+
+def decode_line(data):
+    return data.decode('utf-8', errors='replace').rstrip('\r\n')
+
+
+def parse_log_line(line):
+    """
+    解析一行日志，返回包含 ts、level、logger、run_id、config_id、task_id、stage、msg 的字典。
+    兼容 logger.py 写入的 JSON 行和旧版本的文本行。
+    """
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+            if isinstance(entry, dict) and 'msg' in entry:
+                return entry
+        except ValueError:
+            pass
+    match = TEXT_LINE_PATTERN.match(line)
+    if match:
+        ts, name, level, message = match.groups()
+        return {'ts': ts, 'level': level, 'logger': name, 'msg': message}
+    return {'msg': line}
+
+
+def format_log_entry(entry):
+    """
+    把解析后的日志格式化为一行文本，用于页面显示。
+    """
+    if 'level' not in entry:
+        return entry.get('msg', '')
+    stage = f"[{entry['stage']}] " if entry.get('stage') else ''
+    return f"{entry.get('ts', '')} - [{entry.get('logger', '')}] - {entry['level']} - {stage}{entry.get('msg', '')}"
+
+
+class LogFilter:
+    """
+    日志过滤条件：最低级别、阶段、run_id 和关键字，未设置的条件不参与过滤。
+    """
+
+    def __init__(self, level=None, stage=None, run_id=None, keyword=None):
+        self.level = logging.getLevelName(level.upper()) if level else None
+        if not isinstance(self.level, int):
+            self.level = None
+        self.stage = stage or None
+        self.run_id = run_id or None
+        self.keyword = keyword or None
+
+    @property
+    def active(self):
+        return any(value is not None for value in (self.level, self.stage, self.run_id, self.keyword))
+
+    def matches(self, entry):
+        if self.level is not None:
+            level = logging.getLevelName(entry.get('level') or 'NOTSET')
+            if not isinstance(level, int) or level < self.level:
+                return False
+        if self.stage is not None and entry.get('stage') != self.stage:
+            return False
+        if self.run_id is not None and entry.get('run_id') != self.run_id:
+            return False
+        if self.keyword is not None and self.keyword not in entry.get('msg', ''):
+            return False
+        return True
+
+
+def tail_lines(log_path, count, block_size=BLOCK_SIZE):
+    """
+    从文件末尾按块向前读取，返回最后 count 行（按文件中的顺序），耗时只与 count 有关。
+    """
+    if count <= 0:
+        return []
+    with open(log_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # 多读一行，保证第一行是完整的
+        while position > 0 and data.count(b'\n') <= count:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    lines = data.split(b'\n')
+    if lines and lines[-1] == b'':
+        lines.pop()
+    return [decode_line(line) for line in lines[-count:]]
+
+
+class LogReader:
+    """
+    按行分页读取日志文件，不把整个文件读入内存。
+
+    日志旁边维护一个行偏移索引文件（<日志>.idx），记录每一行的起始字节偏移。
+    每次打开时只读取索引的文件头，并扫描上次索引之后新写入的部分；跳转到任意一页只需从索引中
+    读取两个偏移，再读取该页的内容，耗时与日志大小无关。
+    日志文件被轮转（inode 变化）或截断时索引自动重建。第 1 页为最新的日志。
+    """
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.index_path = index_path_for(log_path)
+        self.count = 0  # 索引中的行首偏移数量
+        self.last_offset = 0
+        self.indexed_bytes = 0
+        self.size = 0
+        self._memory_offsets = None  # 索引文件无法写入时在内存中保存全部偏移
+        self.refresh()
+
+    def refresh(self):
+        """
+        把索引更新到日志文件的当前末尾。
+        """
+        with _index_lock(self.log_path):
+            stat = os.stat(self.log_path)
+            self.size = stat.st_size
+            loaded = self._load_header(stat.st_ino)
+            if loaded and self.indexed_bytes == self.size:
+                return
+            if not loaded:
+                self.indexed_bytes = 0
+                self.count, self.last_offset = 0, 0
+            offsets = array('Q') if loaded else array('Q', [0])
+            self._scan(self.indexed_bytes, self.size, offsets)
+            self.indexed_bytes = self.size
+            self.count += len(offsets)
+            if offsets:
+                self.last_offset = offsets[-1]
+            try:
+                self._save_index(stat.st_ino, offsets, append=loaded)
+            except OSError:
+                # 日志目录不可写时只在内存中使用索引
+                self._memory_offsets = array('Q', [0])
+                self._scan(0, self.size, self._memory_offsets)
+
+    def _load_header(self, inode):
+        try:
+            with open(self.index_path, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) != INDEX_HEADER.size:
+                    return False
+                magic, indexed_inode, indexed_bytes, count = INDEX_HEADER.unpack(header)
+                if magic != INDEX_MAGIC or indexed_inode != inode or indexed_bytes > self.size or not count:
+                    return False
+                f.seek(INDEX_HEADER.size + (count - 1) * 8)
+                last = f.read(8)
+        except (OSError, struct.error):
+            return False
+        if len(last) != 8:
+            return False
+        self.count = count
+        self.last_offset = struct.unpack('<Q', last)[0]
+        self.indexed_bytes = indexed_bytes
+        return True
+
+    def _scan(self, start, end, offsets):
+        """
+        扫描 [start, end) 中的换行符，把新行的起始偏移追加到 offsets。
+        """
+        with open(self.log_path, 'rb') as f:
+            f.seek(start)
+            position = start
+            while position < end:
+                block = f.read(min(SCAN_BLOCK_SIZE, end - position))
+                if not block:
+                    break
+                newline = block.find(b'\n')
+                while newline != -1:
+                    offsets.append(position + newline + 1)
+                    newline = block.find(b'\n', newline + 1)
+                position += len(block)
+
+    def _save_index(self, inode, offsets, append):
+        """
+        append 为 True 时只追加新的偏移，否则重写整个索引文件。
+        """
+        header = INDEX_HEADER.pack(INDEX_MAGIC, inode, self.indexed_bytes, self.count)
+        if append:
+            # 先追加新的偏移，再更新文件头；追加中途失败时文件头中的数量仍然有效
+            with open(self.index_path, 'r+b') as f:
+                f.seek(INDEX_HEADER.size + (self.count - len(offsets)) * 8)
+                f.truncate()
+                f.write(offsets.tobytes())
+                f.seek(0)
+                f.write(header)
+        else:
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(offsets.tobytes())
+            os.replace(tmp_path, self.index_path)
+
+    def _offsets(self, *line_numbers):
+        if self._memory_offsets is not None:
+            return [self._memory_offsets[i] for i in line_numbers]
+        result = []
+        with open(self.index_path, 'rb') as f:
+            for i in line_numbers:
+                f.seek(INDEX_HEADER.size + i * 8)
+                result.append(struct.unpack('<Q', f.read(8))[0])
+        return result
+
+    @property
+    def line_count(self):
+        # 最后一个偏移等于文件末尾时表示最后一行以换行符结尾，之后还没有新行
+        return self.count - (1 if self.last_offset >= self.indexed_bytes else 0)
+
+    def total_pages(self, per_page=DEFAULT_PER_PAGE):
+        return max(1, (self.line_count + per_page - 1) // per_page)
+
+    def read_lines(self, start, end):
+        """
+        返回第 [start, end) 行（从 0 开始）。
+        """
+        start = max(0, start)
+        end = min(end, self.line_count)
+        if start >= end:
+            return []
+        if end < self.count:
+            begin_offset, end_offset = self._offsets(start, end)
+        else:
+            begin_offset, = self._offsets(start)
+            end_offset = self.indexed_bytes
+        with open(self.log_path, 'rb') as f:
+            f.seek(begin_offset)
+            data = f.read(end_offset - begin_offset)
+        lines = data.split(b'\n')
+        if lines and lines[-1] == b'':
+            lines.pop()
+        return [decode_line(line) for line in lines]
+
+    def page(self, page, per_page=DEFAULT_PER_PAGE):
+        """
+        返回第 page 页的日志行（第 1 页为最新的 per_page 行），按文件中的顺序排列。
+        """
+        end = self.line_count - (page - 1) * per_page
+        return self.read_lines(end - per_page, end)
+
+    def search(self, log_filter, before=None, limit=DEFAULT_PER_PAGE, max_lines=SEARCH_MAX_LINES):
+        """
+        从第 before 行（不含，默认为文件末尾）向前查找符合 log_filter 的日志，最多返回 limit 条，
+        最多扫描 max_lines 行。返回 (解析后的日志列表（按文件中的顺序）, 下一次查找的 before)，
+        已查找到文件开头时 before 为 None。
+        """
+        end = self.line_count if before is None else min(max(before, 0), self.line_count)
+        matched = []
+        scanned = 0
+        while end > 0 and len(matched) < limit and scanned < max_lines:
+            start = max(0, end - SEARCH_BATCH_LINES)
+            lines = self.read_lines(start, end)
+            for offset in range(len(lines) - 1, -1, -1):
+                entry = parse_log_line(lines[offset])
+                if log_filter.matches(entry):
+                    matched.append(entry)
+                    if len(matched) >= limit:
+                        end = start + offset
+                        break
+            else:
+                end = start
+            scanned += len(lines)
+        matched.reverse()
+        return matched, (end if end > 0 else None)
+
+
+def follow(log_path, offset, poll_interval=1.0, max_seconds=3600, keepalive_seconds=15):
+    """
+    从 offset 开始持续读取 log_path 中新写入的完整行，生成 (下一行的偏移, 行内容)。
+    没有新内容时每隔 keepalive_seconds 生成一次 (offset, None) 作为心跳；
+    日志被轮转或截断时生成 (None, None) 后结束，最多运行 max_seconds 秒。
+    """
+    deadline = time.monotonic() + max_seconds
+    last_sent = time.monotonic()
+    inode = os.stat(log_path).st_ino
+    buffer = b''
+    with open(log_path, 'rb') as f:
+        f.seek(offset)
+        while time.monotonic() < deadline:
+            chunk = f.read(BLOCK_SIZE)
+            if chunk:
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    offset += len(line) + 1
+                    yield offset, decode_line(line)
+                if lines:
+                    last_sent = time.monotonic()
+                continue
+
+            try:
+                stat = os.stat(log_path)
+            except OSError:
+                stat = None
+            if stat is None or stat.st_ino != inode or stat.st_size < offset + len(buffer):
+                yield None, None
+                return
+            if time.monotonic() - last_sent >= keepalive_seconds:
+                last_sent = time.monotonic()
+                yield offset, None
+            time.sleep(poll_interval)
@@ -1,9 +1,174 @@
+import atexit
+import json
 import logging
 import os
 import glob
+import queue
+import threading
+import uuid
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 
-def setup_logger(log_name, task_id=None):
+from log_reader import index_path_for
+
+# 逐文件日志（带 sample 字段）的采样：每个阶段的每类日志先完整记录前 LOG_SAMPLE_FIRST 条，
+# 之后每 LOG_SAMPLE_EVERY 条记录 1 条。LOG_SAMPLE_EVERY 为 1 时不采样
+DEFAULT_SAMPLE_FIRST = 20
+DEFAULT_SAMPLE_EVERY = 100
+
+# 日志文件中每行一个 JSON 对象包含的字段
+LOG_FIELDS = ('ts', 'level', 'logger', 'run_id', 'config_id', 'task_id', 'stage', 'msg')
+CONSOLE_FORMAT = '%(asctime)s - [%(name)s] - %(levelname)s - %(message)s'
+
+# 每个 logger 的 QueueListener，重新 setup_logger 或进程退出时停止并写完队列中的日志
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def log_extra(stage, sample=None):
+    """
+    生成日志调用的 extra 参数：stage 为日志所属阶段，sample 为逐文件日志的采样键。
+    """
+    extra = {'stage': stage}
+    if sample:
+        extra['sample'] = sample
+    return extra
+
+
+class LogContext(logging.Filter):
+    """
+    为每条日志附加 run_id、config_id、task_id 和 stage 字段。
+    调用时通过 extra 指定的 stage 优先，否则使用 set_log_stage() 设置的当前阶段。
+    """
+
+    def __init__(self, run_id, config_id=None, task_id=None):
+        super().__init__()
+        self.run_id = run_id
+        self.config_id = config_id
+        self.task_id = task_id
+        self.stage = None
+
+    def filter(self, record):
+        record.run_id = self.run_id
+        record.config_id = self.config_id
+        record.task_id = self.task_id
+        if getattr(record, 'stage', None) is None:
+            record.stage = self.stage
+        return True
+
+
+class LogSampler(logging.Filter):
+    """
+    对带 sample 字段的逐文件日志按 (stage, sample) 采样，被丢弃的日志只计数，不格式化也不进入队列。
+    WARNING 及以上级别的日志不采样。
+    """
+
+    def __init__(self, first=DEFAULT_SAMPLE_FIRST, every=DEFAULT_SAMPLE_EVERY):
+        super().__init__()
+        self.first = max(0, first)
+        self.every = max(1, every)
+        self.seen = {}
+        self.dropped = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        sample = getattr(record, 'sample', None)
+        if sample is None or record.levelno >= logging.WARNING or self.every == 1:
+            return True
+        key = (record.stage, sample)
+        with self._lock:
+            count = self.seen[key] = self.seen.get(key, 0) + 1
+            if count <= self.first or (count - self.first) % self.every == 0:
+                return True
+            self.dropped[key] = self.dropped.get(key, 0) + 1
+        return False
+
+    def take_summary(self):
+        """
+        返回并清空 {(stage, sample): (总条数, 丢弃条数)}。
+        """
+        with self._lock:
+            summary = {key: (self.seen[key], dropped) for key, dropped in self.dropped.items()}
+            self.seen, self.dropped = {}, {}
+        return summary
+
+
+class JsonLineFormatter(logging.Formatter):
+    """
+    每条日志输出为一行 JSON，供 app.py 的日志页面按 level、stage、run_id 过滤。
+    """
+
+    def format(self, record):
+        data = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'run_id': getattr(record, 'run_id', None),
+            'config_id': getattr(record, 'config_id', None),
+            'task_id': getattr(record, 'task_id', None),
+            'stage': getattr(record, 'stage', None),
+            'msg': record.getMessage()
+        }
+        if getattr(record, 'sample', None):
+            data['sample'] = record.sample
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _filter_of(logger, filter_type):
+    for log_filter in logger.filters:
+        if isinstance(log_filter, filter_type):
+            return log_filter
+    return None
+
+
+def set_log_stage(logger, stage):
+    """
+    设置 logger 当前所处的阶段，之后没有通过 extra 指定 stage 的日志都使用该阶段。
+    """
+    context = _filter_of(logger, LogContext)
+    if context:
+        context.stage = stage
+
+
+def get_run_id(logger):
+    context = _filter_of(logger, LogContext)
+    return context.run_id if context else None
+
+
+def log_sampling_summary(logger):
+    """
+    记录本次运行中被采样省略的日志数量，在运行结束时调用。
+    """
+    sampler = _filter_of(logger, LogSampler)
+    if not sampler:
+        return
+    for (stage, sample), (total, dropped) in sorted(sampler.take_summary().items(), key=lambda item: str(item[0])):
+        logger.info(f"日志采样: 阶段 {stage} 的 {sample} 日志共 {total} 条，已省略 {dropped} 条", extra={'stage': stage})
+
+
+def _stop_listener(log_name):
+    with _listeners_lock:
+        listener = _listeners.pop(log_name, None)
+    if listener:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+@atexit.register
+def _stop_all_listeners():
+    for log_name in list(_listeners):
+        _stop_listener(log_name)
+
+
+def setup_logger(log_name, task_id=None, config_id=None):
+    """
+    创建日志，返回 (logger, 日志文件路径)。
+
+    日志通过 QueueHandler 放入队列，由后台的 QueueListener 写入文件和控制台，遍历、下载等热点循环
+    不会阻塞在磁盘写入上。文件中每行一个 JSON 对象（字段见 LOG_FIELDS），控制台仍为文本格式。
+    每次调用生成新的 run_id；带 sample 字段的逐文件日志按 LOG_SAMPLE_FIRST / LOG_SAMPLE_EVERY 采样。
+    """
     log_dir = os.path.join(os.getcwd(), 'logs')
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
@@ -19,6 +184,9 @@ def setup_logger(log_name, task_id=None):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         new_log_file = base_log_file.replace('.log', f'_{timestamp}.log')
         os.rename(base_log_file, new_log_file)
+        # 行偏移索引（log_reader.py）随日志文件一起重命名，inode 不变，索引仍然有效
+        if os.path.exists(index_path_for(base_log_file)):
+            os.replace(index_path_for(base_log_file), index_path_for(new_log_file))
 
     # 新日志文件路径
     log_file = base_log_file
@@ -30,19 +198,37 @@ def setup_logger(log_name, task_id=None):
     # 清理旧的日志文件，保留最近的 5 个
     cleanup_old_logs(log_dir, log_name, task_id, max_log_files=5)
 
-    # 避免重复添加处理器
-    if not logger.handlers:
-        # 创建文件处理器
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - [%(name)s] - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+    # 同一进程中再次运行（例如定时任务守护进程）时，先写完上一次运行队列中的日志，再移除旧的处理器
+    _stop_listener(log_name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    for log_filter in list(logger.filters):
+        if isinstance(log_filter, (LogContext, LogSampler)):
+            logger.removeFilter(log_filter)
+
+    # 创建文件处理器
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(JsonLineFormatter())
+
+    # 创建控制台处理器
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    # 先附加上下文字段，再采样
+    logger.addFilter(LogContext(uuid.uuid4().hex[:12], config_id=config_id, task_id=task_id))
+    logger.addFilter(LogSampler(
+        first=int(os.getenv('LOG_SAMPLE_FIRST', DEFAULT_SAMPLE_FIRST)),
+        every=int(os.getenv('LOG_SAMPLE_EVERY', DEFAULT_SAMPLE_EVERY))
+    ))
 
-        # 创建控制台处理器
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    with _listeners_lock:
+        _listeners[log_name] = listener
 
     return logger, log_file
 
@@ -63,6 +249,8 @@ def cleanup_old_logs(log_dir, log_name, task_id=None, max_log_files=5):
         if os.path.exists(log_file):  # 检查文件是否存在
             try:
                 os.remove(log_file)
+                if os.path.exists(index_path_for(log_file)):
+                    os.remove(index_path_for(log_file))
                 print(f"删除旧日志文件: {log_file}")
             except Exception as e:
                 print(f"删除日志文件时出错: {log_file}，错误: {e}")
@@ -1,24 +1,46 @@
-import random
 import sys
 import easywebdav
-import json
 import os
 from urllib.parse import unquote
 import requests
+import threading
 import time
-from queue import Queue
+from classifier import FileClassifier
+from crawler import DirectoryCrawler
 from db_handler import DBHandler
-from logger import setup_logger
+from downloader import Downloader, DEFAULT_DOWNLOAD_WORKERS
+from job_queue import JobQueue, ConfigBusyError
+from listing_backends import create_list_backend
+from local_inventory import LocalInventory
+from logger import setup_logger, log_extra, set_log_stage, log_sampling_summary
+from metrics import RunMetrics, metrics_stage
+from pipeline import RemoteFileLister, classify_entries, CATEGORY_VIDEO, CATEGORY_DOWNLOAD
+from rate_limiter import RateLimiter
+from refresh_planner import REFRESH_MODE_ROOT, REFRESH_MODE_TARGETED, REFRESH_MODE_NONE, plan_targeted_refresh, directories_to_relist
+from remote_index import RemoteIndex
+from strm_writer import StrmWriter, STRM_UNCHANGED, STRM_UPDATED
+from subpaths import CrawlTarget, plan_crawl_targets, plan_path_targets
+
+DEFAULT_CRAWL_WORKERS = 4
+
+
+class RunStats:
+    """
+    单次运行的计数器。同一进程中可以同时运行多个配置（见 runner.py），因此计数器不再使用全局变量。
+    """
+
+    def __init__(self):
+        self.strm_file_counter = 0  # 新建或更新的 strm 文件数量
+        self.video_file_counter = 0  # 视频文件数量
+        self.directory_strm_file_counter = {}  # 每个子目录下创建的 strm 文件数量
+        self.existing_strm_file_counter = 0  # 已存在的 .strm 文件数量
+        self.change_set = None
+        self.download_progress = None
+        self.lock = threading.Lock()  # 遍历线程并发更新计数器时使用
+
 
-# 初始化全局计数器
-strm_file_counter = 0  # 总的 strm 文件数量
-video_file_counter = 0  # 总的视频文件数量
-download_file_counter = 0  # 已下载的文件数量
-total_download_file_counter = 0  # 总共需要下载的文件数量
-directory_strm_file_counter = {}  # 每个子目录下创建的 strm 文件数量
-existing_strm_file_counter = 0  # 已存在的 .strm 文件数量
-download_queue = Queue()  # 下载队列
-found_video_files = set()
+class ConfigRunError(Exception):
+    pass
 
 
 
@@ -32,183 +54,194 @@ def connect_webdav(config):
         protocol=config['protocol']
     )
 
-def load_cached_tree(config_id, logger):
-    # 确保 cache 目录存在
-    cache_dir = 'cache'
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)  # 自动创建 cache 目录
-
-    # 设置缓存文件路径
-    cache_file = os.path.join(cache_dir, f'webdav_directory_cache_{config_id}.json')
-
-    # 加载缓存文件
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.info(f"加载缓存文件出错: {e}")
-    return None
-
-def save_tree_to_cache(file_tree, config_id, logger):
-    # 确保 cache 目录存在
-    cache_dir = 'cache'
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)  # 自动创建 cache 目录
-
-    # 设置缓存文件路径
-    cache_file = os.path.join(cache_dir, f'webdav_directory_cache_{config_id}.json')
-
-    # 保存缓存文件
-    try:
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(file_tree, f, ensure_ascii=False, indent=4)
-        logger.info(f"目录树缓存文件 '{cache_file}' 保存成功。")
-    except Exception as e:
-        logger.info(f"保存目录树缓存文件出错: {e}")
-
-# 比较两个目录树，如果相同返回 True，否则返回 False
-def compare_directory_trees(cached_tree, current_tree):
-    if len(cached_tree) != len(current_tree):
-        return False
-    for cached_file, current_file in zip(cached_tree, current_tree):
-        if cached_file['name'] != current_file['name'] or \
-           cached_file['size'] != current_file['size'] or \
-           cached_file['modified'] != current_file['modified']:
-            return False
-    return True
-
-def build_local_directory_tree(local_root, script_config, logger):
+def build_local_directory_tree(local_root, classifier, logger, start_directories=None):
     """
     构建本地目录树，包括所有 .strm 文件和其他需要下载的元数据文件的信息。
+    使用 LocalInventory 扫描，未变化的目录直接读取缓存；被排除规则匹配的目录不再进入。
+    start_directories 不为 None 时只扫描这些本地目录的子树（本次只遍历云端的部分子树时）。
     """
     local_tree = {}
-    for root, dirs, files in os.walk(local_root):
-        relative_root = os.path.relpath(root, local_root)
-        local_tree[relative_root] = set()
-        for file in files:
-            # 记录 .strm 文件和其他需要下载的文件（字幕、图片、元数据等）
-            file_extension = os.path.splitext(file)[1].lower().lstrip('.')
-            if file.lower().endswith('.strm') or \
-               file_extension in script_config['subtitle_formats'] or \
-               file_extension in script_config['image_formats'] or \
-               file_extension in script_config['metadata_formats']:
-                local_tree[relative_root].add(file)
+    inventory = LocalInventory(local_root, logger=logger)
+    try:
+        for start in start_directories or [None]:
+            for root, dirs, files in inventory.walk(classifier=classifier, start=start):
+                relative_root = os.path.relpath(root, local_root)
+                local_tree[relative_root] = set()
+                for file in files:
+                    # 记录 .strm 文件和其他需要下载的文件（字幕、图片、元数据等）
+                    if file.lower().endswith('.strm') or classifier.is_download(classifier.category(file)):
+                        local_tree[relative_root].add(file)
+    finally:
+        inventory.close()
     logger.info("本地目录树已加载，包括 .strm 文件和需要下载的文件。")
     return local_tree
 
 
-def list_files_recursive_with_cache(webdav, directory, config, script_config, size_threshold, download_enabled, logger, local_tree, min_interval, max_interval, visited=None):
-    global video_file_counter, strm_file_counter, directory_strm_file_counter, total_download_file_counter
-    decoded_directory = unquote(directory)
-    interval = random.randint(min_interval, max_interval)
-
-    if visited is None:
-        visited = set()
-
-    # 检查是否已经访问过该目录，避免循环递归
-    if directory in visited:
-        return []
+def local_directory_for(directory, config):
+    """
+    将 WebDAV 目录映射为本地目录路径（不创建目录）。
+    """
+    local_relative_path = unquote(directory).replace(config['rootpath'], '').lstrip('/')
+    return os.path.join(config['target_directory'], local_relative_path)
 
-    visited.add(directory)
 
-    try:
-        logger.info(f"尝试遍历目录: {decoded_directory}")
-        files = webdav.ls(directory)  # 列出 WebDAV 中的文件
-        file_tree = []
+def local_start_directories(targets, config):
+    """
+    本次遍历的子树对应的本地目录（去掉嵌套在其他目录中的），遍历整个 rootpath 时返回 None。
+    """
+    directories = sorted({os.path.normpath(local_directory_for(target.directory, config)) for target in targets})
+    if os.path.normpath(config['target_directory']) in directories:
+        return None
+    return [directory for directory in directories
+            if not any(directory.startswith(other + os.sep) for other in directories)]
 
-        # 处理本地目录路径，去掉 WebDAV 上的根目录部分
-        local_relative_path = decoded_directory.replace(config['rootpath'], '').lstrip('/')
-        local_directory = os.path.join(config['target_directory'], local_relative_path)
-        os.makedirs(local_directory, exist_ok=True)  # 确保本地目录存在
 
+def make_local_directories(local_directory):
+    """
+    创建 local_directory 及缺少的上级目录，新建的目录都设为 777（不依赖调用方的 umask），
+    返回是否新建了目录。已存在的目录不再 chmod。
+    """
+    missing = []
+    path = os.path.abspath(local_directory)
+    while not os.path.isdir(path):
+        missing.append(path)
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    for path in reversed(missing):
         try:
-            os.chmod(local_directory, 0o777)
-            logger.info(f"目录权限已设置为 777: {local_directory}")
-        except Exception as e:
-            logger.error(f"设置目录权限时出错: {e}")
+            os.mkdir(path)
+        except FileExistsError:
+            # 其他遍历线程已创建
+            continue
+        os.chmod(path, 0o777)
+    return bool(missing)
 
-        # 初始化该目录的 strm 文件计数器
-        directory_strm_file_counter[decoded_directory] = 0
-
-        for f in files:
-            decoded_file_name = unquote(f.name)
-            is_directory = f.name.endswith('/')
-            file_info = {
-                'name': decoded_file_name,
-                'size': f.size,
-                'modified': f.mtime,
-                'is_directory': is_directory,
-                'children': [] if is_directory else None
-            }
-
-            # 如果是文件夹，递归获取其子文件
-            if is_directory:
-                file_info['children'] = list_files_recursive_with_cache(webdav, f.name, config, script_config, size_threshold, download_enabled, logger, local_tree, min_interval, max_interval, visited)
-                time.sleep(interval)
-            else:
-                file_extension = os.path.splitext(f.name)[1].lower().lstrip('.')
-                time.sleep(interval)
-                # 根据不同格式执行不同操作
-                if file_extension in script_config['video_formats']:
-                    logger.info(f"找到视频文件: {decoded_file_name}")
-                    video_file_counter += 1  # 增加视频文件计数
-                    create_strm_file(f.name, f.size, config, script_config['video_formats'], local_directory,
-                                     decoded_directory, size_threshold, logger, local_tree)
-                # 检查本地目录树中是否已经存在文件，如果存在则跳过
-                elif download_enabled and (
-                        file_extension in script_config['subtitle_formats'] or
-                        file_extension in script_config['image_formats'] or
-                        file_extension in script_config['metadata_formats']):
-                    relative_dir = os.path.relpath(local_directory, config['target_directory'])
-                    if relative_dir in local_tree and os.path.basename(decoded_file_name) in local_tree[relative_dir]:
-                        logger.info(f"跳过文件下载: {decoded_file_name}（本地已存在）")
-                        continue
-
-                    logger.info(f"找到需要下载的文件: {decoded_file_name}")
-                    total_download_file_counter += 1  # 记录需要下载的文件总数
-                    # 将下载任务加入队列（无需创建线程）
-                    download_queue.put((webdav, f.name, local_directory, f.size, config))
-
-            file_tree.append(file_info)
-
-        return file_tree
-    except Exception as e:
-        logger.info(f"Error listing files: {e}")
-        return []
 
+def prepare_local_directory(directory, config, logger, stats):
+    """
+    将 WebDAV 目录映射为本地目录并确保其存在，返回本地目录路径。
+    """
+    decoded_directory = unquote(directory)
+    # 处理本地目录路径，去掉 WebDAV 上的根目录部分
+    local_directory = local_directory_for(directory, config)
+    if make_local_directories(local_directory):
+        logger.info(f"已创建目录: {local_directory}", extra=log_extra('crawl', 'directory_created'))
 
+    with stats.lock:
+        # 初始化该目录的 strm 文件计数器
+        stats.directory_strm_file_counter[decoded_directory] = 0
+    return local_directory
 
-def download_files_with_interval(min_interval, max_interval, logger):
-    global download_file_counter, total_download_file_counter
-    while not download_queue.empty():
-        webdav, file_name, local_path, expected_size, config = download_queue.get()
-        try:
-            download_file(webdav, file_name, local_path, expected_size, config, logger)
-        finally:
-            download_file_counter += 1
-            logger.info(f"文件下载进度: {download_file_counter}/{total_download_file_counter}")
-            download_queue.task_done()
 
-        # 使用从数据库读取的随机下载间隔范围
-        interval = random.randint(min_interval, max_interval)
-        time.sleep(interval)
+def list_files_recursive_with_cache(webdav, directory, config, classifier, download_enabled, logger, local_tree, rate_limiter, token=None, index_session=None, incremental=False, stats=None, resources=None, metrics=None, relist=None):
+    """
+    以流水线方式处理 directory：列出 → 分类 → 生成 .strm / 下载。
+
+    - 列出：RemoteFileLister 在后台线程中用 DirectoryCrawler 广度优先并发遍历，结果写入远程文件索引，
+      遍历到的文件通过有界队列逐个交给下游，内存占用不随目录规模增长
+    - 分类：classify_entries 用 classifier（由 script_config 构建的 FileClassifier）区分视频文件和需要下载的文件，
+      排除规则匹配的目录在遍历时即被跳过
+    - 生成 .strm：在当前线程中逐个处理视频文件，StrmWriter 跳过内容未变化的文件并批量写入
+    - 下载：Downloader 在遍历开始前启动，发现第一个字幕/图片/元数据文件后立即开始下载，
+      并发数由 download_workers 决定
+
+    列表后端由配置中的 list_backend 决定（WebDAV 或 AList JSON 接口），并发数由 crawl_workers 决定，
+    列表请求和下载请求共享 rate_limiter。incremental 为 True 时执行增量遍历，只有变更集中的文件会进入下游。
+    directory 可以是 rootpath 下的一棵子树，路径规则始终匹配相对于 rootpath 的路径。
+    relist 为增量遍历时必须重新列出的目录（本次定向刷新过的目录及其上级）。
+    resources 为 runner.py 中同一主机的共享资源（连接池和单主机并发上限），单独运行时为 None。
+    metrics 记录 crawl（遍历）、strm_write（写入剩余的 .strm）和 download_drain（等待下载完成）各阶段的耗时。
+    计数写入 stats，返回 (change_set, 下载进度)，未启用下载时下载进度为 None。
+    """
+    stats = stats or RunStats()
+    session = resources.session if resources else None
+    host_limiter = resources.host_limiter if resources else None
+
+    backend = create_list_backend(config, token, session=session)
+    logger.info(f"使用列表后端: {backend.name}")
+    crawler = DirectoryCrawler(
+        backend, logger,
+        workers=config.get('crawl_workers', DEFAULT_CRAWL_WORKERS),
+        rate_limiter=rate_limiter,
+        metrics=metrics,
+        classifier=classifier,
+        rules_root=config['rootpath'],
+        relist=relist
+    )
+    lister = RemoteFileLister(
+        crawler, directory,
+        on_directory=lambda d: prepare_local_directory(d, config, logger, stats),
+        index_session=index_session,
+        incremental=incremental
+    )
 
-def create_strm_file(file_name, file_size, config, video_formats, local_directory, directory, size_threshold, logger, local_tree):
-    global strm_file_counter, directory_strm_file_counter, existing_strm_file_counter
-    size_threshold_bytes = size_threshold * (1024 * 1024)
+    strm_writer = StrmWriter(config['target_directory'], local_tree, logger)
+    downloader = None
+    if download_enabled:
+        downloader = Downloader(
+            config, logger,
+            rate_limiter=rate_limiter,
+            workers=config.get('download_workers', DEFAULT_DOWNLOAD_WORKERS),
+            session=session,
+            host_limiter=host_limiter,
+            index_session=index_session,
+            metrics=metrics
+        ).start()
+
+    set_log_stage(logger, 'crawl')
+    crawl_start = time.perf_counter()
+    items = classify_entries(lister, classifier, config['rootpath'])
+    try:
+        for category, entry, file_directory in items:
+            decoded_directory = unquote(file_directory)
+            local_directory = local_directory_for(file_directory, config)
+
+            if category == CATEGORY_VIDEO:
+                logger.info(f"找到视频文件: {entry['name']}", extra=log_extra('strm', 'video_found'))
+                with stats.lock:
+                    stats.video_file_counter += 1  # 增加视频文件计数
+                create_strm_file(entry['href'], entry['size'], config, classifier, local_directory,
+                                 decoded_directory, logger, strm_writer, stats)
+            elif category == CATEGORY_DOWNLOAD and downloader:
+                # 检查本地目录树中是否已经存在文件，如果存在则跳过
+                relative_dir = os.path.relpath(local_directory, config['target_directory'])
+                if relative_dir in local_tree and os.path.basename(entry['name']) in local_tree[relative_dir]:
+                    logger.info(f"跳过文件下载: {entry['name']}（本地已存在）", extra=log_extra('download', 'download_exists'))
+                    continue
 
+                logger.info(f"找到需要下载的文件: {entry['name']}", extra=log_extra('download', 'download_found'))
+                downloader.submit(entry['href'], local_directory, entry['size'])
+    finally:
+        # 出错时关闭流水线，停止遍历并等待遍历线程退出，之后才能关闭索引
+        items.close()
+        if metrics:
+            metrics.add_stage_time('crawl', time.perf_counter() - crawl_start)
+        set_log_stage(logger, 'strm_write')
+        with metrics_stage(metrics, 'strm_write'):
+            strm_writer.close()
+        if downloader:
+            # 等待遍历期间加入的下载任务全部完成
+            set_log_stage(logger, 'download_drain')
+            with metrics_stage(metrics, 'download_drain'):
+                downloader.finish()
+        set_log_stage(logger, None)
+
+    return lister.change_set, downloader.progress if downloader else None
+
+
+def create_strm_file(file_name, file_size, config, classifier, local_directory, directory, logger, strm_writer, stats):
     # 获取文件扩展名并判断是否生成strm文件
-    file_extension = os.path.splitext(file_name)[1].lower().lstrip('.')
-    if file_extension not in video_formats:
+    if classifier.category(unquote(file_name)) != CATEGORY_VIDEO:
         decoded_name = unquote(file_name)
-        logger.info(f"跳过文件: {decoded_name}（不是视频格式）")
+        logger.info(f"跳过文件: {decoded_name}（不是视频格式）", extra=log_extra('strm', 'strm_skipped_format'))
         return
 
     # 如果视频文件大小小于用户设定的阈值，则跳过创建
-    if file_size < size_threshold_bytes:
+    if classifier.is_too_small(file_size):
         decoded_name = unquote(file_name)
-        logger.info(f"跳过生成 .strm 文件: {decoded_name}（文件大小小于 {size_threshold} MB）")
+        logger.info(f"跳过生成 .strm 文件: {decoded_name}（文件大小小于 {classifier.size_threshold_mb} MB）", extra=log_extra('strm', 'strm_skipped_size'))
         return
 
     clean_file_name = file_name.replace('/dav', '')  # 去掉 /dav/ 前缀
@@ -219,78 +252,25 @@ def create_strm_file(file_name, file_size, config, video_formats, local_director
     strm_file_name = os.path.splitext(os.path.basename(decoded_file_name))[0] + ".strm"
     strm_file_path = os.path.join(local_directory, strm_file_name)
 
-    # 检查本地是否已存在 .strm 文件（使用本地目录树）
-    relative_dir = os.path.relpath(local_directory, config['target_directory'])
-    if relative_dir in local_tree and strm_file_name in local_tree[relative_dir]:
-        logger.info(f"跳过生成 .strm 文件: {strm_file_path}（本地已存在）")
-        existing_strm_file_counter += 1  # 计数已存在的 .strm 文件
+    # 内容未变化的 .strm 不再重写；新建和需要更新的文件由 strm_writer 批量写入
+    status = strm_writer.write(local_directory, strm_file_name, http_link)
+    if status == STRM_UNCHANGED:
+        logger.debug(f"跳过生成 .strm 文件: {strm_file_path}（本地已存在且内容未变化）", extra=log_extra('strm', 'strm_unchanged'))
+        with stats.lock:
+            stats.existing_strm_file_counter += 1  # 计数已存在的 .strm 文件
         return
 
-    try:
-        logger.info(f"创建 .strm 文件: {strm_file_path}")
-        with open(strm_file_path, 'w', encoding='utf-8') as strm_file:
-            strm_file.write(http_link)  # 写入链接
-            decoded_name = unquote(strm_file_path)
-        logger.info(f".strm 文件已创建: {decoded_name}")
-
-        # 设置文件权限为 777
-        os.chmod(strm_file_path, 0o777)
-        logger.info(f"文件权限已设置为 777: {strm_file_path}")
-
-        # 更新计数器
-        strm_file_counter += 1
-        directory_strm_file_counter[directory] += 1  # 更新子目录下的 strm 文件数量
-    except Exception as e:
-        logger.info(f"创建 .strm 文件时出错: {file_name}，错误: {e}")
-
-def download_file(webdav, file_name, local_path, expected_size, config, logger):
-    global download_file_counter, total_download_file_counter
-
-    # 检查是否允许下载文件
-    if config.get('download_enabled', 1) == 0:
-        logger.info(f"下载功能已禁用，跳过下载文件: {file_name}")
-        return
-
-    try:
-        # 本地文件路径，解码为中文文件名
-        local_file_path = os.path.join(local_path, os.path.basename(unquote(file_name)))
-
-        # 如果文件已存在，跳过下载
-        if os.path.exists(local_file_path):
-            logger.info(f"跳过文件下载: {local_file_path}（本地已存在）")
-            return
-
-        clean_file_name = file_name.replace('/dav', '')
-        # 根据协议动态生成下载链接
-        file_url = f"{config['protocol']}://{config['host']}:{config['port']}/d{clean_file_name}"
-
-        logger.info(f"正在下载文件: {file_url}")
-        response = requests.get(file_url, auth=(config['username'], config['password']), stream=True, allow_redirects=True)
+    if status == STRM_UPDATED:
+        logger.info(f"更新 .strm 文件: {strm_file_path}（链接已变化）", extra=log_extra('strm', 'strm_updated'))
+    else:
+        logger.debug(f"创建 .strm 文件: {strm_file_path}", extra=log_extra('strm', 'strm_created'))
 
-        if response.status_code == 200:
-            with open(local_file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            logger.info(f"文件下载成功: {local_file_path}")
+    # 更新计数器
+    with stats.lock:
+        stats.strm_file_counter += 1
+        stats.directory_strm_file_counter[directory] = stats.directory_strm_file_counter.get(directory, 0) + 1  # 更新子目录下的 strm 文件数量
 
-            os.chmod(local_file_path, 0o777)
-            logger.info(f"文件权限已设置为 777: {local_file_path}")
-        else:
-            logger.info(f"下载失败: {file_name}，状态码: {response.status_code}")
-
-        # 校验文件大小是否匹配
-        actual_size = os.path.getsize(local_file_path)
-        if actual_size == expected_size:
-            logger.info(f"文件已成功下载: {local_file_path}（大小: {actual_size} 字节）")
-            download_file_counter += 1
-            logger.info(f"文件下载进度: {download_file_counter}/{total_download_file_counter}")
-        else:
-            logger.info(f"文件大小不匹配: {local_file_path}。预期: {expected_size}，实际: {actual_size}")
-            os.remove(local_file_path)
-    except Exception as e:
-        logger.info(f"下载文件时出错: {file_name}，错误: {e}")
-
-def get_jwt_token(url, username, password, logger):
+def get_jwt_token(url, username, password, logger, session=None):
     api_url = f"{url}/api/auth/login"  # 动态构建 API 登录路径
     payload = {
         "username": username,
@@ -298,7 +278,7 @@ def get_jwt_token(url, username, password, logger):
     }
 
     try:
-        response = requests.post(api_url, json=payload)
+        response = (session or requests).post(api_url, json=payload)
         if response.status_code == 200:
             data = response.json()
             token = data['data']['token']
@@ -310,7 +290,7 @@ def get_jwt_token(url, username, password, logger):
         logger.error(f"请求 JWT Token 时发生异常: {e}")
         return None
 
-def refresh_webdav_directory(url, token, path, logger):
+def refresh_webdav_directory(url, token, path, logger, rate_limiter=None, session=None):
     refresh_url = f"{url}/api/fs/list"  # 动态构建 API 刷新路径
     headers = {
         "Authorization": f"Bearer {token}"
@@ -321,25 +301,93 @@ def refresh_webdav_directory(url, token, path, logger):
     }
 
     try:
-        response = requests.post(refresh_url, headers=headers, json=payload)
+        if rate_limiter:
+            rate_limiter.acquire()
+        response = (session or requests).post(refresh_url, headers=headers, json=payload)
         if response.status_code == 200:
             logger.info(f"WebDAV 目录 '{path}' 刷新成功。")
+            return True
         else:
             logger.error(f"刷新 WebDAV 目录时出错: {response.status_code}, {response.text}")
     except Exception as e:
         logger.error(f"刷新 WebDAV 目录时发生异常: {e}")
+    return False
+
+
+def refresh_directories(url, token, config, config_id, targets, remote_index, logger, rate_limiter=None, session=None, metrics=None):
+    """
+    按配置的刷新方式（refresh_mode）在遍历前刷新目录，并在远程文件索引中记录刷新时间：
 
+    - root：刷新本次遍历的各子树的根目录
+    - targeted：只刷新索引中到期的目录（见 refresh_planner.py），每次运行最多 refresh_budget 个
+    - none：不刷新
 
-def process_with_cache(webdav, config, script_config, config_id, size_threshold, logger, min_interval, max_interval):
-    global video_file_counter, strm_file_counter, download_file_counter, total_download_file_counter
+    除 none 外，webhook 推送的目录（target.forced）总是刷新。
 
+    返回增量遍历时需要重新列出的目录（定向刷新过的目录及其上级），其他方式返回空集合。
+    """
+    refresh_mode = config.get('refresh_mode', REFRESH_MODE_ROOT)
+    if refresh_mode == REFRESH_MODE_NONE:
+        logger.info("刷新方式为不刷新，跳过刷新目录。")
+        return set()
+
+    # webhook 推送的目录总是刷新
+    directories = [unquote(target.directory) for target in targets if target.forced]
+    scheduled = [target for target in targets if not target.forced]
+    if refresh_mode == REFRESH_MODE_TARGETED and scheduled:
+        plan = plan_targeted_refresh(remote_index, config_id, config, scheduled, time.time())
+        directories += plan.directories
+        logger.info(f"定向刷新: 本次刷新 {len(plan.directories)} 个到期目录（其中热门目录 {plan.hot} 个），"
+                    f"另有 {plan.deferred} 个到期目录留待之后的运行")
+    elif refresh_mode != REFRESH_MODE_TARGETED:
+        # 只刷新本次需要遍历的子树
+        directories += [unquote(target.directory) for target in scheduled]
+
+    refreshed = []
+    for directory in directories:
+        refresh_path = directory.rstrip('/') or '/'
+        logger.info(f"正在尝试刷新 WebDAV 目录: {refresh_path}")
+        if refresh_webdav_directory(url, token, refresh_path, logger, rate_limiter, session=session):
+            refreshed.append(directory)
+    remote_index.mark_refreshed(config_id, refreshed, int(time.time()))
+    if metrics:
+        metrics.set('directories_refreshed', len(refreshed))
+    return directories_to_relist(refreshed, targets) if refresh_mode == REFRESH_MODE_TARGETED else set()
+
+
+def process_with_cache(webdav, config, classifier, config_id, logger, min_interval, max_interval, stats=None, resources=None, metrics=None, targets=None):
+    """
+    执行一次同步，计数写入并返回 stats。classifier 为由 script_config 构建的 FileClassifier。resources 为同一主机共享的连接池、限速器和 JWT（见 runner.py）。
+    metrics 不为 None 时记录各阶段耗时和本次运行的计数。
+    targets 为需要遍历的子树（subpaths.plan_crawl_targets 的结果），依次遍历并合并到同一个索引和目标目录；
+    为 None 时遍历整个 rootpath，为空列表时没有需要同步的子树，直接返回。
+    """
+    stats = stats or RunStats()
+    if targets is None:
+        targets = [CrawlTarget(config['rootpath'], classifier)]
+    if not targets:
+        logger.info("没有需要同步的目录（子路径均未到期），跳过本次同步。")
+        return stats
     download_enabled = config.get('download_enabled', 1)
 
-    cached_tree = load_cached_tree(config_id, logger)
+    if resources:
+        # 同一 AList 主机上的配置共享限速器
+        rate_limiter = resources.rate_limiter
+    else:
+        # 下载间隔范围作为令牌桶限速器的参数，PROPFIND、下载和目录刷新共享同一个限速器
+        rate_limiter = RateLimiter.from_interval_range(min_interval, max_interval)
+    session = resources.session if resources else None
 
-    root_directory = config['rootpath']
+    # 只有遍历整个 rootpath 的运行才更新索引的整体完成时间（快扫据此判断索引是否过期），
+    # 只遍历子路径或推送目录的运行只记录各子树的完成时间
+    full_crawl = len(targets) == 1 and targets[0].subpath is None and not targets[0].forced
+    remote_index = RemoteIndex()
+    remote_index.import_legacy_cache(config_id, logger)
+    index_session = remote_index.session(config_id, remote_index.start_run(config_id, full=full_crawl))
 
     # 在增量更新前，使用 API 强制刷新目录
+    token = None
+    relist = set()
     protocol = config.get('protocol')
     host = config.get('host')
     port = config.get('port')
@@ -350,11 +398,16 @@ def process_with_cache(webdav, config, script_config, config_id, size_threshold,
         password = config.get('password')
 
         if username and password:
-            logger.info(f"正在尝试刷新 WebDAV 根目录: {root_directory}")
-            token = get_jwt_token(url, username, password, logger)
-            if token:
-                refresh_webdav_directory(url, token, root_directory, logger)
-            else:
+            set_log_stage(logger, 'refresh')
+            with metrics_stage(metrics, 'refresh'):
+                if resources:
+                    token = resources.get_token(username, password, logger)
+                else:
+                    token = get_jwt_token(url, username, password, logger)
+                if token:
+                    relist = refresh_directories(url, token, config, config_id, targets, remote_index, logger,
+                                                 rate_limiter, session=session, metrics=metrics)
+            if not token:
                 logger.error("无法获取 JWT Token，跳过刷新目录。")
         else:
             logger.error("缺少token，无法刷新 WebDAV 目录。")
@@ -362,67 +415,107 @@ def process_with_cache(webdav, config, script_config, config_id, size_threshold,
         logger.error("缺少协议、主机或端口，无法构建 API URL。")
 
     # 加载本地目录树（增量更新和全量更新都需要使用）
-    local_tree = build_local_directory_tree(config['target_directory'], script_config, logger)
+    set_log_stage(logger, 'local_scan')
+    with metrics_stage(metrics, 'local_scan'):
+        local_tree = build_local_directory_tree(config['target_directory'], classifier, logger,
+                                                local_start_directories(targets, config))
 
-    if config.get('update_mode') == 'incremental':
-        logger.info("正在执行增量更新...")
+    incremental_mode = config.get('update_mode') == 'incremental'
+    logger.info("正在执行增量更新..." if incremental_mode else "正在执行全量更新...")
 
-        if cached_tree:
-            current_tree = list_files_recursive_with_cache(
-                webdav, root_directory, config, script_config, size_threshold, download_enabled, logger, local_tree,  min_interval, max_interval, visited=None
+    # 在全量更新时，同样需要检查本地文件，快速跳过已经存在的文件
+    change_set, download_progress = None, None
+    try:
+        for target in targets:
+            if target.subpath is not None:
+                logger.info(f"正在同步子路径: {target.label}（间隔 {target.subpath['refresh_minutes']} 分钟）")
+            elif target.forced:
+                logger.info(f"正在同步推送的目录: {target.label}")
+            incremental = incremental_mode and index_session.is_populated(unquote(target.directory))
+            if incremental_mode and not incremental:
+                logger.info(f"{target.label} 的远程文件索引尚未建立，执行全量更新。")
+            target_change_set, target_progress = list_files_recursive_with_cache(
+                webdav, target.directory, config, target.classifier, download_enabled, logger, local_tree, rate_limiter, token,
+                index_session=index_session, incremental=incremental, stats=stats, resources=resources, metrics=metrics,
+                relist=relist
             )
-            if compare_directory_trees(cached_tree, current_tree):
-                logger.info("本地目录树与云端一致，跳过更新。")
-                if not download_enabled:
-                    logger.info("下载功能已禁用，程序即将退出。")
-                    sys.exit(0)
-            else:
-                logger.info("目录树发生变化，进行增量更新。")
-                save_tree_to_cache(current_tree, config_id, logger)
+            change_set = change_set.merge(target_change_set) if change_set else target_change_set
+            if target_progress:
+                download_progress = download_progress.merge(target_progress) if download_progress else target_progress
+        stats.change_set, stats.download_progress = change_set, download_progress
+        if change_set.list_errors:
+            # 有目录列表失败时索引不完整，不记录本次运行（或子树）已完成
+            logger.warning(f"有 {change_set.list_errors} 个目录列表失败，远程文件索引不完整，本次运行不记为已完成")
+        elif full_crawl:
+            index_session.finish()
         else:
-            logger.info("没有找到缓存的目录树，执行全量更新。")
-            current_tree = list_files_recursive_with_cache(
-                webdav, root_directory, config, script_config, size_threshold, download_enabled, logger,  min_interval, max_interval, local_tree, visited=None
-            )
-            save_tree_to_cache(current_tree, config_id, logger)
-
-    elif config.get('update_mode') == 'full':
-        logger.info("正在执行全量更新...")
-
-        # 在全量更新时，同样需要检查本地文件，快速跳过已经存在的文件
-        current_tree = list_files_recursive_with_cache(
-            webdav, root_directory, config, script_config, size_threshold, download_enabled, logger, min_interval, max_interval, local_tree, visited=None
-        )
-        save_tree_to_cache(current_tree, config_id, logger)  # 保存全量更新后的目录树到缓存
-
-    logger.info(f"总共创建了 {strm_file_counter} 个 .strm 文件")
-    logger.info(f"总共发现了 {video_file_counter} 个视频文件")
-
-    if download_enabled:
-        logger.info(f"总共需要下载 {total_download_file_counter} 个文件")
+            index_session.finish([unquote(target.directory) for target in targets],
+                                 [directory for target in targets for directory in target.skipped])
+    finally:
+        remote_index.close()
+
+    logger.info(f"共列出 {change_set.listed_directories} 个目录，跳过 {change_set.skipped_directories} 个未变化的目录")
+    if change_set.excluded_directories:
+        logger.info(f"按排除规则跳过 {change_set.excluded_directories} 个目录")
+    logger.info(f"变更集: 新增 {change_set.added} 个文件，变化 {change_set.changed} 个文件，删除 {change_set.removed} 个文件")
+    for removed_file in change_set.removed_sample:
+        logger.debug(f"云端已删除的文件: {removed_file}", extra=log_extra('crawl', 'file_removed'))
+    if change_set.is_empty():
+        logger.info("本地目录树与云端一致，跳过更新。")
+
+    logger.info(f"总共创建了 {stats.strm_file_counter} 个 .strm 文件")
+    logger.info(f"总共发现了 {stats.video_file_counter} 个视频文件")
+
+    if download_progress:
+        logger.info(f"总共需要下载 {download_progress.total} 个文件")
+        logger.info(f"总共下载了 {download_progress.downloaded} 个文件，跳过 {download_progress.skipped} 个，失败 {download_progress.failed} 个")
     else:
-        logger.info("下载功能已禁用，跳过所有下载任务。程序即将退出。")
-        sys.exit(0)
+        logger.info("下载功能已禁用，跳过所有下载任务。")
+    if metrics:
+        record_run_counters(metrics, stats)
+    return stats
 
-    # 传递下载间隔范围（最小值和最大值）
-    min_interval, max_interval = config['download_interval_range']
-    download_files_with_interval(min_interval, max_interval, logger)
 
-    logger.info(f"总共下载了 {download_file_counter} 个文件")
-
-
-
-if __name__ == '__main__':
+def record_run_counters(metrics, stats):
+    """
+    把 RunStats 中的计数写入 metrics。
+    """
+    metrics.set('strm_written', stats.strm_file_counter)
+    metrics.set('strm_existing', stats.existing_strm_file_counter)
+    metrics.set('video_files', stats.video_file_counter)
+    change_set = stats.change_set
+    if change_set:
+        metrics.set('directories_listed', change_set.listed_directories)
+        metrics.set('directories_skipped', change_set.skipped_directories)
+        metrics.set('directories_excluded', change_set.excluded_directories)
+        metrics.set('files_added', change_set.added)
+        metrics.set('files_changed', change_set.changed)
+        metrics.set('files_removed', change_set.removed)
+    progress = stats.download_progress
+    if progress:
+        metrics.set('downloads_total', progress.total)
+        metrics.set('downloads_ok', progress.downloaded)
+        metrics.set('downloads_skipped', progress.skipped)
+        metrics.set('downloads_failed', progress.failed)
+
+
+def run_config(config_id, task_id=None, resources=None, full=False, paths=None):
+    """
+    运行单个配置，返回 RunStats。无法继续运行时记录日志并抛出 ConfigRunError。
+    resources 由 runner.py 传入，用于在同一进程中运行多个配置时共享主机资源。
+    配置设置了子路径时只遍历到期的子路径，full 为 True 时忽略子路径遍历整个 rootpath。
+    paths 不为 None 时只同步这些目录（相对于 rootpath，由 webhook 推送），不影响子路径的同步时间。
+    无论成功与否，本次运行的指标都会写入 run_metrics 表。
+    """
     db_handler = DBHandler()
-
-    config_id = int(sys.argv[1]) if len(sys.argv) > 1 else 1
-    task_id = sys.argv[2] if len(sys.argv) > 2 else None  # 获取任务ID，如果存在
+    metrics = RunMetrics('strm_creation', config_id, task_id)
+    status = 'failed'
 
     # 设置日志
     if task_id:
-        logger, log_file = setup_logger('config_' + str(config_id), task_id=task_id)
+        logger, log_file = setup_logger('config_' + str(config_id), task_id=task_id, config_id=config_id)
     else:
-        logger, log_file = setup_logger('config_' + str(config_id))
+        logger, log_file = setup_logger('config_' + str(config_id), config_id=config_id)
 
     try:
         # 初始化数据库并获取配置
@@ -432,7 +525,7 @@ if __name__ == '__main__':
         # 检查配置是否有效
         if not config:
             logger.error(f"无法获取配置ID {config_id} 的配置，程序终止。")
-            sys.exit(1)
+            raise ConfigRunError(f"无法获取配置ID {config_id} 的配置")
 
         # 输出配置信息到日志
         logger.info(
@@ -445,27 +538,94 @@ if __name__ == '__main__':
         # 检查脚本配置是否有效
         if not script_config or 'video_formats' not in script_config or 'size_threshold' not in script_config:
             logger.error(f"脚本配置出错，缺少必要的配置项，程序终止。")
-            sys.exit(1)
+            raise ConfigRunError("脚本配置出错，缺少必要的配置项")
 
         # 连接 WebDAV 服务器
         try:
             webdav = connect_webdav(config)
         except Exception as e:
             logger.error(f"连接 WebDAV 服务器时出错: {e}")
-            sys.exit(1)
+            raise ConfigRunError(f"连接 WebDAV 服务器时出错: {e}")
+
+        # 格式、大小阈值和路径规则编译为分类器，本次运行的遍历和本地扫描共用
+        # 只遍历到期的子路径，每个子路径使用全局排除规则加上自己的排除规则
+        started_at = time.time()
+        subpaths = db_handler.get_config_subpaths(config_id)
+        try:
+            classifier = FileClassifier(script_config)
+            if paths is not None:
+                targets, excluded = plan_path_targets(config, script_config, classifier, subpaths, paths)
+                for path in excluded:
+                    logger.info(f"跳过被排除规则匹配的推送目录: {path}")
+            else:
+                targets = plan_crawl_targets(config, script_config, classifier, subpaths, started_at, full)
+        except ValueError as e:
+            logger.error(f"路径规则无效: {e}")
+            raise ConfigRunError(f"路径规则无效: {e}")
 
-        # 使用缓存策略处理文件，并传递 size_threshold
+        # 使用缓存策略处理文件
         try:
-            process_with_cache(webdav, config, script_config, config_id, script_config['size_threshold'], logger)
+            min_interval, max_interval = config['download_interval_range']
+            stats = process_with_cache(webdav, config, classifier, config_id, logger,
+                                       min_interval, max_interval, resources=resources, metrics=metrics,
+                                       targets=targets)
         except Exception as e:
             logger.error(f"处理文件时发生错误: {e}")
-            sys.exit(1)
+            raise ConfigRunError(f"处理文件时发生错误: {e}")
+
+        # 全量遍历覆盖了所有子路径
+        synced = subpaths if full and paths is None else [target.subpath for target in targets if target.subpath is not None]
+        if synced:
+            db_handler.mark_subpaths_synced([subpath['subpath_id'] for subpath in synced], started_at)
+            metrics.set('subpaths_synced', len(synced))
 
         logger.info("文件处理完成！")
+        status = 'success'
+        return stats
 
+    except ConfigRunError:
+        raise
     except Exception as e:
         logger.error(f"运行过程中出现未捕获的异常: {e}")
+        raise ConfigRunError(f"运行过程中出现未捕获的异常: {e}")
 
     finally:
         db_handler.close()
+        log_sampling_summary(logger)
+        save_metrics(metrics, status, logger)
 
+
+def save_metrics(metrics, status, logger):
+    try:
+        run_id = metrics.save(status)
+        logger.info(f"本次运行的指标已保存（运行记录 {run_id}），用时 {metrics.to_dict()['wall_seconds']:.1f} 秒")
+    except Exception as e:
+        # 指标写入失败不影响运行结果
+        logger.error(f"保存运行指标时出错: {e}")
+
+
+if __name__ == '__main__':
+    # 生成的目录和文件需要对媒体服务器等其他用户可写，创建时即为 777，不再逐个 chmod
+    os.umask(0)
+
+    # --full：忽略子路径的同步间隔，遍历整个 rootpath
+    full = '--full' in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != '--full']
+    config_id = int(args[0]) if len(args) > 0 else 1
+    task_id = args[1] if len(args) > 1 else None  # 获取任务ID，如果存在
+
+    # 取得该配置的运行租约，避免与定时任务或网页上启动的运行同时遍历同一个媒体库
+    job_queue = JobQueue()
+    try:
+        job_id = job_queue.start(config_id, 'strm_creation', task_id, source='cli')
+    except ConfigBusyError as e:
+        print(f"{e}，本次运行已取消。")
+        sys.exit(1)
+
+    try:
+        with job_queue.hold(job_id):
+            run_config(config_id, task_id, full=full)
+    except ConfigRunError:
+        sys.exit(1)
+    finally:
+        job_queue.close()
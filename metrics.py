@@ -0,0 +1,290 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# 请求耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 保留的运行记录数量
+KEEP_RUNS = 1000
+
+METRIC_PREFIX = 'alist_strm'
+
+
+class Histogram:
+    """
+    固定桶的耗时直方图，counts[i] 为落在 (buckets[i-1], buckets[i]] 内的次数，最后一个为 +Inf。
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+class RunMetrics:
+    """
+    单次运行（生成 .strm 或校验）的指标，线程安全。
+
+    - stages：各阶段耗时（秒）。流水线中的阶段会重叠，例如遍历期间下载已经开始
+    - counters：请求数、字节数、限速等待时间等累计值，*_seconds 为各线程耗时之和；
+      retries 为重新发起的请求数（限流或 5xx 后重试的列表请求、上次失败后再次发起的下载），没有重试时为 0
+    - histograms：列表请求、下载请求、链接校验的耗时分布
+
+    运行结束后调用 save() 写入 run_metrics 表，由 app.py 的 /metrics 和 /api/runs 读取。
+    """
+
+    def __init__(self, run_type, config_id, task_id=None):
+        self.run_type = run_type
+        self.config_id = config_id
+        self.task_id = task_id
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.stages = {}
+        self.counters = {'retries': 0}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+
+    def add_stage_time(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def wait_for(self, rate_limiter):
+        """
+        向限速器申请令牌，并把等待时间计入 rate_limit_wait_seconds。
+        """
+        if rate_limiter:
+            self.incr('rate_limit_wait_seconds', rate_limiter.acquire())
+
+    def to_dict(self):
+        with self._lock:
+            wall_seconds = time.perf_counter() - self._start
+            counters = dict(self.counters)
+            data = {
+                'run_type': self.run_type,
+                'config_id': self.config_id,
+                'task_id': self.task_id,
+                'started_at': self.started_at,
+                'wall_seconds': wall_seconds,
+                'stages': dict(self.stages),
+                'counters': counters,
+                'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+            }
+        # 派生指标
+        crawl_seconds = data['stages'].get('crawl')
+        if crawl_seconds and counters.get('directories_listed'):
+            data['directories_per_second'] = counters['directories_listed'] / crawl_seconds
+        work_seconds = sum(histogram['sum'] for histogram in data['histograms'].values())
+        data['request_seconds'] = work_seconds
+        data['rate_limit_wait_seconds'] = counters.get('rate_limit_wait_seconds', 0.0)
+        return data
+
+    def save(self, status, db_file=None):
+        """
+        保存本次运行的指标，返回 run_id。
+        """
+        store = MetricsStore(db_file)
+        try:
+            return store.save_run(self, status)
+        finally:
+            store.close()
+
+
+def metrics_stage(metrics, name):
+    """
+    metrics 为 None 时返回空的上下文管理器。
+    """
+    return metrics.stage(name) if metrics else nullcontext()
+
+
+def record_wait(metrics, rate_limiter):
+    """
+    metrics 为 None 时直接申请令牌，供可选地接收 metrics 的组件使用。
+    """
+    if metrics:
+        metrics.wait_for(rate_limiter)
+    elif rate_limiter:
+        rate_limiter.acquire()
+
+
+class MetricsStore:
+    """
+    运行指标的持久化，存放在 config.db 的 run_metrics 表中。
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file or os.getenv('DB_FILE', '/config/config.db')
+        self.conn = sqlite3.connect(self.db_file, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS run_metrics (
+                                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                run_type TEXT NOT NULL,
+                                config_id INTEGER,
+                                task_id TEXT,
+                                status TEXT,
+                                started_at REAL,
+                                finished_at REAL,
+                                data TEXT  -- RunMetrics.to_dict() 的 JSON
+                                )''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_run_metrics_config ON run_metrics (config_id, run_type)')
+        self.conn.commit()
+
+    def save_run(self, metrics, status):
+        data = metrics.to_dict()
+        data['status'] = status
+        cursor = self.conn.execute('''INSERT INTO run_metrics (run_type, config_id, task_id, status, started_at, finished_at, data)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                   (metrics.run_type, metrics.config_id, metrics.task_id, status, metrics.started_at,
+                                    time.time(), json.dumps(data, ensure_ascii=False)))
+        self.conn.execute('DELETE FROM run_metrics WHERE run_id <= ?', (cursor.lastrowid - KEEP_RUNS,))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def _row_to_dict(self, row):
+        run = dict(row)
+        run['data'] = json.loads(run['data'] or '{}')
+        return run
+
+    def list_runs(self, config_id=None, limit=50):
+        query = 'SELECT * FROM run_metrics'
+        params = []
+        if config_id is not None:
+            query += ' WHERE config_id = ?'
+            params.append(config_id)
+        query += ' ORDER BY run_id DESC LIMIT ?'
+        params.append(limit)
+        return [self._row_to_dict(row) for row in self.conn.execute(query, params)]
+
+    def get_run(self, run_id):
+        row = self.conn.execute('SELECT * FROM run_metrics WHERE run_id = ?', (run_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def latest_runs(self):
+        """
+        每个 (配置, 运行类型) 最近一次运行的记录。
+        """
+        rows = self.conn.execute('''SELECT * FROM run_metrics WHERE run_id IN
+                                    (SELECT MAX(run_id) FROM run_metrics GROUP BY config_id, run_type)
+                                    ORDER BY config_id, run_type''')
+        return [self._row_to_dict(row) for row in rows]
+
+    def run_counts(self):
+        return self.conn.execute('''SELECT config_id, run_type, status, COUNT(*) AS runs FROM run_metrics
+                                    GROUP BY config_id, run_type, status''').fetchall()
+
+    def render_prometheus(self):
+        """
+        以 Prometheus 文本格式输出：运行次数，以及每个配置最近一次运行的耗时、计数和请求耗时直方图。
+        """
+        lines = []
+
+        def metric(name, metric_type, help_text):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+
+        def sample(name, labels, value):
+            label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+            lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {format_value(value)}")
+
+        metric('runs', 'gauge', 'Recorded runs by config, run type and status.')
+        for row in self.run_counts():
+            sample('runs', {'config_id': row['config_id'], 'run_type': row['run_type'], 'status': row['status']}, row['runs'])
+
+        latest = self.latest_runs()
+        metric('last_run_timestamp_seconds', 'gauge', 'Finish time of the most recent run.')
+        for run in latest:
+            sample('last_run_timestamp_seconds', run_labels(run), run['finished_at'])
+
+        metric('last_run_duration_seconds', 'gauge', 'Wall time of the most recent run.')
+        for run in latest:
+            sample('last_run_duration_seconds', run_labels(run), run['data'].get('wall_seconds', 0))
+
+        metric('last_run_success', 'gauge', 'Whether the most recent run succeeded.')
+        for run in latest:
+            sample('last_run_success', run_labels(run), 1 if run['status'] == 'success' else 0)
+
+        metric('last_run_stage_seconds', 'gauge', 'Per-stage duration of the most recent run.')
+        for run in latest:
+            for stage, seconds in sorted(run['data'].get('stages', {}).items()):
+                sample('last_run_stage_seconds', dict(run_labels(run), stage=stage), seconds)
+
+        metric('last_run_counter', 'gauge', 'Counters of the most recent run (requests, bytes, files, wait seconds).')
+        for run in latest:
+            for name, value in sorted(run['data'].get('counters', {}).items()):
+                sample('last_run_counter', dict(run_labels(run), name=name), value)
+
+        metric('last_run_directories_per_second', 'gauge', 'Directories listed per second of crawl time in the most recent run.')
+        for run in latest:
+            if 'directories_per_second' in run['data']:
+                sample('last_run_directories_per_second', run_labels(run), run['data']['directories_per_second'])
+
+        metric('last_run_request_duration_seconds', 'histogram', 'Request latency distribution of the most recent run.')
+        for run in latest:
+            for name, histogram in sorted(run['data'].get('histograms', {}).items()):
+                labels = dict(run_labels(run), request=name)
+                cumulative = 0
+                for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+                    cumulative += count
+                    sample('last_run_request_duration_seconds_bucket', dict(labels, le=bound), cumulative)
+                sample('last_run_request_duration_seconds_sum', labels, histogram['sum'])
+                sample('last_run_request_duration_seconds_count', labels, histogram['count'])
+
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        self.conn.close()
+
+
+def run_labels(run):
+    return {'config_id': run['config_id'], 'run_type': run['run_type']}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
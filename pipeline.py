@@ -0,0 +1,137 @@
+import threading
+from queue import Queue, Empty, Full
+from urllib.parse import unquote
+
+from classifier import CATEGORY_VIDEO
+
+# 流水线中的文件分类：视频文件生成 .strm，字幕、图片和元数据文件下载
+CATEGORY_DOWNLOAD = 'download'
+
+# 队列结束标记
+_SENTINEL = object()
+# 队列已满时遍历线程检查消费者是否已停止的间隔（秒）
+_PUT_POLL_SECONDS = 0.1
+
+
+class RemoteFileLister:
+    """
+    流水线的第一阶段：在后台线程中运行 DirectoryCrawler，把遍历到的文件逐个交给消费者。
+
+    使用有界队列传递 (entry, directory)，消费者处理不过来时遍历线程会阻塞等待，
+    因此内存占用与目录规模无关。迭代结束后可通过 change_set 获取本次遍历的变更统计。
+    消费者出错或提前停止迭代时（生成器被关闭），遍历随之停止，队列被清空并等待遍历线程退出，
+    不会留下阻塞在队列上的线程。
+    """
+
+    def __init__(self, crawler, root_directory, on_directory=None, index_session=None, incremental=False, max_pending=1000):
+        self.crawler = crawler
+        self.root_directory = root_directory
+        self.on_directory = on_directory
+        self.index_session = index_session
+        self.incremental = incremental
+        self.max_pending = max_pending
+        self.change_set = None
+
+    def __iter__(self):
+        queue = Queue(maxsize=self.max_pending)
+        stop = threading.Event()
+        errors = []
+
+        def put(item):
+            # 消费者已停止时丢弃，避免遍历线程阻塞在已满的队列上
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=_PUT_POLL_SECONDS)
+                    return
+                except Full:
+                    continue
+
+        def run():
+            try:
+                self.change_set = self.crawler.crawl(
+                    self.root_directory,
+                    on_directory=self.on_directory,
+                    on_file=lambda entry, directory: put((entry, directory)),
+                    index_session=self.index_session,
+                    incremental=self.incremental,
+                    stop=stop
+                )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(_SENTINEL)
+
+        thread = threading.Thread(target=run, name='remote-file-lister', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = queue.get()
+                if item is _SENTINEL:
+                    break
+                yield item
+        finally:
+            stop.set()
+            while thread.is_alive():
+                try:
+                    queue.get(timeout=_PUT_POLL_SECONDS)
+                except Empty:
+                    pass
+            thread.join()
+        if errors:
+            raise errors[0]
+
+
+def classify_entries(items, classifier, root_directory):
+    """
+    流水线的第二阶段：用 classifier（classifier.FileClassifier）为每个文件分类，
+    产出 (category, entry, directory)。不需要处理或被规则排除的文件直接丢弃。
+    """
+    root_name = unquote(root_directory)
+    for entry, directory in items:
+        category = classifier.classify(entry['name'], root_name)
+        if category == CATEGORY_VIDEO:
+            yield CATEGORY_VIDEO, entry, directory
+        elif classifier.is_download(category):
+            yield CATEGORY_DOWNLOAD, entry, directory
+
+
+class BackgroundStage:
+    """
+    由 workers 个后台线程消费队列的流水线阶段，上游产出第一个任务时即开始处理。
+    handler(item) 的异常由 handler 自己记录，这里只保证队列持续被消费。
+    """
+
+    def __init__(self, handler, name='background-stage', max_pending=1000, workers=1):
+        self.handler = handler
+        self.queue = Queue(maxsize=max_pending)
+        self.threads = [
+            threading.Thread(target=self._run, name=f'{name}-{i}', daemon=True)
+            for i in range(max(1, int(workers)))
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _SENTINEL:
+                    return
+                self.handler(item)
+            finally:
+                self.queue.task_done()
+
+    def finish(self):
+        """
+        通知阶段不再有新任务，并等待已入队的任务全部处理完毕。
+        """
+        for _ in self.threads:
+            self.queue.put(_SENTINEL)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    线程安全的令牌桶限速器。
+
+    rate 为每秒补充的令牌数（即每秒允许的请求数），burst 为桶容量（允许的突发请求数）。
+    只有真正向 AList 发出 HTTP 请求时才需要调用 acquire()，本地处理不消耗令牌。
+    rate 为 None 或 <= 0 时不限速。
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate) if rate and rate > 0 else None
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_interval_range(cls, min_interval, max_interval):
+        """
+        由 config 表的 download_interval_range（'min-max'，单位秒）构建限速器：
+        平均请求间隔为 (min + max) / 2 秒，区间宽度决定允许的突发请求数。
+        '0-0' 表示不限速。
+        """
+        min_interval, max_interval = sorted((max(0, int(min_interval)), max(0, int(max_interval))))
+        average_interval = (min_interval + max_interval) / 2
+        if average_interval <= 0:
+            return cls(None)
+        return cls(1 / average_interval, burst=max_interval - min_interval + 1)
+
+    def acquire(self, tokens=1):
+        """
+        获取 tokens 个令牌，令牌不足时阻塞等待。返回实际等待的秒数。
+        """
+        if self.rate is None:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # 允许令牌数为负，相当于预约未来的令牌，等待在锁外进行
+            self._tokens -= tokens
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
@@ -0,0 +1,88 @@
+from urllib.parse import unquote
+
+from classifier import PathRules, parse_rules, relative_path
+from remote_index import directory_key, parent_path
+
+# 运行前的目录刷新方式（AList /api/fs/list 的 refresh: true）
+REFRESH_MODE_ROOT = 'root'  # 刷新本次遍历的根目录（默认，与旧版本相同）
+REFRESH_MODE_TARGETED = 'targeted'  # 只刷新索引中到期的目录，每次运行最多刷新 refresh_budget 个
+REFRESH_MODE_NONE = 'none'  # 不刷新，只读取 AList 的缓存
+REFRESH_MODES = (REFRESH_MODE_ROOT, REFRESH_MODE_TARGETED, REFRESH_MODE_NONE)
+
+# 定向刷新的默认参数
+DEFAULT_REFRESH_BUDGET = 20  # 每次运行最多刷新的目录数
+DEFAULT_REFRESH_MAX_AGE_MINUTES = 1440  # 普通目录距上次刷新超过该时间即到期
+DEFAULT_HOT_REFRESH_MINUTES = 60  # 匹配热门路径规则的目录距上次刷新超过该时间即到期
+
+
+class RefreshPlan:
+    """
+    一次定向刷新的计划：directories 为本次需要刷新的目录（解码后的完整路径，以 / 结尾），
+    hot 为其中热门目录的数量，deferred 为超出预算、留待之后的运行刷新的到期目录数量。
+    """
+
+    def __init__(self, directories, hot=0, deferred=0):
+        self.directories = directories
+        self.hot = hot
+        self.deferred = deferred
+
+
+def _matches_with_ancestors(rules, relative):
+    """
+    relative（目录相对于 rootpath 的路径）或其任一上级目录是否匹配 rules。
+    """
+    parts = relative.split('/')
+    return any(rules.matches('/'.join(parts[:i + 1]), is_directory=True) for i in range(len(parts)))
+
+
+def plan_targeted_refresh(index, config_id, config, targets, now):
+    """
+    从远程文件索引中挑选 targets（subpaths.CrawlTarget 列表）子树内到期的目录：
+
+    - 目录或其上级匹配热门路径规则（hot_paths，写法与排除规则相同）时，距上次刷新超过 hot_refresh_minutes 即到期
+    - 其他目录距上次刷新超过 refresh_max_age 分钟即到期，从未刷新过的目录最先到期
+    - 被排除规则跳过的目录不刷新
+
+    热门目录优先，同类中上次刷新越早越优先，最多取 refresh_budget 个，其余的留到之后的运行，
+    因此切换到定向刷新后首次需要刷新的大量目录会被分摊到多次运行中。
+    """
+    budget = config.get('refresh_budget', DEFAULT_REFRESH_BUDGET)
+    max_age = config.get('refresh_max_age', DEFAULT_REFRESH_MAX_AGE_MINUTES) * 60
+    hot_age = config.get('hot_refresh_minutes', DEFAULT_HOT_REFRESH_MINUTES) * 60
+    hot_rules = PathRules(parse_rules(config.get('hot_paths')))
+
+    hot, aged = [], []
+    for target in targets:
+        classifier = target.classifier
+        for path, refreshed_at in index.iter_directories(config_id, unquote(target.directory)):
+            relative = relative_path(path, config['rootpath'])
+            if relative and classifier.exclude and _matches_with_ancestors(classifier.exclude, relative):
+                continue
+            age = now - refreshed_at if refreshed_at else None
+            if relative and hot_rules and _matches_with_ancestors(hot_rules, relative):
+                if age is None or age >= hot_age:
+                    hot.append((refreshed_at or 0, path))
+            elif age is None or age >= max_age:
+                aged.append((refreshed_at or 0, path))
+
+    hot.sort()
+    aged.sort()
+    due = [path for _, path in hot] + [path for _, path in aged]
+    return RefreshPlan(due[:budget], hot=min(len(hot), budget), deferred=max(0, len(due) - budget))
+
+
+def directories_to_relist(refreshed, targets):
+    """
+    刷新过的目录及其在 targets 子树内的各级上级目录。增量遍历时这些目录即使修改时间未变也要重新列出，
+    否则上级目录的列表没有变化时刷新过的目录会被跳过。
+    """
+    roots = [directory_key(unquote(target.directory)) for target in targets]
+    directories = set()
+    for directory in refreshed:
+        directory = directory_key(directory)
+        while directory not in directories:
+            directories.add(directory)
+            if directory in roots or not any(directory.startswith(root) for root in roots):
+                break
+            directory = parent_path(directory)
+    return directories
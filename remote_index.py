@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+CACHE_DIR = 'cache'
+# 每写入多少个目录的列表提交一次事务
+COMMIT_EVERY = 200
+
+
+def parent_path(path):
+    """
+    返回路径的父目录（以 / 结尾）。目录路径本身以 / 结尾，文件不带。
+    """
+    return path.rstrip('/').rsplit('/', 1)[0] + '/'
+
+
+def directory_key(directory):
+    """
+    将目录路径规范化为索引中的 path：解码后的完整路径，以 / 结尾。
+    """
+    return directory.rstrip('/') + '/'
+
+
+def subtree_range(directory):
+    """
+    返回目录子树在 path 上的范围 [lower, upper)，用于索引范围查询。
+    '0' 是 '/' 之后的下一个字符，因此 'a/b0' 恰好是所有 'a/b/...' 的上界。
+    """
+    lower = directory_key(directory)
+    return lower, lower[:-1] + '0'
+
+
+def subtree_finished_at(subtree_runs, path):
+    """
+    path 所在的、记录在 subtree_runs（RemoteIndex.get_subtree_runs 的结果）中的最深一棵子树的完成时间，
+    没有或从未完成时返回 0。只取最深的一棵，因为上级子树的运行可能跳过了嵌套的子树。
+    """
+    deepest = None
+    for directory in subtree_runs:
+        if path.startswith(directory) and (deepest is None or len(directory) > len(deepest)):
+            deepest = directory
+    return (subtree_runs[deepest] or 0) if deepest else 0
+
+
+def file_extension(path):
+    name = path.rsplit('/', 1)[-1]
+    return os.path.splitext(name)[1].lower().lstrip('.')
+
+
+class RemoteIndex:
+    """
+    远程文件索引，保存每个配置在 AList 上的目录和文件（路径、父目录、大小、修改时间、是否目录、
+    最后一次被看到的运行时间、下载时记录的 ETag），替代 webdav_directory_cache_<id>.json。
+
+    索引存放在独立的 SQLite 数据库中，path 与 parent 都是解码后的完整路径（目录以 / 结尾）。
+    last_seen_run 为发现该记录的那次运行开始时的 Unix 时间戳。
+    所有查询都以流式方式返回，调用方无需把整棵目录树加载到内存中。
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file or os.getenv('INDEX_DB_FILE', '/config/remote_index.db')
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        self._pending_writes = 0
+        self.initialize_tables()
+
+    def initialize_tables(self):
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS remote_files (
+                                    config_id INTEGER NOT NULL,
+                                    path TEXT NOT NULL,
+                                    parent TEXT NOT NULL,
+                                    href TEXT,
+                                    extension TEXT,
+                                    size INTEGER DEFAULT 0,
+                                    modified TEXT,
+                                    is_dir INTEGER NOT NULL DEFAULT 0,
+                                    fingerprint TEXT,
+                                    last_seen_run INTEGER,
+                                    PRIMARY KEY (config_id, path)
+                                    )''')
+            self.add_column_if_not_exists('remote_files', 'etag', 'TEXT')
+            # 目录最近一次通过 AList 接口强制刷新的时间戳（见 refresh_planner.py）
+            self.add_column_if_not_exists('remote_files', 'refreshed_at', 'INTEGER')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_remote_files_parent ON remote_files (config_id, parent)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_remote_files_extension ON remote_files (config_id, extension)')
+            # 每个配置最近一次遍历整个 rootpath 的索引运行的信息
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS index_runs (
+                                    config_id INTEGER PRIMARY KEY,
+                                    last_run INTEGER,
+                                    finished_at INTEGER
+                                    )''')
+            # 只遍历部分子树的运行（子路径、webhook 推送的目录）完成的时间，finished_at 为 NULL 表示从未单独完成过
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS index_subtrees (
+                                    config_id INTEGER NOT NULL,
+                                    directory TEXT NOT NULL,
+                                    finished_at INTEGER,
+                                    PRIMARY KEY (config_id, directory)
+                                    )''')
+            self.conn.commit()
+
+    def add_column_if_not_exists(self, table_name, column_name, column_type):
+        columns = [row['name'] for row in self.conn.execute(f"PRAGMA table_info({table_name})")]
+        if column_name not in columns:
+            self.conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+
+    def is_populated(self, config_id):
+        """
+        该配置是否已经完成过至少一次遍历整个 rootpath 的索引运行。
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT finished_at FROM index_runs WHERE config_id = ?', (config_id,)).fetchone()
+        return bool(row and row['finished_at'])
+
+    def last_finished_at(self, config_id):
+        with self.lock:
+            row = self.conn.execute('SELECT finished_at FROM index_runs WHERE config_id = ?', (config_id,)).fetchone()
+        return row['finished_at'] if row else None
+
+    def get_run(self, config_id):
+        """
+        返回该配置最近一次索引运行的 last_run（开始时间）和 finished_at（完成时间）。
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT last_run, finished_at FROM index_runs WHERE config_id = ?', (config_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_subtree_runs(self, config_id):
+        """
+        返回 {目录: finished_at}，为只遍历部分子树的运行记录的各子树的完成时间，配合 subtree_finished_at 使用。
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT directory, finished_at FROM index_subtrees WHERE config_id = ?', (config_id,)).fetchall()
+        return {row['directory']: row['finished_at'] for row in rows}
+
+    def get_files(self, config_id, paths, batch_size=500):
+        """
+        批量查询文件记录，返回 {path: 记录}，不存在的路径不会出现在结果中。
+        """
+        paths = list(paths)
+        records = {}
+        for i in range(0, len(paths), batch_size):
+            chunk = paths[i:i + batch_size]
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT * FROM remote_files WHERE config_id = ? AND is_dir = 0 AND path IN ({','.join('?' * len(chunk))})",
+                    [config_id] + chunk).fetchall()
+            for row in rows:
+                records[row['path']] = dict(row)
+        return records
+
+    def get(self, config_id, path):
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM remote_files WHERE config_id = ? AND path = ?',
+                                    (config_id, path)).fetchone()
+        return dict(row) if row else None
+
+    def get_children(self, config_id, directory):
+        """
+        返回目录的直接子项，格式与目录树缓存中的节点一致。
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT path, size, modified, is_dir, fingerprint FROM remote_files WHERE config_id = ? AND parent = ?',
+                (config_id, directory_key(directory))).fetchall()
+        return [{
+            'name': row['path'],
+            'size': row['size'],
+            'modified': row['modified'],
+            'is_directory': bool(row['is_dir']),
+            'fingerprint': row['fingerprint']
+        } for row in rows]
+
+    def iter_files(self, config_id, extensions=None, batch_size=1000):
+        """
+        流式遍历配置下的所有文件记录，可按扩展名过滤。
+        使用独立游标按批读取，不会一次性加载所有记录。
+        """
+        query = 'SELECT path, href, size, modified, last_seen_run FROM remote_files WHERE config_id = ? AND is_dir = 0'
+        params = [config_id]
+        if extensions:
+            extensions = sorted({ext.lower() for ext in extensions})
+            query += f" AND extension IN ({','.join('?' * len(extensions))})"
+            params.extend(extensions)
+
+        last_path = ''
+        while True:
+            # 以 path 为游标分批查询，避免长时间持有读锁
+            with self.lock:
+                rows = self.conn.execute(query + ' AND path > ? ORDER BY path LIMIT ?',
+                                         params + [last_path, batch_size]).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last_path = rows[-1]['path']
+
+    def iter_subtree_files(self, config_id, directory):
+        lower, upper = subtree_range(directory)
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT path FROM remote_files WHERE config_id = ? AND is_dir = 0 AND path >= ? AND path < ?',
+                (config_id, lower, upper)).fetchall()
+        return [row['path'] for row in rows]
+
+    def iter_directories(self, config_id, directory, batch_size=1000):
+        """
+        流式遍历 directory 子树中（包括 directory 自身）的所有目录，生成 (path, refreshed_at)。
+        """
+        lower, upper = subtree_range(directory)
+        last_path = ''
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    '''SELECT path, refreshed_at FROM remote_files
+                       WHERE config_id = ? AND is_dir = 1 AND path >= ? AND path < ? AND path > ?
+                       ORDER BY path LIMIT ?''',
+                    (config_id, lower, upper, last_path, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row['path'], row['refreshed_at']
+            last_path = rows[-1]['path']
+
+    def mark_refreshed(self, config_id, directories, refreshed_at):
+        with self.lock:
+            self.conn.executemany('UPDATE remote_files SET refreshed_at = ? WHERE config_id = ? AND path = ?',
+                                  [(refreshed_at, config_id, directory_key(directory)) for directory in directories])
+            self.conn.commit()
+
+    def start_run(self, config_id, full=True):
+        """
+        开始一次索引运行，返回 run_id。只遍历部分子树的运行（full 为 False）不修改 index_runs。
+        """
+        run_id = int(time.time())
+        if full:
+            with self.lock:
+                self.conn.execute('''INSERT INTO index_runs (config_id, last_run) VALUES (?, ?)
+                                     ON CONFLICT(config_id) DO UPDATE SET last_run = excluded.last_run''',
+                                  (config_id, run_id))
+                self.conn.commit()
+        return run_id
+
+    def finish_run(self, config_id):
+        with self.lock:
+            self.conn.execute('UPDATE index_runs SET finished_at = ? WHERE config_id = ?', (int(time.time()), config_id))
+            self.conn.commit()
+            self._pending_writes = 0
+
+    def finish_subtrees(self, config_id, directories, skipped=()):
+        """
+        记录只遍历了 directories 这几棵子树的运行已完成。skipped 为遍历时跳过的嵌套子树（单独设置了子路径的目录），
+        没有记录时以 NULL 记录，使其不会沿用上级子树的完成时间。
+        """
+        finished_at = int(time.time())
+        with self.lock:
+            self.conn.executemany('''INSERT INTO index_subtrees (config_id, directory, finished_at) VALUES (?, ?, ?)
+                                     ON CONFLICT(config_id, directory) DO UPDATE SET finished_at = excluded.finished_at''',
+                                  [(config_id, directory_key(directory), finished_at) for directory in directories])
+            self.conn.executemany('INSERT OR IGNORE INTO index_subtrees (config_id, directory) VALUES (?, ?)',
+                                  [(config_id, directory_key(directory)) for directory in skipped])
+            self.conn.commit()
+            self._pending_writes = 0
+
+    def save_listing(self, config_id, directory, file_infos, fingerprint, run_id, hrefs=None):
+        """
+        保存一个目录的最新列表：更新子项、记录目录指纹，并删除已不存在的子项（含其子树）。
+
+        子目录的 modified 不在这里更新（新的子目录为 NULL），而是在其整棵子树遍历成功后由 set_directory_modified 写入，
+        否则子目录列表失败或运行中断后，增量遍历会因修改时间一致而一直沿用过时的子树。
+        """
+        directory = directory_key(directory)
+        hrefs = hrefs or {}
+        with self.lock:
+            self.conn.execute('''INSERT INTO remote_files (config_id, path, parent, is_dir, fingerprint, last_seen_run)
+                                 VALUES (?, ?, ?, 1, ?, ?)
+                                 ON CONFLICT(config_id, path) DO UPDATE SET
+                                     fingerprint = excluded.fingerprint, last_seen_run = excluded.last_seen_run''',
+                              (config_id, directory, parent_path(directory), fingerprint, run_id))
+            self.conn.executemany('''INSERT INTO remote_files
+                                         (config_id, path, parent, href, extension, size, modified, is_dir, last_seen_run)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                     ON CONFLICT(config_id, path) DO UPDATE SET
+                                         href = excluded.href, extension = excluded.extension, size = excluded.size,
+                                         modified = CASE WHEN excluded.is_dir = 0 THEN excluded.modified
+                                                         WHEN is_dir = 1 THEN modified END,
+                                         is_dir = excluded.is_dir,
+                                         last_seen_run = excluded.last_seen_run,
+                                         etag = CASE WHEN size = excluded.size AND modified IS excluded.modified
+                                                     THEN etag END''',
+                                  [(config_id, item['name'], directory, hrefs.get(item['name']),
+                                    '' if item['is_directory'] else file_extension(item['name']),
+                                    item['size'] or 0, None if item['is_directory'] else item['modified'],
+                                    int(bool(item['is_directory'])), run_id)
+                                   for item in file_infos])
+
+            # 删除本次列表中已不存在的子项，目录需连同子树一起删除
+            stale = self.conn.execute('''SELECT path, is_dir FROM remote_files
+                                         WHERE config_id = ? AND parent = ? AND last_seen_run IS NOT ?''',
+                                      (config_id, directory, run_id)).fetchall()
+            for row in stale:
+                if row['is_dir']:
+                    lower, upper = subtree_range(row['path'])
+                    self.conn.execute('DELETE FROM remote_files WHERE config_id = ? AND path >= ? AND path < ?',
+                                      (config_id, lower, upper))
+                self.conn.execute('DELETE FROM remote_files WHERE config_id = ? AND path = ?', (config_id, row['path']))
+            self._maybe_commit()
+
+    def set_directory_modified(self, config_id, directory, modified):
+        """
+        目录的整棵子树遍历成功后记录其修改时间，之后的增量遍历在修改时间未变时才会沿用该子树。
+        """
+        with self.lock:
+            self.conn.execute('UPDATE remote_files SET modified = ? WHERE config_id = ? AND path = ? AND is_dir = 1',
+                              (modified, config_id, directory_key(directory)))
+            self._maybe_commit()
+
+    def clear_directory_modified(self, config_id, directories):
+        """
+        清除目录的修改时间，使下一次增量遍历重新列出这些目录（用于列表失败的目录及其上级目录）。
+        """
+        with self.lock:
+            self.conn.executemany('UPDATE remote_files SET modified = NULL WHERE config_id = ? AND path = ? AND is_dir = 1',
+                                  [(config_id, directory_key(directory)) for directory in directories])
+            self.conn.commit()
+
+    def set_etag(self, config_id, path, etag):
+        """
+        记录文件下载时服务端返回的 ETag（没有 ETag 时为 Last-Modified），续传时用作 If-Range，
+        文件大小或修改时间变化后会被 save_listing 清空。
+        """
+        with self.lock:
+            self.conn.execute('UPDATE remote_files SET etag = ? WHERE config_id = ? AND path = ?', (etag, config_id, path))
+            self._maybe_commit()
+
+    def touch_subtree(self, config_id, directory, run_id):
+        """
+        目录未变化、沿用索引时，将整棵子树标记为本次运行已看到。
+        """
+        lower, upper = subtree_range(directory)
+        with self.lock:
+            self.conn.execute('UPDATE remote_files SET last_seen_run = ? WHERE config_id = ? AND path >= ? AND path < ?',
+                              (run_id, config_id, lower, upper))
+            self._maybe_commit()
+
+    def _maybe_commit(self):
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_EVERY:
+            self.conn.commit()
+            self._pending_writes = 0
+
+    def clear(self, config_id):
+        with self.lock:
+            self.conn.execute('DELETE FROM remote_files WHERE config_id = ?', (config_id,))
+            self.conn.execute('DELETE FROM index_runs WHERE config_id = ?', (config_id,))
+            self.conn.execute('DELETE FROM index_subtrees WHERE config_id = ?', (config_id,))
+            self.conn.commit()
+
+    def import_json_cache(self, config_id, cache_file):
+        """
+        一次性导入旧版的 webdav_directory_cache_<id>.json。导入成功后将 JSON 文件重命名为 .imported。
+        返回导入的记录数。
+        """
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            file_tree = json.load(f)
+
+        run_id = int(os.path.getmtime(cache_file))
+        rows = []
+        # 旧缓存中根目录的子项没有单独的根节点，父目录直接由路径推导
+        stack = list(file_tree)
+        while stack:
+            item = stack.pop()
+            name = item.get('name')
+            if not name:
+                continue
+            is_dir = bool(item.get('is_directory'))
+            if is_dir:
+                name = directory_key(name)
+                # 旧版递归遍历会把目录自身作为子项记录下来，跳过这些重复节点
+                stack.extend(child for child in item.get('children') or [] if directory_key(child.get('name', '')) != name)
+            rows.append((config_id, name, parent_path(name), None, '' if is_dir else file_extension(name),
+                         item.get('size') or 0, item.get('modified'), int(is_dir), item.get('fingerprint'), run_id))
+
+        with self.lock:
+            self.conn.execute('DELETE FROM remote_files WHERE config_id = ?', (config_id,))
+            self.conn.executemany('''INSERT OR REPLACE INTO remote_files
+                                         (config_id, path, parent, href, extension, size, modified, is_dir, fingerprint, last_seen_run)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            self.conn.execute('''INSERT INTO index_runs (config_id, last_run, finished_at) VALUES (?, ?, ?)
+                                 ON CONFLICT(config_id) DO UPDATE SET last_run = excluded.last_run, finished_at = excluded.finished_at''',
+                              (config_id, run_id, run_id))
+            self.conn.commit()
+
+        os.rename(cache_file, cache_file + '.imported')
+        return len(rows)
+
+    def import_legacy_cache(self, config_id, logger):
+        """
+        如果该配置存在旧版 JSON 缓存且索引尚未建立，则导入它。
+        """
+        cache_file = os.path.join(CACHE_DIR, f'webdav_directory_cache_{config_id}.json')
+        if not os.path.exists(cache_file) or self.is_populated(config_id):
+            return
+        try:
+            count = self.import_json_cache(config_id, cache_file)
+            logger.info(f"已将旧版缓存文件 '{cache_file}' 导入远程文件索引，共 {count} 条记录。")
+        except Exception as e:
+            logger.error(f"导入旧版缓存文件出错: {e}")
+
+    def session(self, config_id, run_id):
+        return IndexSession(self, config_id, run_id)
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class IndexSession:
+    """
+    绑定到某个配置和某次运行的索引视图，供 DirectoryCrawler 使用。
+    """
+
+    def __init__(self, index, config_id, run_id):
+        self.index = index
+        self.config_id = config_id
+        self.run_id = run_id
+        self.populated = index.is_populated(config_id)
+        self._subtree_runs = None
+
+    def is_populated(self, directory):
+        """
+        directory 子树是否已经被一次完成的运行（完整运行或只遍历该子树的运行）写入过索引。
+        """
+        if self.populated:
+            return True
+        if self._subtree_runs is None:
+            self._subtree_runs = self.index.get_subtree_runs(self.config_id)
+        return bool(subtree_finished_at(self._subtree_runs, directory_key(directory)))
+
+    def get_fingerprint(self, directory):
+        row = self.index.get(self.config_id, directory_key(directory))
+        return row['fingerprint'] if row else None
+
+    def get_children(self, directory):
+        return self.index.get_children(self.config_id, directory)
+
+    def iter_subtree_files(self, directory):
+        return self.index.iter_subtree_files(self.config_id, directory)
+
+    def save_listing(self, directory, file_infos, fingerprint, hrefs=None):
+        self.index.save_listing(self.config_id, directory, file_infos, fingerprint, self.run_id, hrefs)
+
+    def touch_subtree(self, directory):
+        self.index.touch_subtree(self.config_id, directory, self.run_id)
+
+    def get_file(self, path):
+        return self.index.get(self.config_id, path)
+
+    def set_directory_modified(self, directory, modified):
+        self.index.set_directory_modified(self.config_id, directory, modified)
+
+    def clear_directory_modified(self, directories):
+        self.index.clear_directory_modified(self.config_id, directories)
+
+    def set_etag(self, path, etag):
+        self.index.set_etag(self.config_id, path, etag)
+
+    def finish(self, directories=None, skipped=()):
+        """
+        directories 为 None 时本次运行遍历了整个 rootpath，更新 index_runs 的完成时间；
+        否则只记录这几棵子树的完成时间，索引的整体完成时间不变。
+        """
+        if directories is None:
+            self.index.finish_run(self.config_id)
+        else:
+            self.index.finish_subtrees(self.config_id, directories, skipped)
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] != 'import':
+        print("用法: python remote_index.py import <config_id|all>")
+        sys.exit(1)
+
+    index = RemoteIndex()
+    try:
+        if sys.argv[2] == 'all':
+            cache_files = [f for f in os.listdir(CACHE_DIR)
+                           if f.startswith('webdav_directory_cache_') and f.endswith('.json')] if os.path.isdir(CACHE_DIR) else []
+            config_ids = [int(f[len('webdav_directory_cache_'):-len('.json')]) for f in cache_files]
+        else:
+            config_ids = [int(sys.argv[2])]
+
+        for config_id in config_ids:
+            cache_file = os.path.join(CACHE_DIR, f'webdav_directory_cache_{config_id}.json')
+            if not os.path.exists(cache_file):
+                print(f"缓存文件不存在: {cache_file}")
+                continue
+            count = index.import_json_cache(config_id, cache_file)
+            print(f"配置 {config_id}: 已导入 {count} 条记录")
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 import sys
 import os
-import fnmatch
 
 # 添加项目根目录到 sys.path，以便导入项目模块
 project_root = os.path.dirname(os.path.abspath(__file__))
@@ -10,33 +9,50 @@ if project_root not in sys.path:
 
 # 导入项目的日志模块
 from logger import setup_logger
+from local_inventory import LocalInventory
+from strm_writer import StrmWriter, STRM_UNCHANGED
 
 def replace_domain_in_strm_files(target_directory, old_domain, new_domain):
     """
     遍历目标目录及其子目录下的所有 .strm 文件，替换其中的域名。
+    通过 StrmWriter 写入，与生成 .strm 时记录的内容保持一致。
     """
-    for root, dirs, files in os.walk(target_directory):
-        for filename in files:
-            if fnmatch.fnmatch(filename, '*.strm'):
-                file_path = os.path.join(root, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    if old_domain in content:
-                        new_content = content.replace(old_domain, new_domain)
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            f.write(new_content)
+    local_tree = {}
+    inventory = LocalInventory(target_directory, logger=logger)
+    try:
+        for root, dirs, files in inventory.walk():
+            local_tree[os.path.relpath(root, target_directory)] = {name for name in files if name.lower().endswith('.strm')}
+    finally:
+        inventory.close()
+
+    strm_writer = StrmWriter(target_directory, local_tree, logger)
+    try:
+        for relative_dir, names in list(local_tree.items()):
+            directory = os.path.normpath(os.path.join(target_directory, relative_dir))
+            for name in sorted(names):
+                file_path = os.path.join(directory, name)
+                content = strm_writer.read(directory, name)
+                if content is None:
+                    logger.error(f"处理文件时出错：{file_path}，错误信息：无法读取文件")
+                    continue
+                if old_domain in content:
+                    if strm_writer.write(directory, name, content.replace(old_domain, new_domain)) != STRM_UNCHANGED:
                         logger.info(f"已更新文件：{file_path}")
-                    else:
-                        logger.info(f"文件中未找到旧域名，跳过：{file_path}")
-                except Exception as e:
-                    logger.error(f"处理文件时出错：{file_path}，错误信息：{e}")
+                else:
+                    logger.info(f"文件中未找到旧域名，跳过：{file_path}")
+    finally:
+        strm_writer.close()
+
+    if strm_writer.failed:
+        logger.error(f"{strm_writer.failed} 个文件写入失败")
 
 def main():
     if len(sys.argv) != 4:
         print("用法：python replace_domain.py <target_directory> <old_domain> <new_domain>")
         sys.exit(1)
 
+    # 与 main.py 一致，替换后的 .strm 文件保持 777 权限
+    os.umask(0)
     target_directory = sys.argv[1]
     old_domain = sys.argv[2]
     new_domain = sys.argv[3]
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_handler import DBHandler
+from downloader import HostLimiter, create_session, DEFAULT_DOWNLOAD_WORKERS
+from job_queue import JobQueue, ConfigBusyError
+from logger import setup_logger
+from main import run_config, ConfigRunError, get_jwt_token, DEFAULT_CRAWL_WORKERS
+from rate_limiter import RateLimiter
+
+# 同时运行的配置数量
+DEFAULT_PARALLEL_CONFIGS = 2
+
+
+def base_url_of(config):
+    return f"{config['protocol']}://{config['host']}:{config['port']}"
+
+
+class HostResources:
+    """
+    同一 AList 主机（protocol://host:port）上的配置共享的资源：
+
+    - session：一个带连接池的 requests.Session，连接数为这些配置中最大的线程数
+    - host_limiter：所有配置对该主机同时进行的下载请求不超过连接池大小
+    - rate_limiter：取这些配置中最严格的下载间隔，多个配置同时运行也不会超过该速率
+    - JWT：同一用户只登录一次
+
+    每个配置使用的线程数仍由自身的 crawl_workers / download_workers 决定。
+    """
+
+    def __init__(self, base_url, pool_size, rate_limiter):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.session = create_session(pool_size)
+        self.host_limiter = HostLimiter(pool_size)
+        self.rate_limiter = rate_limiter
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, username, password, logger):
+        with self._lock:
+            token = self._tokens.get((username, password))
+            if token is None:
+                token = get_jwt_token(self.base_url, username, password, logger, session=self.session)
+                if token:
+                    self._tokens[(username, password)] = token
+            return token
+
+
+def strictest_rate_limiter(configs):
+    """
+    返回平均请求速率最低的限速器，所有配置都不限速时返回不限速的限速器。
+    """
+    limiters = [RateLimiter.from_interval_range(*config['download_interval_range']) for config in configs]
+    limited = [limiter for limiter in limiters if limiter.rate is not None]
+    if not limited:
+        return RateLimiter(None)
+    return min(limited, key=lambda limiter: limiter.rate)
+
+
+def build_host_resources(configs):
+    """
+    按 AList 主机分组，返回 {base_url: HostResources}。
+    """
+    groups = {}
+    for config in configs:
+        groups.setdefault(base_url_of(config), []).append(config)
+
+    resources = {}
+    for base_url, group in groups.items():
+        pool_size = max(max(config.get('crawl_workers', DEFAULT_CRAWL_WORKERS),
+                            config.get('download_workers', DEFAULT_DOWNLOAD_WORKERS)) for config in group)
+        resources[base_url] = HostResources(base_url, pool_size, strictest_rate_limiter(group))
+    return resources
+
+
+def run_configs(config_ids, logger, parallel=DEFAULT_PARALLEL_CONFIGS, task_id=None):
+    """
+    在同一进程中运行多个配置，最多同时运行 parallel 个，返回每个配置的运行结果列表（与 config_ids 顺序一致）。
+    每个配置运行前取得运行队列中的租约；配置正在其他地方运行时改为加入队列，由调度守护进程在其结束后运行。
+    """
+    # 去重并保持顺序，同一配置不能同时运行两次
+    config_ids = list(dict.fromkeys(config_ids))
+
+    db_handler = DBHandler()
+    try:
+        # 在启动工作线程前完成表结构迁移
+        db_handler.initialize_tables()
+        configs = {config_id: db_handler.get_webdav_config(config_id) for config_id in config_ids}
+    finally:
+        db_handler.close()
+
+    resources = build_host_resources([config for config in configs.values() if config])
+    job_queue = JobQueue()
+    for host in resources.values():
+        logger.info(f"主机 {host.base_url}: 连接池大小 {host.pool_size}")
+
+    def run_one(config_id):
+        config = configs[config_id]
+        result = {
+            'config_id': config_id,
+            'config_name': config['config_name'] if config else '',
+            'success': False,
+            'elapsed': 0.0,
+            'stats': None,
+            'error': None
+        }
+        if not config:
+            result['error'] = '配置不存在'
+            return result
+
+        try:
+            job_id = job_queue.start(config_id, 'strm_creation', task_id, source='manual')
+        except ConfigBusyError as e:
+            queued_job_id, _ = job_queue.enqueue(config_id, 'strm_creation', task_id, source='manual')
+            result['error'] = f"{e}，已加入运行队列（队列任务 {queued_job_id}）"
+            logger.info(result['error'])
+            return result
+
+        logger.info(f"开始运行配置ID: {config_id}")
+        start = time.perf_counter()
+        try:
+            with job_queue.hold(job_id):
+                result['stats'] = run_config(config_id, task_id, resources=resources[base_url_of(config)])
+            result['success'] = True
+        except ConfigRunError as e:
+            result['error'] = str(e)
+        except Exception as e:
+            result['error'] = f"未捕获的异常: {e}"
+        result['elapsed'] = time.perf_counter() - start
+        logger.info(f"配置ID: {config_id} 运行{'完成' if result['success'] else '失败'}，用时 {result['elapsed']:.1f} 秒")
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(config_ids) or 1)), thread_name_prefix='config') as executor:
+            return list(executor.map(run_one, config_ids))
+    finally:
+        job_queue.close()
+
+
+def log_summary(results, logger):
+    succeeded = sum(1 for result in results if result['success'])
+    logger.info(f"运行汇总: 共 {len(results)} 个配置，成功 {succeeded} 个，失败 {len(results) - succeeded} 个")
+    for result in results:
+        name = f"配置ID {result['config_id']}（{result['config_name']}）"
+        if not result['success']:
+            logger.info(f"{name}: 失败，用时 {result['elapsed']:.1f} 秒，原因: {result['error']}")
+            continue
+        stats = result['stats']
+        line = (f"{name}: 成功，用时 {result['elapsed']:.1f} 秒，视频文件 {stats.video_file_counter} 个，"
+                f"新建或更新 .strm {stats.strm_file_counter} 个，已存在 {stats.existing_strm_file_counter} 个")
+        if stats.change_set:
+            line += f"，新增 {stats.change_set.added} / 变化 {stats.change_set.changed} / 删除 {stats.change_set.removed} 个文件"
+        if stats.download_progress:
+            progress = stats.download_progress
+            line += f"，下载 {progress.downloaded} 个，跳过 {progress.skipped} 个，失败 {progress.failed} 个"
+        logger.info(line)
+
+
+def main():
+    args = sys.argv[1:]
+    parallel = DEFAULT_PARALLEL_CONFIGS
+    if len(args) >= 2 and args[0] == '--parallel':
+        parallel = int(args[1])
+        args = args[2:]
+    if not args:
+        print("用法: python runner.py [--parallel N] <config_id> [<config_id> ...]")
+        sys.exit(1)
+
+    # 与 main.py 一致，生成的目录和文件创建时即为 777
+    os.umask(0)
+    logger, log_file = setup_logger('runner')
+    results = run_configs([int(config_id) for config_id in args], logger, parallel=parallel)
+    log_summary(results, logger)
+    if not all(result['success'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from cron_expression import CronExpression
+from db_handler import DBHandler
+from job_queue import JobQueue, JOB_TYPE_PARTIAL, lease_owner
+from logger import setup_logger
+from main import run_config
+from strm_validator import run_validation
+from task_scheduler import TASK_MODES, migrate_crontab
+
+# 同时运行的任务数量
+DEFAULT_SCHEDULER_WORKERS = 2
+# 每次触发时间随机推迟 0 ~ 该秒数，避免多个任务在同一时刻同时访问 AList
+DEFAULT_JITTER_SECONDS = 30
+# 轮询数据库的间隔，用于发现网页上新增、修改的任务和“立即运行”请求
+POLL_INTERVAL_SECONDS = 5
+# 触发时间已过去超过该秒数视为错过的运行（守护进程停止期间），启动后补跑一次
+MISSED_RUN_SECONDS = 60
+
+STATUS_SUCCESS = 'success'
+STATUS_FAILED = 'failed'
+
+
+def execute_job(job):
+    """
+    在当前进程中运行队列中的任务，失败时抛出异常。
+    """
+    config_id = int(job['config_id'])
+    if job['job_type'] == JOB_TYPE_PARTIAL:
+        # webhook 推送的目录，由主线程在领取任务时读取
+        run_config(config_id, job['task_id'], paths=job['paths'])
+        return
+    scan_mode = TASK_MODES[job['job_type']]
+    if scan_mode is None:
+        run_config(config_id, job['task_id'])
+    else:
+        run_validation(config_id, scan_mode, job['task_id'])
+
+
+class Scheduler:
+    """
+    定时任务调度守护进程，取代 crontab。
+
+    - 任务存放在 scheduled_tasks 表中，cron 表达式与原来写入 crontab 的完全相同
+    - 到期的任务加入运行队列（job_queue.py），网页上的“立即运行”也加入同一个队列
+    - webhook 推送的目录同步任务（JOB_TYPE_PARTIAL）也从同一个队列中领取，防抖结束后才会被领取
+    - 队列中的任务由 workers 个线程在同一进程中运行，不再为每个任务启动新的解释器；
+      同一配置同时只运行一个任务（包括其他进程通过 runner.py、main.py 启动的运行），
+      上一次运行尚未结束时新的触发在队列中等待，重复的触发合并为一次
+    - 每次触发时间加入随机抖动；守护进程停止期间错过的运行在启动后补跑一次
+    - 只有主线程访问数据库，任务的运行结果由主线程在下一次轮询时写回
+    """
+
+    def __init__(self, logger, workers=DEFAULT_SCHEDULER_WORKERS, max_jitter=DEFAULT_JITTER_SECONDS,
+                 poll_interval=POLL_INTERVAL_SECONDS):
+        self.logger = logger
+        self.workers = max(1, workers)
+        self.max_jitter = max(0, max_jitter)
+        self.poll_interval = poll_interval
+        self.db_handler = DBHandler()
+        self.job_queue = JobQueue()
+        self.owner = lease_owner()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='task')
+        self._active_jobs = set()
+        self._finished = []  # (job, 状态, 错误信息)
+        self._lock = threading.Lock()
+        self._invalid_tasks = set()
+
+    def schedule_next(self, cron, now):
+        next_time = cron.next_time(datetime.fromtimestamp(now)).timestamp()
+        return next_time + random.uniform(0, self.max_jitter)
+
+    def tick(self, now):
+        """
+        处理一次轮询，返回最近一个任务的触发时间（没有任务时为 None）。
+        """
+        self._record_finished()
+        next_due = None
+        for task in self.db_handler.get_scheduled_tasks():
+            task_id = task['task_id']
+            if not task['is_enabled']:
+                continue
+
+            try:
+                cron = CronExpression(task['cron_time'])
+            except ValueError as e:
+                if task_id not in self._invalid_tasks:
+                    self._invalid_tasks.add(task_id)
+                    self.logger.error(f"任务 {task['task_name']}（{task_id}）的 cron 表达式无效: {e}")
+                continue
+            self._invalid_tasks.discard(task_id)
+
+            next_run_at = task['next_run_at']
+            if next_run_at is not None and next_run_at <= now:
+                if now - next_run_at > MISSED_RUN_SECONDS + self.max_jitter:
+                    reason = f"补跑错过的运行（原定于 {datetime.fromtimestamp(next_run_at):%Y-%m-%d %H:%M}）"
+                else:
+                    reason = '定时触发'
+                self.enqueue(task, reason)
+                next_run_at = None
+            if next_run_at is None:
+                next_run_at = self.schedule_next(cron, now)
+                self.db_handler.set_task_next_run(task_id, next_run_at)
+            next_due = next_run_at if next_due is None else min(next_due, next_run_at)
+
+        self.dispatch()
+        return next_due
+
+    def enqueue(self, task, reason):
+        job_id, coalesced = self.job_queue.enqueue(int(task['config_id']), task['task_mode'], task['task_id'], source='schedule')
+        if coalesced:
+            self.logger.info(f"任务 {task['task_name']}（{reason}）已在队列中等待（队列任务 {job_id}），合并为一次运行")
+        else:
+            self.logger.info(f"任务 {task['task_name']}（{reason}）已加入队列（队列任务 {job_id}）")
+
+    def dispatch(self):
+        """
+        为运行中的任务续租，并在有空闲线程时领取排队的任务。
+        """
+        with self._lock:
+            active = list(self._active_jobs)
+        if active:
+            self.job_queue.renew(active)
+        while len(active) < self.workers:
+            job = self.job_queue.claim(self.owner)
+            if job is None:
+                break
+            active.append(job['job_id'])
+            if job['job_type'] == JOB_TYPE_PARTIAL:
+                job['paths'] = self.job_queue.get_paths(job['job_id'])
+            with self._lock:
+                self._active_jobs.add(job['job_id'])
+            self.logger.info(f"运行队列任务 {job['job_id']}，配置ID: {job['config_id']}，模式: {job['job_type']}，来源: {job['source']}")
+            self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        status = STATUS_FAILED
+        error = None
+        try:
+            execute_job(job)
+            status = STATUS_SUCCESS
+        except SystemExit:
+            # 校验脚本在配置无效时调用 sys.exit
+            error = '配置无效，运行已终止'
+        except Exception as e:
+            error = str(e)
+            self.logger.error(f"队列任务 {job['job_id']} 运行出错: {e}")
+        finally:
+            with self._lock:
+                self._finished.append((job, status, error))
+            self.logger.info(f"队列任务 {job['job_id']} 运行结束，状态: {status}，用时 {time.time() - job['started_at']:.1f} 秒")
+
+    def _record_finished(self):
+        with self._lock:
+            finished, self._finished = self._finished, []
+        for job, status, error in finished:
+            self.job_queue.finish(job['job_id'], status == STATUS_SUCCESS, error)
+            with self._lock:
+                self._active_jobs.discard(job['job_id'])
+            if job['task_id']:
+                self.db_handler.record_task_run(job['task_id'], job['started_at'], status)
+
+    def run_forever(self):
+        migrate_crontab(self.logger)
+        self.logger.info(f"定时任务调度已启动，工作线程数: {self.workers}")
+        try:
+            while True:
+                now = time.time()
+                try:
+                    next_due = self.tick(now)
+                except Exception as e:
+                    self.logger.error(f"调度定时任务时出错: {e}")
+                    next_due = None
+                # 最近的任务触发前一直休眠，但至少每 poll_interval 秒检查一次网页上的修改
+                sleep_seconds = self.poll_interval if next_due is None else min(self.poll_interval, next_due - time.time())
+                time.sleep(max(0.1, sleep_seconds))
+        finally:
+            self.executor.shutdown(wait=True)
+            self._record_finished()
+            self.job_queue.close()
+            self.db_handler.close()
+
+
+def main():
+    # 与 main.py 一致，生成的目录和文件创建时即为 777
+    os.umask(0)
+    logger, log_file = setup_logger('scheduler')
+    Scheduler(
+        logger,
+        workers=int(os.getenv('SCHEDULER_WORKERS', DEFAULT_SCHEDULER_WORKERS)),
+        max_jitter=int(os.getenv('SCHEDULER_JITTER', DEFAULT_JITTER_SECONDS))
+    ).run_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,28 @@
 import os
 import sys
-import json
-import random
 import time
+from classifier import FileClassifier, CATEGORY_VIDEO
 from db_handler import DBHandler
-from logger import setup_logger
-import subprocess
-import re  # 导入正则表达式模块
-
-# 定义无效目录树存储的根目录
-INVALID_FILE_TREES_DIR = 'invalid_file_trees'
+from invalid_manifest import write_manifest, manifest_path
+from job_queue import JobQueue, ConfigBusyError
+from local_inventory import LocalInventory
+from link_checker import LinkChecker, LINK_VALID, LINK_INVALID, DEFAULT_CHECK_WORKERS
+from logger import setup_logger, log_extra, set_log_stage, log_sampling_summary
+from main import run_config, ConfigRunError
+from metrics import RunMetrics, metrics_stage
+from rate_limiter import RateLimiter
+from remote_index import RemoteIndex, subtree_finished_at
+from urllib.parse import unquote, urlparse
+from listing_backends import WEBDAV_PREFIX
+
+SCAN_MODES = ('quick', 'slow', 'index')
+# .strm 中 AList 直链（/d/）和代理链接（/p/）的路径前缀
+STRM_URL_PREFIXES = ('/d/', '/p/')
 
 class StrmValidator:
-    def __init__(self, db_handler, scan_mode, config_id, task_id=None):
+    def __init__(self, db_handler, scan_mode, config_id, task_id=None, metrics=None):
         self.db_handler = db_handler
+        self.metrics = metrics
         self.scan_mode = scan_mode
         self.config_id = config_id
         self.task_id = task_id
@@ -22,13 +31,14 @@ class StrmValidator:
         self.script_config = None
         self.target_directory = ""
         self.remote_base = ""
+        self.classifier = None
         self.video_formats = set()
 
     def setup_logger(self):
         if self.task_id:
-            logger, log_file = setup_logger(f'validate_strm_config_{self.config_id}', task_id=self.task_id)
+            logger, log_file = setup_logger(f'validate_strm_config_{self.config_id}', task_id=self.task_id, config_id=self.config_id)
         else:
-            logger, log_file = setup_logger(f'validate_strm_config_{self.config_id}')
+            logger, log_file = setup_logger(f'validate_strm_config_{self.config_id}', config_id=self.config_id)
         return logger, log_file
 
     def set_target_directory(self, config_id):
@@ -48,8 +58,13 @@ class StrmValidator:
             self.logger.error("无法获取脚本配置，程序终止。")
             sys.exit(1)
 
-        # 获取视频格式
-        self.video_formats = set(fmt.lower() for fmt in self.script_config.get('video_formats', []))
+        # 格式、大小阈值和路径规则编译为分类器，与生成 .strm 时使用的规则一致
+        try:
+            self.classifier = FileClassifier(self.script_config)
+        except ValueError as e:
+            self.logger.error(f"路径规则无效: {e}，程序终止。")
+            sys.exit(1)
+        self.video_formats = self.classifier.extensions(CATEGORY_VIDEO)
         if not self.video_formats:
             self.logger.error("脚本配置中的 'video_formats' 为空或未配置，程序终止。")
             sys.exit(1)
@@ -63,130 +78,120 @@ class StrmValidator:
         if not self.remote_base.endswith('/'):
             self.remote_base += '/'
 
-    def load_cached_tree(self):
-        cache_dir = 'cache'
-        cache_file = os.path.join(cache_dir, f'webdav_directory_cache_{self.config_id}.json')
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    self.logger.info(f"加载缓存文件: {cache_file}")
-                    return json.load(f)
-            except Exception as e:
-                self.logger.error(f"加载缓存文件出错: {e}")
-        else:
-            self.logger.warning(f"缓存文件不存在: {cache_file}")
-        return None
-
     def list_local_strm_files(self):
-        strm_files = []
-        for root, dirs, files in os.walk(self.target_directory):
-            for file in files:
-                if file.lower().endswith('.strm'):
-                    full_path = os.path.abspath(os.path.join(root, file))
-                    strm_files.append(full_path)
+        inventory = LocalInventory(self.target_directory, logger=self.logger)
+        try:
+            # 排除规则匹配的目录和文件不参与校验
+            strm_files = list(inventory.iter_files('.strm', classifier=self.classifier))
+        finally:
+            inventory.close()
         self.logger.info(f"找到 {len(strm_files)} 个本地 .strm 文件")
         return strm_files
 
-    def build_expected_strm_set(self, file_tree, current_path=''):
+    def build_expected_strm_set(self, remote_index):
+        """
+        从远程文件索引中流式读取视频文件，构建期望存在的 .strm 文件路径集合。
+        """
         expected_strm_set = set()
-        size_threshold_mb = self.script_config.get('size_threshold', 100)  # 获取大小阈值，默认100MB
-        size_threshold_bytes = size_threshold_mb * 1024 * 1024  # 转换为字节
-
-        for file in file_tree:
-            file_name = file['name']
-            file_size = file.get('size', 0)  # 假设缓存中包含文件大小字段
-            is_directory = file.get('is_directory', False)  # 获取是否为目录的标识
+        for file in remote_index.iter_files(self.config_id, extensions=self.video_formats):
+            file_name = file['path']
+            file_size = file.get('size') or 0
 
             if not file_name.startswith(self.remote_base):
                 self.logger.warning(f"文件路径不以远程根路径开头: {file_name}")
                 continue
 
-            # 如果是目录，递归处理子文件
-            if is_directory:
-                children = file.get('children', [])
-                if children:
-                    expected_strm_set.update(self.build_expected_strm_set(children, current_path))
-            else:
-                # 文件大小小于阈值，跳过该文件
-                if file_size < size_threshold_bytes:
-                    self.logger.info(f"跳过文件（大小小于阈值 {size_threshold_mb}MB）: {file_name}, 大小: {file_size / (1024 * 1024):.2f}MB")
-                    continue
-
-                file_extension = os.path.splitext(file_name)[1].lower().lstrip('.')
-                if file_extension in self.video_formats:
-                    # 生成对应的 .strm 文件路径
-                    relative_path = os.path.relpath(file_name, self.remote_base)
-                    video_relative_dir = os.path.dirname(relative_path)
-                    video_base_name = os.path.splitext(os.path.basename(relative_path))[0]
-                    strm_file_name = f"{video_base_name}.strm"
-                    strm_file_path = os.path.abspath(
-                        os.path.join(self.target_directory, video_relative_dir, strm_file_name)
-                    )
-                    expected_strm_set.add(strm_file_path)
-                    self.logger.debug(f"预期的 .strm 文件路径: {strm_file_path}")
+            # 被路径规则排除的文件不会生成 .strm
+            if self.classifier.has_rules and self.classifier.is_excluded_path(os.path.relpath(file_name, self.remote_base)):
+                continue
+
+            # 文件大小小于阈值，跳过该文件
+            if self.classifier.is_too_small(file_size):
+                self.logger.info(f"跳过文件（大小小于阈值 {self.classifier.size_threshold_mb}MB）: {file_name}, 大小: {file_size / (1024 * 1024):.2f}MB",
+                                 extra=log_extra('validate', 'skipped_size'))
+                continue
+
+            # 生成对应的 .strm 文件路径
+            relative_path = os.path.relpath(file_name, self.remote_base)
+            video_relative_dir = os.path.dirname(relative_path)
+            video_base_name = os.path.splitext(os.path.basename(relative_path))[0]
+            strm_file_name = f"{video_base_name}.strm"
+            strm_file_path = os.path.abspath(
+                os.path.join(self.target_directory, video_relative_dir, strm_file_name)
+            )
+            expected_strm_set.add(strm_file_path)
+            self.logger.debug(f"预期的 .strm 文件路径: {strm_file_path}", extra=log_extra('validate', 'expected_strm'))
         return expected_strm_set
 
-    def check_cache_file(self, cache_file, max_age_hours=24):
+    def check_index_age(self, remote_index, max_age_hours=24):
         """
-        检查缓存文件是否过期，如果缓存文件存在且在max_age_hours内被修改过，则返回True。
-        如果缓存文件不存在或已过期，则返回False。
+        检查远程文件索引是否过期，如果索引已建立且在max_age_hours内完成过遍历整个 rootpath 的运行，则返回True。
+        只同步了部分子路径或推送目录的运行不算，因为其他目录中云端删除的文件不会反映到索引中。
+        如果索引不存在或已过期，则返回False。
         """
-        if os.path.exists(cache_file):
-            last_modified_time = os.path.getmtime(cache_file)
-            current_time = time.time()
-            # 计算缓存文件的年龄（秒），并将其转换为小时
-            cache_age_hours = (current_time - last_modified_time) / 3600
-            if cache_age_hours <= max_age_hours:
-                self.logger.info(f"缓存文件 {cache_file} 存在且未过期（{cache_age_hours:.2f}小时）")
+        finished_at = remote_index.last_finished_at(self.config_id)
+        if finished_at:
+            # 计算索引的年龄（秒），并将其转换为小时
+            index_age_hours = (time.time() - finished_at) / 3600
+            if index_age_hours <= max_age_hours:
+                self.logger.info(f"远程文件索引存在且未过期（{index_age_hours:.2f}小时）")
                 return True
             else:
-                self.logger.info(f"缓存文件 {cache_file} 已过期（{cache_age_hours:.2f}小时），将重新生成缓存")
+                self.logger.info(f"远程文件索引已过期（{index_age_hours:.2f}小时），将重新生成索引")
         else:
-            self.logger.warning(f"缓存文件 {cache_file} 不存在")
+            self.logger.warning(f"配置 {self.config_id} 的远程文件索引不存在")
 
-        # 缓存文件不存在或已过期
+        # 索引不存在或已过期
         return False
 
     def rebuild_cache(self, config_id):
         """
-        调用 main.py 重建缓存文件
+        在当前进程中对整个 rootpath 运行一次同步，重建远程文件索引，成功时返回 True。
+
+        校验任务已持有该配置的运行租约（调度守护进程领取任务时或命令行启动时取得），
+        因此直接调用 run_config，不能再启动 main.py 子进程，否则子进程会因配置正在运行而退出。
         """
-        self.logger.info("正在调用 main.py 重建缓存文件...")
+        self.logger.info("正在重建远程文件索引...")
         try:
-            # 调用 main.py 重新生成缓存文件
-            result = subprocess.run(
-                ['/usr/local/bin/python3.9', 'main.py', str(config_id)],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            if result.returncode == 0:
-                self.logger.info(f"缓存文件重建成功: {result.stdout}")
-            else:
-                self.logger.error(f"缓存文件重建失败: {result.stderr}")
+            run_config(config_id, self.task_id, full=True)
+            self.logger.info("远程文件索引重建成功")
+            return True
+        except ConfigRunError as e:
+            self.logger.error(f"远程文件索引重建失败: {e}")
         except Exception as e:
-            self.logger.error(f"调用 main.py 重建缓存时发生错误: {e}")
-
-    def fast_scan(self, cached_tree, local_strm_files):
-        # 修改为先检查缓存文件时间
-        cache_file = os.path.join('cache', f'webdav_directory_cache_{self.config_id}.json')
-        if not self.check_cache_file(cache_file):
-            # 如果缓存文件已过期或不存在，调用 main.py 重建缓存
-            self.rebuild_cache(self.config_id)
-            # 重新加载缓存文件
-            cached_tree = self.load_cached_tree()
-
-        if not cached_tree:
-            self.logger.warning("未加载到缓存树，快扫将视为所有本地 .strm 文件无效。")
-            invalid_files = local_strm_files
-        else:
-            invalid_files = self.fast_scan_logic(cached_tree, local_strm_files)
+            self.logger.error(f"重建远程文件索引时发生错误: {e}")
+        return False
+
+    def prepare_fast_scan(self):
+        """
+        快扫前检查远程文件索引的更新时间，已过期或不存在时重建索引。
+        重建会生成新的 .strm 文件，因此需要在扫描本地文件之前进行。
+        """
+        remote_index = RemoteIndex()
+        try:
+            remote_index.import_legacy_cache(self.config_id, self.logger)
+            if self.check_index_age(remote_index) or self.rebuild_cache(self.config_id):
+                return
+            if not remote_index.is_populated(self.config_id):
+                # 没有可用的索引时无法判断，不能把所有本地 .strm 文件都记为无效
+                self.logger.error("远程文件索引不存在且重建失败，快扫已终止。")
+                raise RuntimeError("远程文件索引不存在且重建失败")
+            self.logger.warning("远程文件索引重建失败，将使用已过期的索引进行快扫，结果可能不准确。")
+        finally:
+            remote_index.close()
+
+    def fast_scan(self, local_strm_files):
+        remote_index = RemoteIndex()
+        try:
+            invalid_files = self.fast_scan_logic(remote_index, local_strm_files)
+        finally:
+            remote_index.close()
 
         return invalid_files
 
-    def fast_scan_logic(self, cached_tree, local_strm_files):
+    def fast_scan_logic(self, remote_index, local_strm_files):
         # 构建期望的 .strm 文件集
-        expected_strm_files = self.build_expected_strm_set(cached_tree) if cached_tree else set()
+        expected_strm_files = self.build_expected_strm_set(remote_index)
         local_strm_files_set = set(local_strm_files)
 
         # 额外存在的本地 .strm 文件（本地有但缓存中没有）
@@ -201,12 +206,12 @@ class StrmValidator:
         if extra_local_files:
             self.logger.info(f"发现 {len(extra_local_files)} 个本地多余的 .strm 文件（本地存在但缓存中没有）：")
             for file in extra_local_files:
-                self.logger.debug(f"多余的文件: {file}")
+                self.logger.debug(f"多余的文件: {file}", extra=log_extra('validate', 'extra_file'))
 
         if missing_files_in_local:
             self.logger.info(f"发现 {len(missing_files_in_local)} 个缓存中存在但本地缺失的 .strm 文件：")
             for file in missing_files_in_local:
-                self.logger.debug(f"缺失的文件: {file}")
+                self.logger.debug(f"缺失的文件: {file}", extra=log_extra('validate', 'missing_file'))
 
         # 输出最终汇总
         total_invalid_files = len(invalid_files)
@@ -214,11 +219,10 @@ class StrmValidator:
 
         return invalid_files
 
-    def slow_scan(self, local_strm_files):
-        self.logger.info("开始执行慢扫模式...")
-        invalid_files = []
-        total_files = len(local_strm_files)
-
+    def create_link_checker(self):
+        """
+        按配置创建慢扫和索引扫描共用的 LinkChecker。
+        """
         # 获取下载间隔范围
         download_interval_range = self.config.get('download_interval_range', (1, 3))
         if not isinstance(download_interval_range, (list, tuple)) or len(download_interval_range) != 2:
@@ -234,120 +238,209 @@ class StrmValidator:
             self.logger.error("下载间隔范围的值必须为整数。")
             sys.exit(1)
 
-        # 确保 min_interval <= max_interval
-        if min_interval > max_interval:
-            min_interval, max_interval = max_interval, min_interval
+        # 下载间隔范围作为所有校验请求共享的令牌桶限速器参数
+        rate_limiter = RateLimiter.from_interval_range(min_interval, max_interval)
+        workers = self.config.get('download_workers', DEFAULT_CHECK_WORKERS)
+        self.logger.info(f"HTTP 校验并发数: {workers}")
+        return LinkChecker(rate_limiter=rate_limiter, workers=workers, metrics=self.metrics)
 
-        for idx, strm_file in enumerate(local_strm_files, 1):
+    def read_strm_urls(self, local_strm_files, invalid_files):
+        """
+        逐个读取 .strm 文件中的 URL，产出 (strm_file, url)。无法读取或内容为空的文件直接记为无效。
+        """
+        for strm_file in local_strm_files:
             try:
                 # 读取 .strm 文件中的 URL
                 with open(strm_file, 'r', encoding='utf-8') as f:
                     url = f.read().strip()
+            except Exception as e:
+                self.logger.error(f"读取 .strm 文件时出错: {strm_file}，错误: {e}")
+                invalid_files.append(strm_file)
+                continue
 
-                if not url:
-                    self.logger.warning(f"空的 .strm 文件: {strm_file}")
-                    invalid_files.append(strm_file)
-                    continue
-
-                # 使用 curl 验证 URL
-                self.logger.info(f"({idx}/{total_files}) 正在验证: {url}")
-                result = subprocess.run(
-                    ['curl', '-s', url],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True
-                )
-
-                stdout_output = result.stdout
-                stderr_output = result.stderr
-
-                # 检查 stderr 中的警告信息
-                if "Warning: Binary output can mess up your terminal" in stderr_output:
-                    # 出现警告信息，认为链接有效
-                    self.logger.info(f"有效的 .strm 文件: {strm_file}")
-                # 检查 stdout 中是否包含 <a href="..."> 标签
-                elif re.search(r'<a href=".*">.*</a>', stdout_output):
-                    self.logger.info(f"有效的 .strm 文件: {strm_file}")
-                # 检查 stdout 中是否包含 HTTP 错误消息（如 400 Bad Request、404 Not Found 等）
-                elif re.search(r'\b\d{3}\s+\w+', stdout_output):
-                    error_message = stdout_output.strip()
-                    self.logger.warning(f"无效的 .strm 文件: {strm_file}，错误信息: {error_message}")
-                    invalid_files.append(strm_file)
-                else:
-                    # 尝试解析 JSON，检查 'code' 字段
-                    try:
-                        response_json = json.loads(stdout_output)
-                        if 'code' in response_json:
-                            code_value = response_json['code']
-                            self.logger.warning(f"无效的 .strm 文件: {strm_file}，返回的 code: {code_value}")
-                            invalid_files.append(strm_file)
-                        else:
-                            # 如果没有 'code' 字段，认为链接有效
-                            self.logger.info(f"有效的 .strm 文件: {strm_file}")
-                    except json.JSONDecodeError:
-                        # 不是有效的 JSON，认为链接有效
-                        self.logger.info(f"有效的 .strm 文件: {strm_file}")
+            if not url:
+                self.logger.warning(f"空的 .strm 文件: {strm_file}")
+                invalid_files.append(strm_file)
+                continue
+            yield strm_file, url
 
-            except Exception as e:
-                # 捕获异常并记录
-                self.logger.error(f"验证 .strm 文件时出错: {strm_file}，错误: {e}")
+    def probe_links(self, checker, items, total_files, invalid_files):
+        """
+        并发发起 HTTP 校验，无效的文件加入 invalid_files，返回请求出错的文件数量。
+        """
+        error_count = 0
+        for idx, (strm_file, url, result, detail) in enumerate(checker.check_all(items), 1):
+            if result == LINK_VALID:
+                self.logger.info(f"({idx}/{total_files}) 有效的 .strm 文件: {strm_file}", extra=log_extra('validate', 'link_valid'))
+            elif result == LINK_INVALID:
+                self.logger.warning(f"({idx}/{total_files}) 无效的 .strm 文件: {strm_file}，错误信息: {detail}")
                 invalid_files.append(strm_file)
+            else:
+                # 网络错误无法判断链接是否失效，不计入无效文件
+                error_count += 1
+                self.logger.error(f"({idx}/{total_files}) 验证 .strm 文件时出错: {strm_file}，错误: {detail}")
 
-            # 随机等待
-            interval = random.randint(min_interval, max_interval)
-            self.logger.debug(f"等待 {interval} 秒后继续...")
-            time.sleep(interval)
+        if error_count:
+            self.logger.warning(f"有 {error_count} 个 .strm 文件因请求出错未能验证")
+        return error_count
 
+    def slow_scan(self, local_strm_files):
+        self.logger.info("开始执行慢扫模式...")
+        invalid_files = []
+        checker = self.create_link_checker()
+        self.probe_links(checker, self.read_strm_urls(local_strm_files, invalid_files), len(local_strm_files), invalid_files)
         self.logger.info(f"慢扫发现 {len(invalid_files)} 个无效的 .strm 文件")
         return invalid_files
 
-    def save_invalid_trees(self, invalid_files):
-        if not os.path.exists(INVALID_FILE_TREES_DIR):
-            os.makedirs(INVALID_FILE_TREES_DIR)
-            self.logger.info(f"创建目录: {INVALID_FILE_TREES_DIR}")
-
-        invalid_tree = {}
-        for file_path in invalid_files:
-            relative_path = os.path.relpath(file_path, self.target_directory)
-            parts = relative_path.split(os.sep)
-            current = invalid_tree
-            for part in parts[:-1]:
-                current = current.setdefault(part, {})
-            current[parts[-1]] = "invalid"
-
-        output_file = os.path.join(INVALID_FILE_TREES_DIR, f'invalid_file_trees_{self.config_id}.json')
+    def strm_url_to_remote_path(self, url):
+        """
+        将 .strm 中的 AList 直链还原为远程文件索引中的路径（create_strm_file 的逆过程）：
+        http(s)://host:port/d/<路径> -> /dav/<解码后的路径>。/p/ 代理链接同样处理，
+        主机名和查询参数（如签名）不参与比较。无法识别时返回 None。
+        """
+        path = urlparse(url).path
+        for prefix in STRM_URL_PREFIXES:
+            if path.startswith(prefix):
+                return WEBDAV_PREFIX + unquote(path[len(prefix) - 1:])
+        return None
+
+    def index_scan(self, local_strm_files, max_age_hours=24, batch_size=500):
+        """
+        索引扫描：把每个 .strm 的链接还原为远程路径，分批在远程文件索引中查找。
+
+        - 记录存在且在 max_age_hours 内被遍历看到过：有效
+        - 路径位于 rootpath 下但记录不存在，且索引在 max_age_hours 内完成过完整运行，
+          或路径所在的子树（子路径、推送的目录）在 max_age_hours 内被单独遍历完成过：无效
+        - 其余情况（记录过期、索引未完成、链接无法识别或不在 rootpath 下）才发起 HTTP 校验
+        """
+        self.logger.info("开始执行索引扫描模式...")
+        invalid_files = []
+        to_probe = []
+        valid_count = 0
+        max_age = max_age_hours * 3600
+        now = time.time()
+
+        remote_index = RemoteIndex()
+        try:
+            remote_index.import_legacy_cache(self.config_id, self.logger)
+            run = remote_index.get_run(self.config_id)
+            index_fresh = bool(run and run['finished_at'] and run['finished_at'] >= (run['last_run'] or 0)
+                               and now - run['finished_at'] <= max_age)
+            subtree_runs = remote_index.get_subtree_runs(self.config_id)
+            if not index_fresh:
+                self.logger.warning("远程文件索引的完整运行不存在、未完成或已过期，"
+                                    "除最近单独同步过的子树外，索引中缺失的文件将通过 HTTP 校验。")
+
+            def missing_is_invalid(path):
+                if not path or not path.startswith(self.remote_base):
+                    return False
+                return index_fresh or now - subtree_finished_at(subtree_runs, path) <= max_age
+
+            def check_batch(batch):
+                nonlocal valid_count
+                records = remote_index.get_files(self.config_id, [path for _, _, path in batch if path])
+                for strm_file, url, path in batch:
+                    record = records.get(path) if path else None
+                    if record and now - (record['last_seen_run'] or 0) <= max_age:
+                        valid_count += 1
+                        self.logger.debug(f"索引中存在，有效的 .strm 文件: {strm_file}", extra=log_extra('validate', 'index_valid'))
+                    elif not record and missing_is_invalid(path):
+                        self.logger.warning(f"无效的 .strm 文件: {strm_file}，远程文件已不存在: {path}")
+                        invalid_files.append(strm_file)
+                    else:
+                        to_probe.append((strm_file, url))
+
+            batch = []
+            for strm_file, url in self.read_strm_urls(local_strm_files, invalid_files):
+                batch.append((strm_file, url, self.strm_url_to_remote_path(url)))
+                if len(batch) >= batch_size:
+                    check_batch(batch)
+                    batch = []
+            if batch:
+                check_batch(batch)
+        finally:
+            remote_index.close()
+
+        self.logger.info(f"索引确认有效 {valid_count} 个，确认无效 {len(invalid_files)} 个，需要 HTTP 校验 {len(to_probe)} 个")
+        if to_probe:
+            self.probe_links(self.create_link_checker(), to_probe, len(to_probe), invalid_files)
+
+        self.logger.info(f"索引扫描发现 {len(invalid_files)} 个无效的 .strm 文件")
+        return invalid_files
+
+    def save_invalid_manifest(self, invalid_files, total_files):
+        """
+        把无效的 .strm 文件逐行写入失效文件清单（invalid_manifest.py），没有无效文件时清除旧的清单。
+        """
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(invalid_tree, f, ensure_ascii=False, indent=4)
-            self.logger.info(f"无效的目录树已保存到: {output_file}")
+            summary = write_manifest(self.config_id, self.target_directory, invalid_files,
+                                     scan_mode=self.scan_mode, total_files=total_files)
+            if summary:
+                self.logger.info(f"{summary['count']} 个无效的 .strm 文件已写入清单: {manifest_path(self.config_id)}")
         except Exception as e:
-            self.logger.error(f"保存无效目录树时出错: {e}")
+            self.logger.error(f"保存失效文件清单时出错: {e}")
 
     def validate_all_strm_files(self):
-        local_strm_files = self.list_local_strm_files()
+        if self.scan_mode == 'quick':
+            set_log_stage(self.logger, 'validate')
+            with metrics_stage(self.metrics, 'index_check'):
+                self.prepare_fast_scan()
+
+        set_log_stage(self.logger, 'local_scan')
+        with metrics_stage(self.metrics, 'local_scan'):
+            local_strm_files = self.list_local_strm_files()
         invalid_files = []
 
-        if self.scan_mode == 'quick':
-            cached_tree = self.load_cached_tree()
-            if not cached_tree:
-                self.logger.warning("未加载到缓存树，快扫将视为所有本地 .strm 文件无效。")
-                invalid_files = local_strm_files
+        set_log_stage(self.logger, 'validate')
+        with metrics_stage(self.metrics, 'scan'):
+            if self.scan_mode == 'quick':
+                invalid_files = self.fast_scan(local_strm_files)
+            elif self.scan_mode == 'slow':
+                invalid_files = self.slow_scan(local_strm_files)
+            elif self.scan_mode == 'index':
+                invalid_files = self.index_scan(local_strm_files)
             else:
-                invalid_files = self.fast_scan(cached_tree, local_strm_files)
-        elif self.scan_mode == 'slow':
-            invalid_files = self.slow_scan(local_strm_files)
-        else:
-            self.logger.error(f"未知的扫描模式: {self.scan_mode}")
-            sys.exit(1)
+                self.logger.error(f"未知的扫描模式: {self.scan_mode}")
+                sys.exit(1)
 
         total_files = len(local_strm_files)
         invalid_count = len(invalid_files)
         valid_count = total_files - invalid_count
+        if self.metrics:
+            self.metrics.set('strm_files', total_files)
+            self.metrics.set('invalid_files', invalid_count)
 
-        if invalid_files:
-            self.save_invalid_trees(invalid_files)
+        self.save_invalid_manifest(invalid_files, total_files)
 
         self.logger.info(f"验证完成。有效的 .strm 文件数量: {valid_count}，无效的 .strm 文件数量: {invalid_count}")
+        log_sampling_summary(self.logger)
+
+def run_validation(config_id, scan_mode, task_id=None):
+    """
+    对配置执行一次校验，供命令行和定时任务守护进程（scheduler_daemon.py）调用。
+    配置无效时与命令行一致抛出 SystemExit。本次校验的指标写入 run_metrics 表。
+    """
+    # 创建数据库处理实例
+    db_handler = DBHandler()
+    metrics = RunMetrics(f'strm_validation_{scan_mode}', config_id, task_id)
+    status = 'failed'
+    validator = None
+
+    try:
+        # 创建 StrmValidator 实例并执行校验
+        validator = StrmValidator(db_handler, scan_mode, config_id, task_id=task_id, metrics=metrics)
+        validator.set_target_directory(config_id)
+        validator.validate_all_strm_files()
+        status = 'success'
+    finally:
+        # 关闭数据库连接
+        db_handler.close()
+        try:
+            metrics.save(status)
+        except Exception as e:
+            # 指标写入失败不影响校验结果
+            if validator:
+                validator.logger.error(f"保存运行指标时出错: {e}")
 
 def main():
     if len(sys.argv) < 3 or len(sys.argv) > 4:
@@ -364,23 +457,25 @@ def main():
     scan_mode = sys.argv[2].lower()
     task_id = sys.argv[3] if len(sys.argv) == 4 else None  # 获取 task_id，如果存在
 
-    if scan_mode not in ['quick', 'slow']:
-        print("扫描模式无效，请选择 'quick' 或 'slow'.")
+    if scan_mode not in SCAN_MODES:
+        print("扫描模式无效，请选择 'quick'、'slow' 或 'index'.")
         sys.exit(1)
 
-    # 创建数据库处理实例
-    db_handler = DBHandler()
+    # 取得该配置的运行租约，快扫重建索引时在同一租约下运行同步
+    job_queue = JobQueue()
+    try:
+        job_id = job_queue.start(config_id, f'strm_validation_{scan_mode}', task_id, source='cli')
+    except ConfigBusyError as e:
+        print(f"{e}，本次校验已取消。")
+        sys.exit(1)
 
     try:
-        # 创建 StrmValidator 实例并执行校验
-        validator = StrmValidator(db_handler, scan_mode, config_id, task_id=task_id)
-        validator.set_target_directory(config_id)
-        validator.validate_all_strm_files()
+        with job_queue.hold(job_id):
+            run_validation(config_id, scan_mode, task_id)
     except Exception as e:
         print(f"运行过程中出现未捕获的异常: {e}")
     finally:
-        # 关闭数据库连接
-        db_handler.close()
+        job_queue.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,120 @@
+import os
+from collections import OrderedDict
+
+from local_inventory import LocalInventory
+from logger import log_extra
+
+# 写入结果
+STRM_CREATED = 'created'
+STRM_UPDATED = 'updated'
+STRM_UNCHANGED = 'unchanged'
+
+DEFAULT_BATCH_SIZE = 200
+# 内存中最多保留多少个目录的 .strm 内容记录
+CONTENT_CACHE_DIRECTORIES = 256
+
+
+class StrmWriter:
+    """
+    批量写入 .strm 文件。
+
+    - 只有内容变化时才写入：已存在的 .strm 先与 strm_contents 中记录的内容比较，
+      没有记录时（例如旧版本或其他工具生成的文件）读取一次文件内容
+    - 写入时先写同目录下的临时文件，再用 os.replace 原子替换，媒体服务器不会读到半个文件
+    - 临时文件创建后用 fchmod 设为 0o777（不依赖调用方的 umask），替换后目标文件即为 777，不再逐个 chmod 路径
+    - 累积 batch_size 个文件后统一写入并提交内容记录
+
+    local_tree 为 build_local_directory_tree 返回的 {相对目录: 文件名集合}，写入后会同步更新。
+    """
+
+    def __init__(self, target_directory, local_tree, logger, batch_size=DEFAULT_BATCH_SIZE, db_file=None):
+        self.target_directory = target_directory
+        self.local_tree = local_tree
+        self.logger = logger
+        self.batch_size = batch_size
+        self.inventory = LocalInventory(target_directory, db_file=db_file)
+        self._contents = OrderedDict()  # 相对目录 -> {文件名: 内容}，按目录懒加载
+        self._pending = []
+        self._discovered = []  # 从文件中读到、尚未记录的内容
+        self.failed = 0
+
+    def _directory_contents(self, relative_dir):
+        contents = self._contents.get(relative_dir)
+        if contents is None:
+            contents = self.inventory.load_strm_contents(relative_dir)
+            self._contents[relative_dir] = contents
+            if len(self._contents) > CONTENT_CACHE_DIRECTORIES:
+                self._contents.popitem(last=False)
+        else:
+            self._contents.move_to_end(relative_dir)
+        return contents
+
+    def read(self, local_directory, strm_file_name):
+        """
+        返回已存在的 .strm 内容，优先使用记录的内容，文件不存在时返回 None。
+        """
+        relative_dir = os.path.relpath(local_directory, self.target_directory)
+        if strm_file_name not in self.local_tree.get(relative_dir, ()):
+            return None
+        contents = self._directory_contents(relative_dir)
+        if strm_file_name not in contents:
+            try:
+                with open(os.path.join(local_directory, strm_file_name), 'r', encoding='utf-8') as f:
+                    contents[strm_file_name] = f.read().strip()
+            except OSError:
+                return None
+            self._discovered.append((relative_dir, strm_file_name, contents[strm_file_name]))
+        return contents[strm_file_name]
+
+    def write(self, local_directory, strm_file_name, content):
+        """
+        安排写入一个 .strm 文件，返回 STRM_CREATED、STRM_UPDATED 或 STRM_UNCHANGED。
+        实际写入在累积到 batch_size 个文件或调用 flush() 时进行。
+        """
+        existing = self.read(local_directory, strm_file_name)
+        if existing is not None and existing == content:
+            return STRM_UNCHANGED
+
+        relative_dir = os.path.relpath(local_directory, self.target_directory)
+        self._pending.append((local_directory, relative_dir, strm_file_name, content))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        return STRM_CREATED if existing is None else STRM_UPDATED
+
+    def flush(self):
+        if not self._pending:
+            if self._discovered:
+                self.inventory.save_strm_contents(self._discovered)
+                self._discovered = []
+            return
+        written = []
+        for local_directory, relative_dir, strm_file_name, content in self._pending:
+            strm_file_path = os.path.join(local_directory, strm_file_name)
+            temp_path = os.path.join(local_directory, f'.{strm_file_name}.tmp')
+            try:
+                fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o777)
+                try:
+                    os.fchmod(fd, 0o777)
+                    os.write(fd, content.encode('utf-8'))
+                finally:
+                    os.close(fd)
+                os.replace(temp_path, strm_file_path)
+            except OSError as e:
+                self.failed += 1
+                self.logger.error(f"写入 .strm 文件时出错: {strm_file_path}，错误: {e}")
+                continue
+            self.logger.debug(f".strm 文件已写入: {strm_file_path}", extra=log_extra('strm_write', 'strm_written'))
+            self.local_tree.setdefault(relative_dir, set()).add(strm_file_name)
+            self._directory_contents(relative_dir)[strm_file_name] = content
+            written.append((relative_dir, strm_file_name, content))
+
+        self.inventory.save_strm_contents(self._discovered + written)
+        self.logger.info(f"已批量写入 {len(written)} 个 .strm 文件")
+        self._pending = []
+        self._discovered = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.inventory.close()
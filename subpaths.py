@@ -0,0 +1,186 @@
+import re
+import time
+from urllib.parse import quote, unquote
+
+from classifier import FileClassifier, PathRules, parse_rules, relative_path, REGEX_RULE_PREFIX
+
+# 子路径默认的同步间隔（分钟）
+DEFAULT_REFRESH_MINUTES = 60
+# AList 的 WebDAV 路径前缀，webhook 推送的路径可以带也可以不带
+WEBDAV_PREFIX = '/dav'
+# 设置页面中每行一个子路径：路径 | 间隔（分钟） | 排除规则（多条用 ; 分隔），后两项可省略
+FIELD_SEPARATOR = '|'
+RULE_SEPARATOR = ';'
+
+
+def normalize_subpath(path):
+    """
+    子路径统一为相对于 rootpath、以 / 分隔、不以 / 开头或结尾的形式，根目录自身为空字符串。
+    """
+    parts = [part for part in path.strip().replace('\\', '/').split('/') if part and part != '.']
+    if '..' in parts:
+        raise ValueError(f"子路径不能包含 ..: {path}")
+    return '/'.join(parts)
+
+
+def parse_subpaths(text):
+    """
+    解析设置页面中的子路径文本（每行一个，# 开头为注释），返回
+    [{'path', 'refresh_minutes', 'exclude_rules'}] 列表，格式错误时抛出 ValueError。
+    """
+    subpaths = []
+    seen = set()
+    for number, line in enumerate((text or '').splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = [field.strip() for field in line.split(FIELD_SEPARATOR, 2)]
+        path = normalize_subpath(fields[0])
+        refresh_minutes = DEFAULT_REFRESH_MINUTES
+        if len(fields) > 1 and fields[1]:
+            if not fields[1].isdigit() or int(fields[1]) <= 0:
+                raise ValueError(f"第 {number} 行的同步间隔必须是正整数（分钟）: {fields[1]}")
+            refresh_minutes = int(fields[1])
+        rules = [rule.strip() for rule in fields[2].split(RULE_SEPARATOR)] if len(fields) > 2 else []
+        rules = [rule for rule in rules if rule]
+        PathRules(rules)
+        if path in seen:
+            raise ValueError(f"第 {number} 行的子路径重复: {path or '/'}")
+        seen.add(path)
+        subpaths.append({'path': path, 'refresh_minutes': refresh_minutes, 'exclude_rules': '\n'.join(rules)})
+    return subpaths
+
+
+def format_subpaths(subpaths):
+    """
+    parse_subpaths 的逆操作，用于在设置页面中显示。
+    """
+    lines = []
+    for subpath in subpaths:
+        line = f"{subpath['path'] or '/'} {FIELD_SEPARATOR} {subpath['refresh_minutes']}"
+        rules = parse_rules(subpath.get('exclude_rules'))
+        if rules:
+            line += f" {FIELD_SEPARATOR} {(RULE_SEPARATOR + ' ').join(rules)}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def subpath_directory(rootpath, path):
+    """
+    子路径在 WebDAV 上的目录，与遍历得到的目录 href 一样经过 URL 编码并以 / 结尾；根目录返回 rootpath 本身。
+    """
+    if not path:
+        return rootpath
+    return quote(f"{rootpath.rstrip('/')}/{path}/")
+
+
+def rootpath_relative(path, rootpath):
+    """
+    把 AList 路径（/电视剧/xxx）或 WebDAV 路径（/dav/电视剧/xxx）转换为相对于 rootpath 的子路径，
+    不在 rootpath 下时返回 None。
+    """
+    path = '/' + normalize_subpath(path)
+    if path != WEBDAV_PREFIX and not path.startswith(WEBDAV_PREFIX + '/'):
+        path = WEBDAV_PREFIX + path.rstrip('/')
+    root = '/' + normalize_subpath(rootpath)
+    if path != root and not path.startswith(root.rstrip('/') + '/'):
+        return None
+    return relative_path(path, root)
+
+
+def is_due(subpath, now):
+    last_synced_at = subpath.get('last_synced_at')
+    return not last_synced_at or now - last_synced_at >= subpath['refresh_minutes'] * 60
+
+
+def _is_inside(path, parent):
+    return not parent or path.startswith(parent + '/')
+
+
+class CrawlTarget:
+    """
+    一次运行中需要遍历的一棵子树：directory 为遍历的起点，classifier 为该子树使用的分类器，
+    subpath 为对应的子路径记录（未设置子路径时为 None）。
+
+    forced 为 True 时（webhook 推送的目录）无论刷新方式是否为定向刷新，都会刷新其根目录。
+    skipped 为遍历时跳过的嵌套子路径的目录（解码后的完整路径），这些目录的索引不会因本次遍历而更新。
+    """
+
+    def __init__(self, directory, classifier, subpath=None, forced=False, skipped=()):
+        self.directory = directory
+        self.classifier = classifier
+        self.subpath = subpath
+        self.forced = forced
+        self.skipped = list(skipped)
+
+    @property
+    def label(self):
+        if self.subpath is None:
+            return unquote(self.directory)
+        return self.subpath['path'] or '/'
+
+
+def _subtree_classifier(script_config, classifier, global_rules, rules):
+    # 没有额外的规则时沿用全局分类器
+    if rules == global_rules:
+        return classifier
+    return FileClassifier(dict(script_config, exclude_rules=rules))
+
+
+def plan_crawl_targets(config, script_config, classifier, subpaths, now=None, full=False):
+    """
+    根据配置的子路径计算本次需要遍历的子树。
+
+    - 没有子路径或 full 为 True 时遍历整个 rootpath，使用全局的 classifier
+    - 否则只遍历到期的子路径（距上次同步超过其同步间隔），未被任何子路径覆盖的目录不再遍历；
+      每个子路径使用全局排除规则加上自己的排除规则，并跳过嵌套在其中、单独设置了子路径的目录，
+      因此每个目录只按离它最近的子路径的间隔同步
+
+    规则均匹配相对于 rootpath 的路径。返回 CrawlTarget 列表，没有到期的子路径时为空列表。
+    """
+    if full or not subpaths:
+        return [CrawlTarget(config['rootpath'], classifier)]
+
+    now = now if now is not None else time.time()
+    global_rules = parse_rules(script_config.get('exclude_rules'))
+    targets = []
+    for subpath in subpaths:
+        if not is_due(subpath, now):
+            continue
+        nested = [other['path'] for other in subpaths
+                  if other['path'] != subpath['path'] and _is_inside(other['path'], subpath['path'])]
+        rules = (global_rules + parse_rules(subpath.get('exclude_rules'))
+                 + [REGEX_RULE_PREFIX + '^' + re.escape(path) + '/$' for path in nested])
+        targets.append(CrawlTarget(subpath_directory(config['rootpath'], subpath['path']),
+                                   _subtree_classifier(script_config, classifier, global_rules, rules), subpath,
+                                   skipped=[unquote(subpath_directory(config['rootpath'], path)) for path in nested]))
+    return targets
+
+
+def plan_path_targets(config, script_config, classifier, subpaths, paths):
+    """
+    webhook 推送的目录（相对于 rootpath）对应的遍历目标，不考虑子路径的同步间隔：
+
+    - 嵌套在另一个推送目录中的目录不再单独遍历
+    - 目录位于某个子路径中时，使用全局排除规则加上离它最近的子路径的排除规则
+    - 目录自身或其上级被排除规则匹配时跳过
+
+    返回 (CrawlTarget 列表, 被排除而跳过的目录列表)。
+    """
+    paths = sorted(set(paths))
+    global_rules = parse_rules(script_config.get('exclude_rules'))
+    targets, excluded = [], []
+    for path in paths:
+        if any(other != path and _is_inside(path, other) for other in paths):
+            continue
+        owners = [subpath for subpath in subpaths if subpath['path'] == path or _is_inside(path, subpath['path'])]
+        owner = max(owners, key=lambda subpath: len(subpath['path'])) if owners else None
+        rules = global_rules + (parse_rules(owner.get('exclude_rules')) if owner else [])
+        target_classifier = _subtree_classifier(script_config, classifier, global_rules, rules)
+        parts = path.split('/') if path else []
+        if target_classifier.exclude and any(target_classifier.is_excluded_directory('/'.join(parts[:i + 1]))
+                                             for i in range(len(parts))):
+            excluded.append(path)
+            continue
+        targets.append(CrawlTarget(subpath_directory(config['rootpath'], path), target_classifier, forced=True))
+    return targets, excluded
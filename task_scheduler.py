@@ -1,25 +1,29 @@
 import subprocess
 import os
-import sys
 import uuid  # 用于生成唯一的 task_id
 
-CRON_BACKUP_FILE = "/config/cron.bak"  # 备份文件路径
+from cron_expression import validate_cron_expression
+from db_handler import DBHandler
+from job_queue import JobQueue
 
+CRON_BACKUP_FILE = "/config/cron.bak"  # 旧版本的 crontab 备份文件路径
 
-# 获取当前的 crontab 任务列表
+# 任务模式及其对应的校验扫描模式（strm_creation 运行 main.py）
+TASK_MODES = {
+    'strm_creation': None,
+    'strm_validation_quick': 'quick',
+    'strm_validation_slow': 'slow',
+    'strm_validation_index': 'index'
+}
+
+
+# 获取当前的 crontab 任务列表（仅用于迁移旧版本的任务）
 def get_cron_jobs():
     result = subprocess.run(['crontab', '-l'], stdout=subprocess.PIPE, text=True)
     cron_jobs = result.stdout.strip().split('\n') if result.stdout else []
     return cron_jobs
 
 
-# 备份当前的 cron 任务到 /config/cron.bak
-def backup_cron_jobs(cron_jobs):
-    cron_data = "\n".join(cron_jobs)
-    with open(CRON_BACKUP_FILE, 'w') as f:
-        f.write(cron_data)
-
-
 # 从备份文件中读取 cron 任务
 def get_cron_jobs_from_backup():
     if os.path.exists(CRON_BACKUP_FILE):
@@ -66,122 +70,138 @@ def extract_task_info(job_line):
     return task_info
 
 
-def list_tasks_in_cron():
-    cron_jobs = get_cron_jobs()
-    program_managed_tasks = []
-    for job in cron_jobs:
-        if "# task_id=" in job and "config_id=" in job:
-            task_info = extract_task_info(job)
-            program_managed_tasks.append(task_info)
-    return program_managed_tasks
-
-
-def add_tasks_to_cron(task_name, cron_time, config_ids, task_mode, is_enabled=True):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
+def list_tasks():
+    """
+    获取所有定时任务，附带界面显示用的间隔类型和说明。
+    """
+    db_handler = DBHandler()
+    try:
+        tasks = db_handler.get_scheduled_tasks()
+    finally:
+        db_handler.close()
+
+    for task in tasks:
+        task['config_id'] = str(task['config_id'])
+        task['is_enabled'] = bool(task['is_enabled'])
+        interval_type, interval_value, description = parse_cron_time(task['cron_time'])
+        task['interval_type'] = interval_type
+        task['interval_value'] = interval_value
+        task['interval_description'] = description
+    return tasks
+
+
+def add_tasks(task_name, cron_time, config_ids, task_mode, is_enabled=True):
+    if task_mode not in TASK_MODES:
+        raise ValueError('不支持的任务模式')
+    validate_cron_expression(cron_time)
+
+    db_handler = DBHandler()
     task_ids = []
-    cron_jobs = get_cron_jobs()
-
-    for config_id in config_ids:
-        task_id = str(uuid.uuid4())
-
-        commands = []
-        if task_mode == 'strm_creation':
-            cmd_main = f'cd "{script_dir}" && /usr/local/bin/python3.9 "{script_dir}/main.py" {config_id} {task_id}'
-            commands.append(cmd_main)
-        elif task_mode == 'strm_validation_quick':
-            cmd_validator = f'cd "{script_dir}" && /usr/local/bin/python3.9 "{script_dir}/strm_validator.py" {config_id} quick {task_id}'
-            commands.append(cmd_validator)
-        elif task_mode == 'strm_validation_slow':
-            cmd_validator = f'cd "{script_dir}" && /usr/local/bin/python3.9 "{script_dir}/strm_validator.py" {config_id} slow {task_id}'
-            commands.append(cmd_validator)
-        else:
-            raise ValueError('不支持的任务模式')
-
-        command = ' && '.join(commands)
-        cron_entry = f"{cron_time} {command} # task_id={task_id} task_name={task_name} config_id={config_id} task_mode={task_mode}"
-        if not is_enabled:
-            cron_entry = f"# {cron_entry}"
-        cron_jobs.append(cron_entry)
-        task_ids.append(task_id)
-
-    update_crontab(cron_jobs)
+    try:
+        for config_id in config_ids:
+            task_id = str(uuid.uuid4())
+            db_handler.add_scheduled_task(task_id, task_name, cron_time, config_id, task_mode, is_enabled)
+            task_ids.append(task_id)
+    finally:
+        db_handler.close()
     return task_ids
 
 
-def update_tasks_in_cron(task_ids, cron_time=None, config_ids=None, task_mode=None, task_name=None, is_enabled=None):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    cron_jobs = get_cron_jobs()
-    updated_jobs = []
-    task_ids_set = set(task_ids)
-    task_found = False
-
-    for job in cron_jobs:
-        is_job_enabled = not job.strip().startswith('#')
-        clean_job = job.lstrip('# ').strip()
-        task_info = extract_task_info(clean_job)
-        current_task_id = task_info.get('task_id')
-        if current_task_id in task_ids_set:
-            task_found = True
-            if cron_time is None:
-                cron_time = task_info['cron_time']
-            if task_name is None:
-                task_name = task_info.get('task_name', 'Updated Task')
-            if config_ids is None:
-                config_id = task_info.get('config_id')
-            else:
-                index = task_ids.index(current_task_id)
-                config_id = config_ids[index] if index < len(config_ids) else task_info.get('config_id')
-            if task_mode is None:
-                task_mode = task_info.get('task_mode')
-            if is_enabled is None:
-                is_enabled = is_job_enabled
-
-            commands = []
-            if task_mode == 'strm_creation':
-                cmd_main = f'cd "{script_dir}" && /usr/local/bin/python3.9 "main.py" {config_id} {current_task_id}'
-                commands.append(cmd_main)
-            elif task_mode == 'strm_validation_quick':
-                cmd_validator = f'cd "{script_dir}" && /usr/local/bin/python3.9 "strm_validator.py" {config_id} quick {current_task_id}'
-                commands.append(cmd_validator)
-            elif task_mode == 'strm_validation_slow':
-                cmd_validator = f'cd "{script_dir}" && /usr/local/bin/python3.9 "strm_validator.py" {config_id} slow {current_task_id}'
-                commands.append(cmd_validator)
-            else:
-                raise ValueError('不支持的任务模式')
-
-            command = ' && '.join(commands)
-            job_line = f"{cron_time} {command} # task_id={current_task_id} task_name={task_name} config_id={config_id} task_mode={task_mode}"
-            if not is_enabled:
-                job_line = f"# {job_line}"
-            updated_jobs.append(job_line)
-        else:
-            updated_jobs.append(job)
-
-    if not task_found:
-        raise ValueError('未找到指定的任务ID')
-
-    update_crontab(updated_jobs)
-
-
-def delete_tasks_from_cron(task_ids):
-    cron_jobs = get_cron_jobs()
-    task_ids_set = set(task_ids)
-    updated_jobs = []
-    for job in cron_jobs:
-        clean_job = job.lstrip('# ').strip()
-        task_info = extract_task_info(clean_job)
-        current_task_id = task_info.get('task_id')
-        if current_task_id not in task_ids_set:
-            updated_jobs.append(job)
-    update_crontab(updated_jobs)
-
-
-def update_crontab(cron_jobs):
-    cron_data = "\n".join(cron_jobs)
-    subprocess.run(f'(echo "{cron_data}") | crontab -', shell=True)
-
-    # 同步到备份文件
-    backup_cron_jobs(cron_jobs)
+def update_tasks(task_ids, cron_time=None, config_ids=None, task_mode=None, task_name=None, is_enabled=None):
+    if task_mode is not None and task_mode not in TASK_MODES:
+        raise ValueError('不支持的任务模式')
+    if cron_time is not None:
+        validate_cron_expression(cron_time)
+
+    db_handler = DBHandler()
+    try:
+        tasks = {task['task_id']: task for task in db_handler.get_scheduled_tasks()}
+        if not any(task_id in tasks for task_id in task_ids):
+            raise ValueError('未找到指定的任务ID')
+
+        for index, task_id in enumerate(task_ids):
+            task = tasks.get(task_id)
+            if task is None:
+                continue
+            config_id = task['config_id']
+            if config_ids is not None and index < len(config_ids):
+                config_id = config_ids[index]
+            db_handler.update_scheduled_task(
+                task_id,
+                task_name if task_name is not None else task['task_name'],
+                cron_time if cron_time is not None else task['cron_time'],
+                config_id,
+                task_mode if task_mode is not None else task['task_mode'],
+                is_enabled if is_enabled is not None else task['is_enabled']
+            )
+    finally:
+        db_handler.close()
+
+
+def delete_tasks(task_ids):
+    db_handler = DBHandler()
+    try:
+        db_handler.delete_scheduled_tasks(task_ids)
+    finally:
+        db_handler.close()
+
+
+def request_task_run(task_id):
+    """
+    将任务加入运行队列，由调度守护进程执行。同一任务已在排队时合并为一次运行。
+    返回 (job_id, 是否与已有的排队任务合并)。
+    """
+    task = next((task for task in list_tasks() if task['task_id'] == task_id), None)
+    if task is None:
+        raise ValueError(f"找不到 task_id 为 {task_id} 的任务。")
+
+    job_queue = JobQueue()
+    try:
+        return job_queue.enqueue(int(task['config_id']), task['task_mode'], task_id, source='manual')
+    finally:
+        job_queue.close()
+
+
+def migrate_crontab(logger=None):
+    """
+    将旧版本写在 crontab（以及备份文件 /config/cron.bak）中的任务导入 scheduled_tasks 表，
+    导入后从 crontab 中删除这些任务，并将备份文件重命名，避免任务被 cron 和调度守护进程重复运行。
+    """
+    try:
+        cron_jobs = get_cron_jobs()
+    except FileNotFoundError:
+        # 没有安装 cron
+        cron_jobs = []
+    managed_jobs = [job for job in cron_jobs if "# task_id=" in job and "config_id=" in job]
+    backup_jobs = [job for job in get_cron_jobs_from_backup() if "# task_id=" in job and "config_id=" in job]
+    if not managed_jobs and not backup_jobs:
+        return 0
+
+    db_handler = DBHandler()
+    migrated = 0
+    try:
+        existing = {task['task_id'] for task in db_handler.get_scheduled_tasks()}
+        for job in managed_jobs + backup_jobs:
+            task_info = extract_task_info(job)
+            task_id = task_info.get('task_id')
+            if not task_id or task_id in existing or task_info['task_mode'] not in TASK_MODES:
+                continue
+            db_handler.add_scheduled_task(task_id, task_info.get('task_name', ''), task_info['cron_time'],
+                                          task_info['config_id'], task_info['task_mode'], task_info['is_enabled'])
+            existing.add(task_id)
+            migrated += 1
+    finally:
+        db_handler.close()
+
+    if managed_jobs:
+        remaining_jobs = [job for job in cron_jobs if job not in managed_jobs]
+        subprocess.run(['crontab', '-'], input="\n".join(remaining_jobs) + "\n", text=True)
+    if os.path.exists(CRON_BACKUP_FILE):
+        os.replace(CRON_BACKUP_FILE, CRON_BACKUP_FILE + '.migrated')
+
+    if logger:
+        logger.info(f"已从 crontab 导入 {migrated} 个定时任务")
+    return migrated
 
 
 # 将间隔类型转换为 cron 时间
@@ -219,6 +239,8 @@ def determine_task_mode(command):
             return 'strm_validation_quick'
         elif 'slow' in command:
             return 'strm_validation_slow'
+        elif ' index ' in command:
+            return 'strm_validation_index'
     return None
 
 
@@ -266,22 +288,3 @@ def parse_cron_time(cron_time):
         return interval_type, interval_value, description
     else:
         return 'custom', '', '自定义时间'
-
-
-def run_task_immediately(task_id):
-    tasks = list_tasks_in_cron()
-
-    task_to_run = next((task for task in tasks if task.get('task_id') == task_id), None)
-
-    if task_to_run:
-        command = task_to_run.get('command')
-        if not command:
-            raise ValueError('找不到该任务的命令，无法运行。')
-
-        try:
-            subprocess.Popen(command, shell=True)
-            print(f"任务 {task_id} 已立即运行。")
-        except Exception as e:
-            print(f"运行任务 {task_id} 时发生错误: {e}")
-    else:
-        raise ValueError(f"找不到 task_id 为 {task_id} 的任务。")
@@ -0,0 +1,98 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# 添加项目根目录和 benchmark 目录到 sys.path，以便导入项目模块和模拟的 AList 服务
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (project_root, os.path.join(project_root, 'benchmark')):
+    if path not in sys.path:
+        sys.path.append(path)
+
+from fake_alist_server import FakeAListServer, FakeTree
+
+CONFIG_ID = 1
+FAILING_DIRECTORY = '/目录 000/目录 001'
+
+
+class IncrementalCrawlTest(unittest.TestCase):
+    """
+    增量遍历中某个目录列表失败后，下一次增量遍历仍会重新列出该目录，而不是因修改时间一致而沿用过时的子树。
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='alist_strm_test_')
+        self.old_cwd = os.getcwd()
+        self.old_env = dict(os.environ)
+        os.chdir(self.work_dir)
+        os.environ.update(DB_FILE=os.path.join(self.work_dir, 'config.db'),
+                          INDEX_DB_FILE=os.path.join(self.work_dir, 'index.db'),
+                          INVENTORY_DB_FILE=os.path.join(self.work_dir, 'inventory.db'))
+        self.tree = FakeTree(depth=2, dirs_per_level=2, files_per_dir=5)
+        self.server = FakeAListServer(self.tree).start()
+        self.target_directory = os.path.join(self.work_dir, 'strm')
+        os.makedirs(self.target_directory)
+
+        from db_handler import DBHandler
+        db_handler = DBHandler()
+        try:
+            db_handler.initialize_tables()
+            db_handler.cursor.execute(
+                '''INSERT INTO config (config_id, config_name, url, username, password, rootpath, target_directory,
+                   download_enabled, update_mode, download_interval_range, list_backend)
+                   VALUES (?, 'test', ?, 'admin', 'admin', '/dav', ?, 0, 'incremental', '0-0', 'webdav')''',
+                (CONFIG_ID, self.server.url, self.target_directory))
+            db_handler.conn.commit()
+        finally:
+            db_handler.close()
+
+    def tearDown(self):
+        self.server.stop()
+        os.chdir(self.old_cwd)
+        os.environ.clear()
+        os.environ.update(self.old_env)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def add_video(self, directory, name):
+        self.tree.mtime += 60
+        self.tree.directories[directory].append({'name': name, 'is_dir': False, 'size': 300 * 1024 * 1024,
+                                                 'mtime': self.tree.mtime})
+        self.tree._touch_directory(directory)
+
+    def test_failed_listing_is_retried_by_next_incremental_run(self):
+        from main import run_config
+        from remote_index import RemoteIndex
+
+        run_config(CONFIG_ID)
+        index = RemoteIndex()
+        try:
+            # 把完成时间提前，以便区分之后的运行是否更新了它
+            index.conn.execute('UPDATE index_runs SET finished_at = finished_at - 3600 WHERE config_id = ?', (CONFIG_ID,))
+            index.conn.commit()
+            finished_at = index.last_finished_at(CONFIG_ID)
+        finally:
+            index.close()
+
+        self.add_video(FAILING_DIRECTORY, '新视频.mkv')
+        list_directory = self.tree.list
+        self.tree.list = lambda path: None if path.rstrip('/') == FAILING_DIRECTORY else list_directory(path)
+        stats = run_config(CONFIG_ID)
+        self.assertEqual(stats.change_set.list_errors, 1)
+
+        index = RemoteIndex()
+        try:
+            # 索引不完整，运行不记为已完成
+            self.assertEqual(index.get_run(CONFIG_ID)['finished_at'], finished_at)
+        finally:
+            index.close()
+
+        self.tree.list = list_directory
+        stats = run_config(CONFIG_ID)
+        self.assertEqual(stats.change_set.list_errors, 0)
+        self.assertEqual(stats.change_set.added, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.target_directory, FAILING_DIRECTORY.lstrip('/'), '新视频.strm')))
+
+
+if __name__ == '__main__':
+    unittest.main()
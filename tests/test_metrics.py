@@ -0,0 +1,85 @@
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import requests
+
+# 添加项目根目录到 sys.path，以便导入项目模块
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from crawler import DirectoryCrawler
+from listing_backends import make_entry
+from metrics import MetricsStore, RunMetrics
+
+
+class FlakyBackend:
+    """
+    每个目录的前 failures 次列表请求返回 HTTP 错误 status 的列表后端。
+    """
+
+    name = 'flaky'
+
+    def __init__(self, failures, status=503):
+        self.failures = failures
+        self.status = status
+        self.calls = 0
+
+    def list_directory(self, directory):
+        self.calls += 1
+        if self.calls <= self.failures:
+            response = requests.Response()
+            response.status_code = self.status
+            raise requests.HTTPError(f'{self.status} Server Error', response=response)
+        return [make_entry(f'{directory}视频.mkv', 1024, 'Tue, 14 Nov 2023 22:13:20 GMT', False)]
+
+
+class RetriesCounterTest(unittest.TestCase):
+    """
+    限流或 5xx 后重试的列表请求计入 retries，并与其他计数一起出现在 /api/runs 和 /metrics 中。
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='alist_strm_test_')
+        self.db_file = os.path.join(self.work_dir, 'config.db')
+        self.logger = logging.getLogger('test_metrics')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def crawl(self, backend):
+        metrics = RunMetrics('strm', 1)
+        crawler = DirectoryCrawler(backend, self.logger, workers=1, metrics=metrics, retry_delay=0)
+        files = []
+        change_set = crawler.crawl('/dav/', on_file=lambda entry, directory: files.append(entry['name']))
+        return metrics, change_set, files
+
+    def test_listing_retried_after_server_error(self):
+        metrics, change_set, files = self.crawl(FlakyBackend(failures=2))
+        self.assertEqual(files, ['/dav/视频.mkv'])
+        self.assertEqual(change_set.list_errors, 0)
+        self.assertEqual(metrics.counters['retries'], 2)
+        self.assertEqual(metrics.counters['list_requests'], 3)
+
+        metrics.save('success', db_file=self.db_file)
+        store = MetricsStore(self.db_file)
+        try:
+            self.assertEqual(store.list_runs()[0]['data']['counters']['retries'], 2)
+            self.assertIn('alist_strm_last_run_counter{config_id="1",run_type="strm",name="retries"} 2',
+                          store.render_prometheus())
+        finally:
+            store.close()
+
+    def test_client_error_is_not_retried(self):
+        metrics, change_set, files = self.crawl(FlakyBackend(failures=1, status=404))
+        self.assertEqual(files, [])
+        self.assertEqual(change_set.list_errors, 1)
+        self.assertEqual(metrics.counters['retries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
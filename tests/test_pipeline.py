@@ -0,0 +1,48 @@
+import os
+import sys
+import threading
+import unittest
+
+# 添加项目根目录到 sys.path，以便导入项目模块
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from pipeline import RemoteFileLister
+
+
+class EndlessCrawler:
+    """
+    不断产出文件的遍历器，直到 stop 被设置。
+    """
+
+    def __init__(self):
+        self.stopped = False
+
+    def crawl(self, root_directory, on_directory=None, on_file=None, index_session=None, incremental=False, stop=None):
+        count = 0
+        while not stop.is_set():
+            on_file({'name': f'{root_directory}{count}.mkv'}, root_directory)
+            count += 1
+        self.stopped = True
+
+
+class RemoteFileListerTest(unittest.TestCase):
+
+    def test_consumer_error_stops_crawl_thread(self):
+        crawler = EndlessCrawler()
+        lister = RemoteFileLister(crawler, '/dav/', max_pending=2)
+
+        def consume():
+            for index, _ in enumerate(lister):
+                if index == 5:
+                    raise RuntimeError('写入 .strm 失败')
+
+        with self.assertRaises(RuntimeError):
+            consume()
+        self.assertTrue(crawler.stopped)
+        self.assertFalse([thread for thread in threading.enumerate() if thread.name == 'remote-file-lister'])
+
+
+if __name__ == '__main__':
+    unittest.main()
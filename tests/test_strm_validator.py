@@ -0,0 +1,131 @@
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+# 添加项目根目录和 benchmark 目录到 sys.path，以便导入项目模块和模拟的 AList 服务
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (project_root, os.path.join(project_root, 'benchmark')):
+    if path not in sys.path:
+        sys.path.append(path)
+
+from fake_alist_server import FakeAListServer, FakeTree
+
+CONFIG_ID = 1
+
+
+class QuickValidationJobTest(unittest.TestCase):
+    """
+    快扫依赖的远程文件索引完成时间：通过调度守护进程运行快扫时，索引过期会在校验任务的租约下重建，
+    而不是被租约挡住；只同步子路径的运行只记录该子树的完成时间，不会让整个索引显得未过期。
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='alist_strm_test_')
+        self.old_cwd = os.getcwd()
+        self.old_env = dict(os.environ)
+        os.chdir(self.work_dir)
+        os.environ.update(DB_FILE=os.path.join(self.work_dir, 'config.db'),
+                          INDEX_DB_FILE=os.path.join(self.work_dir, 'index.db'),
+                          INVENTORY_DB_FILE=os.path.join(self.work_dir, 'inventory.db'))
+        self.tree = FakeTree(depth=1, dirs_per_level=2, files_per_dir=5)
+        self.server = FakeAListServer(self.tree).start()
+        self.target_directory = os.path.join(self.work_dir, 'strm')
+        os.makedirs(self.target_directory)
+
+        from db_handler import DBHandler
+        db_handler = DBHandler()
+        try:
+            db_handler.initialize_tables()
+            db_handler.cursor.execute(
+                '''INSERT INTO config (config_id, config_name, url, username, password, rootpath, target_directory,
+                   download_enabled, update_mode, download_interval_range, list_backend)
+                   VALUES (?, 'test', ?, 'admin', 'admin', '/dav', ?, 0, 'incremental', '0-0', 'webdav')''',
+                (CONFIG_ID, self.server.url, self.target_directory))
+            db_handler.conn.commit()
+        finally:
+            db_handler.close()
+
+    def tearDown(self):
+        self.server.stop()
+        os.chdir(self.old_cwd)
+        os.environ.clear()
+        os.environ.update(self.old_env)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def expire_index(self):
+        from remote_index import RemoteIndex
+        index = RemoteIndex()
+        try:
+            index.start_run(CONFIG_ID)
+            index.finish_run(CONFIG_ID)
+            index.conn.execute('UPDATE index_runs SET last_run = ?, finished_at = ? WHERE config_id = ?',
+                               (int(time.time()) - 48 * 3600, int(time.time()) - 48 * 3600, CONFIG_ID))
+            index.conn.commit()
+        finally:
+            index.close()
+
+    def test_quick_scan_rebuilds_expired_index_under_job_lease(self):
+        from invalid_manifest import iter_manifest
+        from job_queue import JOB_DONE
+        from remote_index import RemoteIndex
+        from scheduler_daemon import Scheduler
+
+        self.expire_index()
+        stale_file = os.path.join(self.target_directory, '已删除的视频.strm')
+        with open(stale_file, 'w', encoding='utf-8') as f:
+            f.write(f'{self.server.url}/d/已删除的视频.mkv')
+        started_at = time.time()
+
+        scheduler = Scheduler(logging.getLogger('test_scheduler'), workers=1, max_jitter=0)
+        try:
+            job_id, _ = scheduler.job_queue.enqueue(CONFIG_ID, 'strm_validation_quick')
+            scheduler.dispatch()
+            scheduler.executor.shutdown(wait=True)
+            scheduler._record_finished()
+            jobs = {job['job_id']: job for job in scheduler.job_queue.list_jobs()}
+        finally:
+            scheduler.job_queue.close()
+            scheduler.db_handler.close()
+
+        self.assertEqual(jobs[job_id]['state'], JOB_DONE)
+        index = RemoteIndex()
+        try:
+            self.assertGreaterEqual(index.last_finished_at(CONFIG_ID), int(started_at))
+        finally:
+            index.close()
+        # 重建时生成了所有视频的 .strm，只有云端不存在的文件被记为无效
+        self.assertEqual([os.path.join(self.target_directory, path) for path in iter_manifest(CONFIG_ID)], [stale_file])
+
+    def test_subpath_run_does_not_refresh_whole_index(self):
+        from db_handler import DBHandler
+        from main import run_config
+        from remote_index import RemoteIndex, subtree_finished_at
+        from subpaths import parse_subpaths
+
+        self.expire_index()
+        db_handler = DBHandler()
+        try:
+            db_handler.set_config_subpaths(CONFIG_ID, parse_subpaths('目录 000 | 60'))
+        finally:
+            db_handler.close()
+        started_at = int(time.time())
+
+        run_config(CONFIG_ID)
+
+        index = RemoteIndex()
+        try:
+            # 只同步了一个子路径，快扫仍需重建索引，但该子树本身记为已完成
+            self.assertLess(index.last_finished_at(CONFIG_ID), started_at)
+            subtree_runs = index.get_subtree_runs(CONFIG_ID)
+            self.assertGreaterEqual(subtree_finished_at(subtree_runs, '/dav/目录 000/文件 0000.mkv'), started_at)
+            self.assertEqual(subtree_finished_at(subtree_runs, '/dav/目录 001/文件 0000.mkv'), 0)
+        finally:
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()